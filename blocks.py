@@ -0,0 +1,157 @@
+"""Compiled block geometry of a model.
+
+The velocity of a layer is defined on "blocks": the layer is cut at the x of
+every node of its top and bottom boundaries and velocity lines, and each block
+is a vertical trapezoid with linear boundaries and velocity along x on its top
+and bottom. A `BlockTable` holds the corners of all the blocks of a model,
+worked out once per model revision and shared by everything that reads the
+velocity of the model(grids, sections, point queries, meshes, poission
+ratios).
+"""
+from collections import namedtuple
+
+import numpy as np
+
+
+# Blocks of a layer. `x` are the edges of the blocks(len(x)-1 blocks), the
+# others are the depth/velocity of the top and bottom of the layer at `x`, and
+# the poission ratio of every block(None if not bound to the layer).
+LayerBlocks = namedtuple('LayerBlocks', ['x', 'y_top', 'y_bot', 'v_top', 'v_bot', 'pois'])
+
+
+def _readonly(a):
+    a.flags.writeable = False
+    return a
+
+
+def compile_layer(ly_cur, ly_next):
+    """Get the LayerBlocks of the layer `ly_cur`, whose bottom boundary is
+    the top one of `ly_next`."""
+    x_top, x_bot = ly_cur.depth.x, ly_next.depth.x
+    y_top, y_bot = ly_cur.depth.y, ly_next.depth.y
+    x_v_top, x_v_bot = ly_cur.v_top.x, ly_cur.v_bot.x
+    v_top, v_bot = ly_cur.v_top.y, ly_cur.v_bot.y
+    x_all = np.unique(np.hstack([x_top, x_bot, x_v_top, x_v_bot]))
+    pois = None
+    if ly_cur.pois is not None:
+        pois = np.interp((x_all[:-1]+x_all[1:])/2.0, ly_cur.pois['x'], ly_cur.pois['y'])
+    return LayerBlocks(*[None if a is None else _readonly(a) for a in (
+        x_all,
+        np.interp(x_all, x_top, y_top),
+        np.interp(x_all, x_bot, y_bot),
+        np.interp(x_all, x_v_top, v_top),
+        np.interp(x_all, x_v_bot, v_bot),
+        pois)])
+
+
+class BlockTable(object):
+    """Immutable table of the blocks of all layers(but the end layer) of a
+    model. `table[ilayer]` is the LayerBlocks of a layer, the blocks of all
+    layers are numbered in a row from 0, starting at `offsets[ilayer]` for a
+    layer.
+    Use `build` to get a table up to date with a model, which only compiles
+    layers again whose nodes or poission ratios changed since the last table."""
+    def __init__(self, layers, keys=(), pois=(), model_key=None):
+        self.layers = tuple(layers)
+        # What each layer and the whole table was compiled from, see `build`.
+        # The poission ratios are kept so that their ids in the keys are not
+        # reused.
+        self._keys = tuple(keys)
+        self._pois = tuple(pois)
+        self._model_key = model_key
+        self._padded = None
+        counts = [max(len(lb.x)-1, 0) for lb in self.layers]
+        self.offsets = _readonly(np.concatenate([[0], np.cumsum(counts, dtype=int)]))
+
+    @staticmethod
+    def layer_key(ly_cur, ly_next):
+        """Key of what the blocks of a layer are compiled from: the revisions
+        of its parts and of the top of the next layer, and its poission
+        ratios."""
+        parts = tuple(ly_cur[:3]) + (ly_next.depth,)
+        return tuple((tl._store, tl._slot, tl.revision) for tl in parts) + (id(ly_cur.pois),)
+
+    @classmethod
+    def build(cls, model, old=None):
+        """Get the block table of the model, reusing the layers of the `old`
+        table which have not changed, or `old` itself if nothing changed."""
+        # Any change of nodes or layers moves the revision of the store
+        pois = tuple(ly.pois for ly in model)
+        model_key = (model.store, model.revision) + tuple(map(id, pois))
+        if old is not None and old._model_key == model_key:
+            return old
+        nlayer = len(model) - 1
+        keys = tuple(cls.layer_key(model[i], model[i+1]) for i in range(nlayer))
+        if old is not None and old._keys == keys:
+            return cls(old.layers, keys, pois, model_key)
+        reuse = {} if old is None else dict(zip(old._keys, old.layers))
+        layers = []
+        for ily, key in enumerate(keys):
+            lb = reuse.get(key)
+            if lb is None:
+                lb = compile_layer(model[ily], model[ily+1])
+            layers.append(lb)
+        return cls(layers, keys, pois, model_key)
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __getitem__(self, ilayer):
+        return self.layers[ilayer]
+
+    def __iter__(self):
+        return iter(self.layers)
+
+    @property
+    def nblock(self):
+        return int(self.offsets[-1])
+
+    def locate(self, ilayer, x):
+        """Index of the block of the `ilayer`-th layer each x falls in. A point
+        on the edge of 2 blocks belongs to the right one, points out of the
+        layer go to the first/last block."""
+        edges = self.layers[ilayer].x
+        return np.clip(np.searchsorted(edges, x, side='right') - 1, 0, len(edges)-2)
+
+    def padded(self):
+        """Arrays of all the layers padded to the same length n, the most
+        edges of a layer(at least 2): (x, values, pois, nedge). x, in the
+        shape of (nlayer, n), is padded with inf; values, stacking y_top,
+        y_bot, v_top and v_bot in the shape of (4, nlayer, n), and pois are
+        padded with NaN. `nedge` is the number of edges of every layer. Built
+        on the first call."""
+        if self._padded is None:
+            nedge = np.array([len(lb.x) for lb in self.layers], dtype=int)
+            n = max(2, nedge.max(initial=0))
+            x = np.full((len(self.layers), n), np.inf)
+            values = np.full((4, len(self.layers), n), np.nan)
+            pois = np.full((len(self.layers), n), np.nan)
+            for ily, lb in enumerate(self.layers):
+                x[ily, :len(lb.x)] = lb.x
+                values[:, ily, :len(lb.x)] = lb[1:5]
+                if lb.pois is not None:
+                    pois[ily, :len(lb.pois)] = lb.pois
+            self._padded = tuple(map(_readonly, (x, values, pois, nedge)))
+        return self._padded
+
+    def at(self, x):
+        """Values of all the layers at a single `x`: (y_top, y_bot, v_top,
+        v_bot, pois), arrays of length nlayer. Values are the same as
+        `np.interp` on every layer gives, and pois is that of the block `x`
+        falls in(see `locate`), but all the layers are done at once."""
+        x_all, values, pois, nedge = self.padded()
+        rows = np.arange(len(x_all))
+        # the last edge on or left to x, as found by `np.interp`
+        i = np.count_nonzero(x_all <= x, axis=1) - 1
+        j = np.clip(i, 0, np.maximum(nedge-2, 0))
+        x0, x1 = x_all[rows, j], x_all[rows, j+1]
+        v0, v1 = values[:, rows, j], values[:, rows, j+1]
+        # on an edge, beyond the last edge or before the first edge
+        on_edge = (i >= nedge-1) | (x0 == x) | (i < 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            v = (v1 - v0) / (x1 - x0) * (x - x0) + v0
+        v = np.where(on_edge, values[:, rows, np.maximum(i, 0)], v)
+        return tuple(v) + (pois[rows, j],)
+
+    def __str__(self):
+        return '<BlockTable: %d layers, %d blocks>' %(len(self), self.nblock)
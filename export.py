@@ -0,0 +1,230 @@
+"""Export the velocity grid of a model to files.
+
+The grid is computed and written a tile of rows at a time(see
+`grid.tile_ranges`), so a grid larger than the memory can be exported, under a
+memory ceiling if wanted. Formats:
+
+    npy   - a NumPy .npy file for each field, which `np.load(path,
+            mmap_mode='r')` maps into memory without reading it
+    raw   - a file of little-endian float32 for each field, holding the grid
+            rows one after another
+    ascii - text columns `x z vp [vs pois]`, a line for each grid node
+
+Files of the npy and raw formats are named after the output path with the
+field appended(e.g. grid.npy -> grid_vp.npy, grid_vs.npy), along with a small
+JSON header(grid.json) giving the shape, data type and axes of the grid.
+
+    python export.py examples/v3.in -o grid.npy --nx 2000 --ny 1000
+    python export.py examples/v3.in -o grid.npy --nx 20000 --ny 10000 --max-memory 500 -j 4
+
+Run `python export.py -h` for all the options.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from grid import (TILE_CELLS, compute_grid_to_files, tile_ranges, tile_rows_for,
+    usable_workers)
+from model import Model, ModelManager
+import util
+
+
+# Format of an output file by its extension
+EXTENSIONS = {
+    '.npy': 'npy',
+    '.raw': 'raw',
+    '.bin': 'raw',
+    '.txt': 'ascii',
+    '.dat': 'ascii',
+    '.xyz': 'ascii',
+    }
+FORMATS = ('npy', 'raw', 'ascii')
+# Format of a value in ascii outputs
+ASCII_FMT = '%.6f'
+
+
+def guess_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in EXTENSIONS:
+        raise ValueError('Unknown export format of "%s", use one of %s' %(
+            path, ', '.join(sorted(EXTENSIONS))))
+    return EXTENSIONS[ext]
+
+
+def output_paths(path, fields, fmt):
+    """Paths of the data files written for `fields` and of the JSON header
+    (None for the ascii format)"""
+    if fmt == 'ascii':
+        return [path], None
+    root, ext = os.path.splitext(path)
+    return ['%s_%s%s' %(root, field, ext) for field in fields], root + '.json'
+
+
+def make_header(fmt, fields, paths, dtype, xlim, ylim, nxgrid, nygrid):
+    """Description of the data files of the npy and raw formats"""
+    return dict(
+        format=fmt,
+        dtype=np.dtype(dtype).str,
+        shape=[nygrid, nxgrid],
+        order='C',
+        x=dict(min=float(xlim[0]), max=float(xlim[1]), n=nxgrid),
+        z=dict(min=float(ylim[0]), max=float(ylim[1]), n=nygrid),
+        fields={field: os.path.basename(p) for field, p in zip(fields, paths)},
+        )
+
+
+def export_grid(model_manager, path, xlim=None, ylim=None, nxgrid=None, nygrid=None,
+        fields=None, fmt=None, dtype=np.float32, tile_rows=None, progress=None,
+        workers=1, max_memory=None):
+    """Export the grid of `fields`(see `ModelManager.grid_fields`) over
+    `xlim`, `ylim` with `nxgrid` x `nygrid` nodes, the whole model with the
+    default grid size by default. The format is told by the extension of
+    `path` unless `fmt` is given. Raw files are always little-endian float32,
+    `dtype` sets the data type of npy files. `progress` is called with the
+    fraction of rows written after every tile, it may raise(e.g.
+    `util.Cancelled`) to stop. Files partly written are removed on errors.
+    Tiles take about `max_memory` bytes if given, or `tile_rows` rows. The npy
+    format is computed by `workers` processes, see `compute_grid_to_files`.
+    Return the paths of the files written."""
+    if fmt is None:
+        fmt = guess_format(path)
+    if fmt not in FORMATS:
+        raise ValueError('Invalid export format %r' %(fmt,))
+    if not xlim:
+        xlim = model_manager.model.xlim
+    if not ylim:
+        ylim = model_manager.model.ylim
+    nxgrid = model_manager.NXGRID if nxgrid is None else int(nxgrid)
+    nygrid = model_manager.NYGRID if nygrid is None else int(nygrid)
+    if nxgrid < 1 or nygrid < 1:
+        raise ValueError('Invalid grid size %d x %d' %(nxgrid, nygrid))
+    fields = model_manager.grid_fields(fields)
+    if not fields:
+        raise ValueError('No field to export')
+    dtype = np.dtype('<f4' if fmt == 'raw' else dtype)
+    x = np.linspace(xlim[0], xlim[1], nxgrid)
+    y = np.linspace(ylim[0], ylim[1], nygrid)
+    paths, header_path = output_paths(path, fields, fmt)
+    if max_memory is not None and fmt != 'npy':
+        # ascii tiles are stacked into columns of float64 with the axes
+        extra_bytes = 8 * (4 + len(fields)) if fmt == 'ascii' else 0
+        tile_rows = tile_rows_for(model_manager, nxgrid, max_memory, fields, dtype,
+            extra_bytes=extra_bytes)
+
+    written = []
+    try:
+        if fmt == 'npy':
+            written.extend(paths)
+            compute_grid_to_files(model_manager, x, y, dict(zip(fields, paths)), workers,
+                max_memory, tile_rows, progress, dtype)
+        else:
+            _stream_grid(model_manager, x, y, fields, dtype, fmt, paths, written,
+                tile_ranges(nygrid, nxgrid, tile_rows), progress)
+        if header_path is not None:
+            written.append(header_path)
+            with open(header_path, 'w') as f:
+                json.dump(make_header(fmt, fields, paths, dtype, xlim, ylim, nxgrid, nygrid), f, indent=2)
+    except BaseException:
+        for p in written:
+            if os.path.isfile(p):
+                os.remove(p)
+        raise
+    return written
+
+
+def _stream_grid(model_manager, x, y, fields, dtype, fmt, paths, written, tiles, progress):
+    """Write the grid tile by tile to raw or ascii files in a row"""
+    with contextlib.ExitStack() as stack:
+        files = []
+        for p in paths:
+            files.append(stack.enter_context(open(p, 'w' if fmt == 'ascii' else 'wb')))
+            written.append(p)
+        if fmt == 'ascii':
+            files[0].write('# x z %s\n' %' '.join(fields))
+        for i, (start, stop) in enumerate(tiles):
+            grids = [g for g in model_manager.interp_grid(x, y[start:stop], fields, dtype)
+                if g is not None]
+            if fmt == 'ascii':
+                xx, yy = np.meshgrid(x, y[start:stop])
+                np.savetxt(files[0], np.column_stack(
+                    [xx.ravel(), yy.ravel()] + [g.ravel() for g in grids]), fmt=ASCII_FMT)
+            else:
+                for f, grid in zip(files, grids):
+                    f.write(grid.tobytes())
+            if progress is not None:
+                progress((i+1) / len(tiles))
+
+
+def load_grid(header_path, mmap_mode='r'):
+    """Load the grids exported in the npy or raw format, described by the
+    JSON header at `header_path`. Return (x, z, grids), grids being a dict of
+    arrays by field, memory-mapped unless `mmap_mode` is None."""
+    with open(header_path, 'r') as f:
+        header = json.load(f)
+    folder = os.path.dirname(header_path)
+    x = np.linspace(header['x']['min'], header['x']['max'], header['x']['n'])
+    z = np.linspace(header['z']['min'], header['z']['max'], header['z']['n'])
+    grids = {}
+    for field, name in header['fields'].items():
+        p = os.path.join(folder, name)
+        if header['format'] == 'npy':
+            grids[field] = np.load(p, mmap_mode=mmap_mode)
+        elif mmap_mode is None:
+            grids[field] = np.fromfile(p, dtype=header['dtype']).reshape(header['shape'])
+        else:
+            grids[field] = np.memmap(p, dtype=header['dtype'], mode=mmap_mode,
+                shape=tuple(header['shape']))
+    return x, z, grids
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Export the velocity grid of a v.in file.')
+    parser.add_argument('file', help='v.in file')
+    parser.add_argument('-o', '--output', required=True,
+        help='output path, whose extension(%s) tells the format' %', '.join(sorted(EXTENSIONS)))
+    parser.add_argument('--format', choices=FORMATS, help='output format, overriding the extension')
+    parser.add_argument('--fields', nargs='+', choices=ModelManager.FIELDS,
+        help='fields to export(default: all that can be computed)')
+    parser.add_argument('--nx', type=int, help='number of grid columns(default: %d)' %ModelManager.NXGRID)
+    parser.add_argument('--ny', type=int, help='number of grid rows(default: %d)' %ModelManager.NYGRID)
+    parser.add_argument('--xlim', type=float, nargs=2, metavar=('XMIN', 'XMAX'),
+        help='x range of the grid(default: the whole model)')
+    parser.add_argument('--ylim', type=float, nargs=2, metavar=('YMIN', 'YMAX'),
+        help='depth range of the grid(default: the whole model)')
+    parser.add_argument('--pois', help='poission ratios as copied from r.in, needed to export vs and pois')
+    parser.add_argument('--float64', action='store_true', help='write npy files in float64')
+    parser.add_argument('--max-memory', type=float, metavar='MB',
+        help='memory ceiling of computing the grid(default: tiles of %d cells)' %TILE_CELLS)
+    parser.add_argument('-j', '--workers', type=int, default=1,
+        help='number of processes computing npy files(default: 1)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    t = time.perf_counter()
+    try:
+        model_manager = ModelManager(Model.load(args.file))
+        if args.pois:
+            model_manager.bind_pois(util.parse_pois_str(args.pois))
+        if args.fields and not model_manager.has_pois and set(args.fields) - {'vp'}:
+            raise ValueError('Exporting vs and pois needs poission ratios, see --pois')
+        paths = export_grid(model_manager, args.output, args.xlim, args.ylim, args.nx, args.ny,
+            args.fields, args.format, np.float64 if args.float64 else np.float32,
+            workers=args.workers, max_memory=args.max_memory and args.max_memory*2**20)
+    except (OSError, ValueError) as e:
+        print('error: %s' %e, file=sys.stderr)
+        return 1
+    for p in paths:
+        print(p)
+    print('exported in %.2f s, %s' %(time.perf_counter()-t, util.format_peak_rss(usable_workers(args.workers) > 1)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
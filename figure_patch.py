@@ -10,7 +10,7 @@ from matplotlib.backend_tools import ToolBase, ToolCopyToClipboardBase
 import matplotlib.backends.backend_tkagg
 from matplotlib.backend_managers import ToolManager
 
-from util import TextWindow
+from widgets import TextWindow
 
 
 class ToolCopyData(ToolBase):
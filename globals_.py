@@ -1,4 +1,7 @@
+from gridcache import GridCache
 from util import SessionManager, HistoryManager
 
 session = SessionManager(autosave=True)
 history = HistoryManager(autosave=True)
+# computed velocity grids, shared by all velocity windows
+grid_cache = GridCache()
@@ -0,0 +1,273 @@
+"""Tiled computation of large velocity grids.
+
+Grid columns are independent of each other (see `ModelManager.interp_grid`),
+so a grid can be cut into tiles of columns and computed tile by tile, in a
+pool of processes if wanted. Workers get the model packed into flat arrays
+(`Model.pack`) once, and write their tiles straight into output arrays in
+shared memory, so no grid data is pickled between processes. Results are
+bit-identical to `interp_grid` on the whole grid.
+
+Grids larger than the memory are computed by `compute_grid_to_files`, which
+cuts the grid into tiles of rows under a memory ceiling and writes every tile
+straight into .npy files, returning memory maps of them.
+
+The scaling of `compute_grid` with the number of workers is measured by
+
+    python grid.py examples/v3.in --nx 4000 --ny 2000 -j 1 2 4 8
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+import sys
+import time
+
+import numpy as np
+
+from model import Model, ModelManager
+
+
+# Cells per tile, which bounds the temporary memory used by a worker
+TILE_CELLS = 500000
+# Temporary memory taken by `interp_grid` for a grid cell, besides the output
+# grids, measured with tracemalloc
+WORK_BYTES_PER_CELL = 48
+
+# State of a worker process, set by `_init_worker`
+_worker = {}
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def usable_workers(workers):
+    """Number of worker processes worth starting for `workers`(all the CPUs
+    if None): more processes than CPUs only add the overhead of the pool, so
+    a single CPU takes the serial path."""
+    if workers is None:
+        return default_workers()
+    return max(1, min(workers, default_workers()))
+
+
+def tile_ranges(nx, ny, tile_cols=None):
+    """Cut `nx` columns into tiles, return a list of (start, stop)."""
+    if tile_cols is None:
+        tile_cols = max(1, TILE_CELLS // max(ny, 1))
+    return [(i, min(i+tile_cols, nx)) for i in range(0, nx, tile_cols)]
+
+
+def tile_rows_for(model_manager, nx, max_memory, fields, dtype=float, workers=1, extra_bytes=0):
+    """Rows per tile of a grid `nx` columns wide so that `workers` workers
+    computing a tile each take at most `max_memory` bytes in all. `extra_bytes`
+    is the memory taken by the caller for a cell of a tile."""
+    itemsize = np.dtype(dtype).itemsize
+    # values of every layer at every column, taken once for a tile
+    column_bytes = 6 * 8 * len(model_manager.model) * nx
+    cell_bytes = WORK_BYTES_PER_CELL + itemsize * len(fields) + extra_bytes
+    rows = (max_memory / max(workers, 1) - column_bytes) // (cell_bytes * nx)
+    if rows < 1:
+        raise ValueError('Memory ceiling of %.1f MB is too low for %d workers on a grid %d columns wide' %(
+            max_memory/2**20, workers, nx))
+    return int(rows)
+
+
+def _init_worker(packed, has_pois, x, y, fields, dtype, shm_names):
+    mm = ModelManager(Model.unpack(packed))
+    mm.has_pois = has_pois
+    blocks = [shared_memory.SharedMemory(name=name) for name in shm_names]
+    out = [np.ndarray((len(y), len(x)), dtype=dtype, buffer=shm.buf) for shm in blocks]
+    _worker.update(mm=mm, x=x, y=y, fields=fields, blocks=blocks, out=out)
+
+
+def _interp_tile(model_manager, x, y, fields, out, start, stop):
+    grids = model_manager.interp_grid(x[start:stop], y, fields, out[0].dtype)
+    # only the grids of `fields` are not None
+    for field, grid in zip(out, [g for g in grids if g is not None]):
+        field[:, start:stop] = grid
+
+
+def _compute_tile(start, stop):
+    w = _worker
+    _interp_tile(w['mm'], w['x'], w['y'], w['fields'], w['out'], start, stop)
+    return start, stop
+
+
+def _init_file_worker(packed, has_pois, x, y, fields, dtype, paths, offsets):
+    mm = ModelManager(Model.unpack(packed))
+    mm.has_pois = has_pois
+    _worker.update(mm=mm, x=x, y=y, fields=fields, dtype=dtype, paths=paths, offsets=offsets)
+
+
+def _write_rows(model_manager, x, y, fields, dtype, paths, offsets, start, stop):
+    """Compute rows `start` to `stop` of the grid and write them into the
+    files in place. Plain file writes keep the written pages out of the
+    memory of the process, unlike writing into memory maps."""
+    grids = [g for g in model_manager.interp_grid(x, y[start:stop], fields, dtype) if g is not None]
+    for path, offset, grid in zip(paths, offsets, grids):
+        with open(path, 'r+b') as f:
+            f.seek(offset + start * grid.strides[0])
+            f.write(grid.tobytes())
+
+
+def _compute_rows(start, stop):
+    w = _worker
+    _write_rows(w['mm'], w['x'], w['y'], w['fields'], w['dtype'], w['paths'], w['offsets'], start, stop)
+    return start, stop
+
+
+def _as_result(model_manager, fields, out):
+    grids = dict(zip(fields, out))
+    return tuple(grids.get(f) for f in model_manager.FIELDS)
+
+
+def compute_grid(model_manager, x, y, workers=None, tile_cols=None, progress=None,
+        fields=None, dtype=float):
+    """Interpolate velocity on the grid spanned by 1-D axes `x` and `y` tile
+    by tile, with `workers` processes (all the CPUs by default, and no more
+    than the CPUs, see `usable_workers`). Return
+    (vp, vs, pois) just like `model_manager.interp_grid(x, y, fields, dtype)`.
+    `progress` is called with the fraction of tiles done after every tile, it
+    may raise(e.g. `util.Cancelled`) to stop the computation."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    nx, ny = len(x), len(y)
+    workers = usable_workers(workers)
+    fields = model_manager.grid_fields(fields)
+    dtype = np.dtype(dtype)
+    tiles = tile_ranges(nx, ny, tile_cols)
+    if not fields:
+        return (None,) * len(model_manager.FIELDS)
+
+    if workers <= 1 or len(tiles) <= 1:
+        out = [np.empty((ny, nx), dtype=dtype) for f in fields]
+        for i, (start, stop) in enumerate(tiles):
+            _interp_tile(model_manager, x, y, fields, out, start, stop)
+            if progress is not None:
+                progress((i+1) / len(tiles))
+        return _as_result(model_manager, fields, out)
+
+    # One shared block for each field, each is freed as soon as it is copied
+    # out, so at most one more field is held in memory.
+    blocks = [shared_memory.SharedMemory(create=True, size=max(ny*nx*dtype.itemsize, 1))
+        for f in fields]
+    out = []
+    try:
+        initargs = (model_manager.model.pack(), model_manager.has_pois, x, y,
+            fields, dtype, [shm.name for shm in blocks])
+        with ProcessPoolExecutor(max_workers=min(workers, len(tiles)),
+                initializer=_init_worker, initargs=initargs) as pool:
+            futures = [pool.submit(_compute_tile, *tile) for tile in tiles]
+            try:
+                for i, future in enumerate(futures):
+                    future.result()
+                    if progress is not None:
+                        progress((i+1) / len(tiles))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        for shm in blocks:
+            out.append(np.ndarray((ny, nx), dtype=dtype, buffer=shm.buf).copy())
+            shm.close()
+            shm.unlink()
+    finally:
+        for shm in blocks[len(out):]:
+            shm.close()
+            shm.unlink()
+    return _as_result(model_manager, fields, out)
+
+
+def compute_grid_to_files(model_manager, x, y, paths, workers=1, max_memory=None,
+        tile_rows=None, progress=None, dtype=float):
+    """Interpolate velocity on the grid spanned by 1-D axes `x` and `y` into
+    .npy files, `paths` being a dict of the path by field. The grid is
+    computed in tiles of rows, each written into the files once done, so the
+    grid need not fit in the memory. Tiles are sized so that the `workers`
+    processes(see `usable_workers`) take about `max_memory` bytes in all for computing, or have
+    `tile_rows` rows(`TILE_CELLS` cells by default). `progress` is called like in
+    `compute_grid`. Return (vp, vs, pois), the grids of the fields written as
+    read-only memory maps of the files, None for the others."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    nx, ny = len(x), len(y)
+    fields = model_manager.grid_fields(list(paths))
+    dtype = np.dtype(dtype)
+    workers = usable_workers(workers)
+    if not fields:
+        return (None,) * len(model_manager.FIELDS)
+    if max_memory is not None:
+        tile_rows = tile_rows_for(model_manager, nx, max_memory, fields, dtype, workers)
+    tiles = tile_ranges(ny, nx, tile_rows)
+    paths = [paths[f] for f in fields]
+    # Files are made in full size with the header, then filled in place
+    offsets = []
+    for path in paths:
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(ny, nx))
+        offsets.append(out.offset)
+        del out
+
+    if workers <= 1 or len(tiles) <= 1:
+        for i, (start, stop) in enumerate(tiles):
+            _write_rows(model_manager, x, y, fields, dtype, paths, offsets, start, stop)
+            if progress is not None:
+                progress((i+1) / len(tiles))
+    else:
+        initargs = (model_manager.model.pack(), model_manager.has_pois, x, y,
+            fields, dtype, paths, offsets)
+        with ProcessPoolExecutor(max_workers=min(workers, len(tiles)),
+                initializer=_init_file_worker, initargs=initargs) as pool:
+            futures = [pool.submit(_compute_rows, *tile) for tile in tiles]
+            try:
+                for i, future in enumerate(futures):
+                    future.result()
+                    if progress is not None:
+                        progress((i+1) / len(tiles))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    out = [np.load(path, mmap_mode='r') for path in paths]
+    return _as_result(model_manager, fields, out)
+
+
+def benchmark(model_manager, nx, ny, workers=(1, 2, 4, 8), repeat=3):
+    """Time `compute_grid` on a grid of `nx` x `ny` nodes over the whole
+    model with each number of `workers`. Return a list of (workers, processes
+    actually used, best time of `repeat` runs in seconds)."""
+    model = model_manager.model
+    x = np.linspace(model.xlim[0], model.xlim[1], nx)
+    y = np.linspace(model.ylim[0], model.ylim[1], ny)
+    timings = []
+    for n in workers:
+        best = np.inf
+        for i in range(repeat):
+            t = time.perf_counter()
+            compute_grid(model_manager, x, y, workers=n)
+            best = min(best, time.perf_counter()-t)
+        timings.append((n, usable_workers(n), best))
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the grid computation with several numbers of workers.')
+    parser.add_argument('file', help='v.in file')
+    parser.add_argument('--nx', type=int, default=4000, help='number of grid columns(default: 4000)')
+    parser.add_argument('--ny', type=int, default=2000, help='number of grid rows(default: 2000)')
+    parser.add_argument('-j', '--workers', type=int, nargs='+', default=[1, 2, 4, 8],
+        help='numbers of workers to time(default: 1 2 4 8)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each, the best is kept(default: 3)')
+    args = parser.parse_args(argv)
+    try:
+        model_manager = ModelManager(Model.load(args.file))
+    except (OSError, ValueError) as e:
+        print('error: %s' %e, file=sys.stderr)
+        return 1
+    print('%d x %d grid, %d CPUs' %(args.nx, args.ny, default_workers()))
+    for n, used, seconds in benchmark(model_manager, args.nx, args.ny, args.workers, args.repeat):
+        print('workers=%-3d processes=%-3d %8.3f s' %(n, used, seconds))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+
+class GridCache(object):
+    """LRU cache of computed velocity grids, limited by the memory they take.
+    A grid is cached under the key made by `make_key`, which covers the
+    content of the model, the bound poission ratios, the grid parameters and
+    the field, so a cached grid is never stale. Once the grids take more than
+    `max_bytes`, the least recently used ones are evicted.
+    Cached arrays are shared by all the users of the cache and must not be
+    modified in place. The cache can be used from several threads."""
+    def __init__(self, max_bytes=256*1024*1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(model_manager, xlim, ylim, nxgrid, nygrid, dtype=float, field=None):
+        return (
+            model_manager.model.digest(),
+            model_manager.pois_digest(),
+            tuple(map(float, xlim)),
+            tuple(map(float, ylim)),
+            int(nxgrid),
+            int(nygrid),
+            np.dtype(dtype).str,
+            field,
+            )
+
+    @staticmethod
+    def sizeof(value):
+        """Bytes taken by the arrays in a cached value(a tuple)."""
+        return sum(a.nbytes for a in value if isinstance(a, np.ndarray))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """Get the cached value of the key, or None if it is not cached."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Cache a value(a tuple of arrays). A value larger than the whole
+        budget is not cached."""
+        with self._lock:
+            self.pop(key)
+            size = self.sizeof(value)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = value
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self.nbytes -= self.sizeof(old)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self.nbytes -= self.sizeof(value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return dict(
+            hits=self.hits, misses=self.misses, evictions=self.evictions,
+            entries=len(self._entries), nbytes=self.nbytes, max_bytes=self.max_bytes)
+
+    def __str__(self):
+        return '<GridCache: %d entries, %.1f/%.1f MB, %d hits, %d misses, %d evictions>' %(
+            len(self._entries), self.nbytes/2**20, self.max_bytes/2**20,
+            self.hits, self.misses, self.evictions)
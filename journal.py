@@ -0,0 +1,268 @@
+"""Undo/redo journal of model edits.
+
+Instead of snapshotting the whole model, every edit is recorded as a small
+entry holding just enough to apply it again or revert it: the moved nodes and
+their displacement, the values of inserted/deleted nodes, or a copy of a
+deleted layer. Undo and redo therefore cost O(size of the edit).
+Entries are replayed through the methods of the model, so that model listeners
+are notified of undo and redo as well.
+"""
+from collections import deque
+
+import numpy as np
+
+
+class JournalEntry(object):
+    """Base class of journal entries."""
+    # Rough size of an entry object itself (with the headers of its arrays),
+    # counted in `nbytes`
+    OVERHEAD = 500
+
+    def apply(self, model):
+        """Do the edit (again) on the model."""
+        raise NotImplementedError
+
+    def revert(self, model):
+        """Undo the edit on the model."""
+        raise NotImplementedError
+
+    def merge(self, other):
+        """Try to absorb an entry recorded right after this one. Return True
+        if merged."""
+        return False
+
+    @property
+    def nbytes(self):
+        return self.OVERHEAD
+
+    @property
+    def ilayers(self):
+        """Indexes of layers touched by the edit, or None if the edit changes
+        the number of layers."""
+        return None
+
+
+class MoveEntry(JournalEntry):
+    """Nodes moved by (dx[i], dy[i])."""
+    def __init__(self, nodes, dx, dy):
+        # nodes: n*3 integer array of node indexes
+        self.nodes = np.asarray(nodes, dtype=np.int32).reshape(-1, 3)
+        self.dx = np.asarray(dx, dtype=float)
+        self.dy = np.asarray(dy, dtype=float)
+
+    def _move(self, model, sign):
+        model.move_nodes(self.nodes, sign*self.dx, sign*self.dy)
+
+    def apply(self, model):
+        self._move(model, 1)
+
+    def revert(self, model):
+        self._move(model, -1)
+
+    def merge(self, other):
+        """Consecutive moves of the same set of nodes add up."""
+        if not (isinstance(other, MoveEntry) and np.array_equal(self.nodes, other.nodes)):
+            return False
+        self.dx += other.dx
+        self.dy += other.dy
+        return True
+
+    @property
+    def nbytes(self):
+        return self.OVERHEAD + self.nodes.nbytes + self.dx.nbytes + self.dy.nbytes
+
+    @property
+    def ilayers(self):
+        return sorted(set(self.nodes[:,0].tolist()))
+
+
+class InsertNodeEntry(JournalEntry):
+    """Nodes inserted by `Model.insert_nodes`, which then have the indexes
+    `nodes` and the values `values`."""
+    def __init__(self, nodes, values):
+        # nodes: n*3 integer array of node indexes, values: n*3 array
+        self.nodes = np.asarray(nodes, dtype=np.int32).reshape(-1, 3)
+        self.values = np.asarray(values, dtype=float).reshape(-1, 3)
+
+    def apply(self, model):
+        # insert after the nodes left to the inserted ones, which are shifted
+        # by the other nodes inserted left to them in the same part
+        after = self.nodes.copy()
+        parts, group = np.unique(self.nodes[:, :2], axis=0, return_inverse=True)
+        for k in range(len(parts)):
+            i = np.flatnonzero(group.ravel() == k)
+            idx = self.nodes[i, 2]
+            after[i, 2] = idx - 1 - np.searchsorted(np.sort(idx), idx)
+        model.insert_nodes(after, self.values)
+
+    def revert(self, model):
+        model.delete_nodes(self.nodes)
+
+    @property
+    def nbytes(self):
+        return self.OVERHEAD + self.nodes.nbytes + self.values.nbytes
+
+    @property
+    def ilayers(self):
+        return sorted(set(self.nodes[:,0].tolist()))
+
+
+class DeleteNodeEntry(InsertNodeEntry):
+    """Nodes deleted by `Model.delete_nodes`, the reverse of InsertNodeEntry."""
+    def apply(self, model):
+        InsertNodeEntry.revert(self, model)
+
+    def revert(self, model):
+        InsertNodeEntry.apply(self, model)
+
+
+class InsertLayerEntry(JournalEntry):
+    """A layer inserted under the `ilayer`-th layer by `Model.insert_layer`,
+    which also overwrote the top velocity of the `ilayer`-th layer."""
+    def __init__(self, ilayer, old_v_top):
+        self.ilayer = ilayer
+        self.old_v_top = np.array(old_v_top, dtype=float)
+
+    def apply(self, model):
+        model.insert_layer(self.ilayer)
+
+    def revert(self, model):
+        model[self.ilayer].v_top.y = self.old_v_top
+        model.delete_layer(self.ilayer+1)
+
+    @property
+    def nbytes(self):
+        return self.OVERHEAD + self.old_v_top.nbytes
+
+
+class DeleteLayerEntry(JournalEntry):
+    """The `ilayer`-th layer deleted. A copy of the layer is kept."""
+    def __init__(self, ilayer, layer):
+        self.ilayer = ilayer
+        self.layer = layer
+
+    def apply(self, model):
+        model.delete_layer(self.ilayer)
+
+    def revert(self, model):
+        model.put_layer(self.ilayer, self.layer.copy())
+
+    @property
+    def nbytes(self):
+        return self.OVERHEAD + sum(tpl.x.nbytes + tpl.y.nbytes + tpl.vary.nbytes
+            for tpl in self.layer if tpl is not None)
+
+
+class CompoundEntry(JournalEntry):
+    """Several entries done as one edit, reverted in reverse order."""
+    def __init__(self, entries):
+        self.entries = list(entries)
+
+    def apply(self, model):
+        for entry in self.entries:
+            entry.apply(model)
+
+    def revert(self, model):
+        for entry in reversed(self.entries):
+            entry.revert(model)
+
+    @property
+    def nbytes(self):
+        return self.OVERHEAD + sum(entry.nbytes for entry in self.entries)
+
+    @property
+    def ilayers(self):
+        ilayers = set()
+        for entry in self.entries:
+            if entry.ilayers is None:
+                return None
+            ilayers.update(entry.ilayers)
+        return sorted(ilayers)
+
+
+class EditJournal(object):
+    """Undo and redo stacks of journal entries.
+    The oldest entries are evicted once there are more than `max_entries`
+    entries or they take more than `max_bytes` bytes; the newest entry is
+    always kept."""
+    def __init__(self, max_entries=10000, max_bytes=4*1024*1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.nbytes = 0
+        # A new entry is not merged into the last one after undo/redo or
+        # `seal()`.
+        self.sealed = True
+
+    def __len__(self):
+        return len(self.undo_stack)
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.nbytes = 0
+        self.sealed = True
+
+    def seal(self):
+        """Stop merging new entries into the last one."""
+        self.sealed = True
+
+    def record(self, entry):
+        """Record an edit that has been done. Entries of undone edits are
+        dropped."""
+        if entry is None:
+            return
+        if isinstance(entry, CompoundEntry):
+            if not entry.entries:
+                return
+            if len(entry.entries) == 1:
+                entry = entry.entries[0]
+        for old in self.redo_stack:
+            self.nbytes -= old.nbytes
+        self.redo_stack.clear()
+        last = self.undo_stack[-1] if self.undo_stack else None
+        if last is not None and not self.sealed:
+            size = last.nbytes
+            if last.merge(entry):
+                self.nbytes += last.nbytes - size
+                return
+        self.undo_stack.append(entry)
+        self.nbytes += entry.nbytes
+        self.sealed = False
+        self.evict()
+
+    def evict(self):
+        """Drop the oldest entries until the limits are satisfied."""
+        while len(self.undo_stack) > 1 and (len(self.undo_stack) > self.max_entries
+                or self.nbytes > self.max_bytes):
+            self.nbytes -= self.undo_stack.popleft().nbytes
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self, model):
+        """Revert the last edit on the model and return its entry, or None if
+        there is nothing to undo."""
+        if not self.undo_stack:
+            return None
+        entry = self.undo_stack.pop()
+        entry.revert(model)
+        self.redo_stack.append(entry)
+        self.sealed = True
+        return entry
+
+    def redo(self, model):
+        """Apply the last undone edit on the model again and return its entry,
+        or None if there is nothing to redo."""
+        if not self.redo_stack:
+            return None
+        entry = self.redo_stack.pop()
+        entry.apply(model)
+        self.undo_stack.append(entry)
+        self.sealed = True
+        self.evict()
+        return entry
@@ -10,8 +10,9 @@ import traceback
 
 from globals_ import session, history
 from ploter import ModelPloter
-from util import ScrollText, TextWindow, get_file_logger
+from util import get_file_logger
 from velocity import VelocityFrame
+from widgets import ScrollText, TextWindow
 
 
 cur_dir = os.path.dirname(os.path.abspath(__file__))
@@ -35,6 +36,8 @@ class MainFrame(ttk.Frame):
         self.vin_path = None
         self.canvas = None
         self.ploter = None
+        # open velocity windows, see `show_velocity`
+        self.velocity_frames = []
         self.fig = plt.figure(tight_layout=True)
         self.fig.patch.set_facecolor('#F0F0F0')
         # self.fig.subplots_adjust(top=0.96, bottom=0.075, left=0.1, right=0.97)
@@ -53,6 +56,9 @@ class MainFrame(ttk.Frame):
             'r': self.reload,
             's': self.save,
             'S': self.save_as,
+            'z': self.undo,
+            'y': self.redo,
+            'Z': self.redo,
             'w': self.exit,
             'F1': self.show_help,
         }
@@ -141,8 +147,8 @@ class MainFrame(ttk.Frame):
 
         editmenu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label='Edit', menu=editmenu)
-        editmenu.add_command(label='Undo', command=self.not_implement)
-        editmenu.add_command(label='Redo', command=self.not_implement)
+        editmenu.add_command(label='Undo', command=self.undo)
+        editmenu.add_command(label='Redo', command=self.redo)
 
         helpmenu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label='Help', menu=helpmenu)
@@ -246,6 +252,12 @@ class MainFrame(ttk.Frame):
         for name, value in zip(self.slider_names, self.slider_init_values):
             self.settings[name].set(value)
 
+    def undo(self):
+        self.ploter.undo()
+
+    def redo(self):
+        self.ploter.redo()
+
     def not_implement(self):
         messagebox.showinfo('Info', 'Not yet implemented')
 
@@ -254,7 +266,19 @@ class MainFrame(ttk.Frame):
             return
         vf = VelocityFrame(tk.Toplevel())
         vf.grid(sticky='nswe')
-        vf.bind_model(self.ploter.model.copy())
+        # bind the model being edited, so that velocity plots follow the edits
+        vf.bind_model(self.ploter.model)
+        self.velocity_frames.append(vf)
+
+    def rebind_velocity(self):
+        """Bind the open velocity windows to the model just loaded, which
+        replaces the one they are bound to."""
+        self.velocity_frames = [vf for vf in self.velocity_frames if vf.winfo_exists()]
+        for vf in self.velocity_frames:
+            if self.ploter.model is None:
+                vf.close()
+            elif vf.model_manager.model is not self.ploter.model:
+                vf.bind_model(self.ploter.model)
 
     def show_help(self):
         with open(os.path.join(cur_dir, 'resource', 'help.txt'), 'r', encoding='utf8') as f:
@@ -309,6 +333,7 @@ class MainFrame(ttk.Frame):
             session.set('file', self.vin_path)
         history.merge_session(session)
         self.update_recent_opens_menu()
+        self.rebind_velocity()
 
     def reload(self):
         """Dialog when reloading current v.in file"""
@@ -321,6 +346,7 @@ class MainFrame(ttk.Frame):
             if not okay:
                 return
         self.ploter.open()
+        self.rebind_velocity()
 
     def save(self):
         """Dialog when saving modified model back into current v.in file"""
@@ -1,10 +1,13 @@
-import copy
+from collections import namedtuple
+import hashlib
 import os
-import re
 
 import numpy as np
 
+from blocks import BlockTable
+from store import ColumnStore
 from util import get_file_logger
+from vinfile import VinReader, VinSyntaxError
 
 
 cur_dir = os.path.dirname(os.path.abspath(__file__))
@@ -13,36 +16,39 @@ logger_tl = get_file_logger('TripleLine', file=os.path.join(cur_dir, 'log', 'mod
 logger_ly = get_file_logger('Layer', file=os.path.join(cur_dir, 'log', 'model.log'), level='info')
 logger_vm = get_file_logger('Model', file=os.path.join(cur_dir, 'log', 'model.log'), level='info')
 
+# A change of the model passed to model listeners: indexes of the changed
+# layers, the x range (xmin, xmax) out of which the model is unchanged (None
+# for everywhere), and whether layers were inserted or deleted.
+ModelChange = namedtuple('ModelChange', ['ilayers', 'xlim', 'structural'])
+
 
 class TripleLine(object):
     """3 lines of the v.in file/model.
     The 3 lines can fold to 6, 9 or 3N lines when the number of nodes exceed
-    10*(N-1)."""
-    def __init__(self, data=None):
-        self._data = data or []
+    10*(N-1).
+    Nodes are kept in a slot of a `ColumnStore`, which is shared by all the
+    parts of a model. `x`, `y` and `vary` are zero-copy views into the store,
+    they are only valid until the next insertion or deletion of nodes."""
+    def __init__(self, data=None, store=None, slot=None):
+        if store is None:
+            store = ColumnStore()
+            slot = store.add(*(data or ([], [], [])))
+        self._store = store
+        self._slot = slot
 
     @classmethod
     def loads(cls, tstr):
         """Load object from string."""
         if not tstr.strip():
             return
-        triple = cls()
-        lines = tstr.strip().split('\n')
-        lines = [line.strip() for line in lines]
-        if len(lines) % 3 != 0:
-            raise ValueError('TripleLine can only load strings of 3N lines, but "%s" got.' %tstr)
         triple_line = [[], [], []]
-        for i in range(len(lines)//3):
-            triple_line[0].extend(re.split(' +', lines[i*3])[1:])
-            triple_line[1].extend(re.split(' +', lines[i*3+1])[1:])
-            triple_line[2].extend(re.split(' +', lines[i*3+2]))
-        triple_line[0] = list(map(float, triple_line[0]))
-        triple_line[1] = list(map(float, triple_line[1]))
-        triple_line[2] = list(map(int, triple_line[2]))
-        if len(set(map(len, triple_line))) != 1:
-            raise ValueError('The 3 lines must in the same length, but "%s" got.' %triple_line)
-        triple._data = triple_line
-        return triple
+        for lineno, col, ilayer, flag, x, y, vary in VinReader(tstr.splitlines()).records():
+            if vary is None:
+                raise VinSyntaxError('TripleLine can only load strings of 3N lines', lineno, col)
+            triple_line[0].extend(x)
+            triple_line[1].extend(y)
+            triple_line[2].extend(vary)
+        return cls(triple_line)
 
     def dumps(self, idx=1):
         """Dump current object as string"""
@@ -59,49 +65,75 @@ class TripleLine(object):
                     + '%2d ' %1 + ''.join(['%8.3f' %x for x in chunked[1]]) + '\n' \
                     + '%3s' %'' + ''.join(['%8d' %x for x in chunked[2]]) + '\n' \
                     + _dumps(left)
-        return _dumps(self._data)
+        return _dumps(list(self))
 
     def copy(self):
-        """Make a deepcopy of current object."""
-        return TripleLine(copy.deepcopy(self._data))
+        """Make a copy of current object, which owns a store of its own."""
+        return TripleLine([self.x, self.y, self.vary])
+
+    def bind_store(self, store):
+        """Move the nodes of current object into another store."""
+        if store is self._store:
+            return
+        slot = store.add(self.x, self.y, self.vary)
+        self._store.release(self._slot)
+        self._store = store
+        self._slot = slot
 
     def move_node(self, idx, delta_x, delta_y):
         """Move a node and return the position of moved node."""
-        self._data[0][idx] += delta_x
-        self._data[1][idx] += delta_y
-        return (self._data[0][idx], self._data[1][idx])
+        x, y = self.x, self.y
+        x[idx] += delta_x
+        y[idx] += delta_y
+        self._store.touch(self._slot)
+        return (float(x[idx]), float(y[idx]))
+
+    def move_nodes(self, idx, delta_x, delta_y):
+        """Move the nodes at distinct indexes `idx` at once and return their
+        new positions."""
+        x, y = self.x, self.y
+        x[idx] += delta_x
+        y[idx] += delta_y
+        self._store.touch(self._slot)
+        return x[idx], y[idx]
 
     def __getitem__(self, slc):
-        return self._data[slc]
+        return list(self)[slc]
 
     def __iter__(self):
-        return iter(self._data)
+        return iter(self._store.view(self._slot))
 
     def __len__(self):
-        return len(self._data[0])
+        return int(self._store.size[self._slot])
 
     def __str__(self):
         return (
             '<class TripleLine \n'
             '  1: {0}\n'
             '  2: {1}\n'
-            '  3: {2}>').format(*map(str, self._data))
+            '  3: {2}>').format(*map(lambda a: str(a.tolist()), self))
 
     @property
     def x(self):
-        return self._data[0]
+        return self._store.view(self._slot)[0]
 
     @property
     def y(self):
-        return self._data[1]
+        return self._store.view(self._slot)[1]
 
     @y.setter
     def y(self, new_y):
-        self._data[1] = new_y
+        self.y[:] = new_y
+        self._store.touch(self._slot)
+
+    @property
+    def revision(self):
+        """Revision of the nodes, which changes whenever they are modified."""
+        return int(self._store.rev[self._slot])
 
     @property
     def vary(self):
-        return self._data[2]
+        return self._store.view(self._slot)[2]
 
     def insert_node(self, i, new_node=None):
         """Insert a node into the right side of the i-th node, and return
@@ -111,37 +143,66 @@ class TripleLine(object):
         # If the value of the node to insert is not specified, determine it
         # through linear interpolation.
         if new_node is None:
+            x, y, vary = self.x, self.y, self.vary
             if i == len(self) - 1:
-                x = self.x[i] + (self.x[i] - self.x[i-1] if i > 0 else 1)
-                y, vary = self.y[i], self.vary[i]
+                new_x = x[i] + (x[i] - x[i-1] if i > 0 else 1)
+                new_y, new_vary = y[i], vary[i]
             else:
-                x = (self.x[i] + self.x[i+1]) / 2
-                y = (self.y[i] + self.y[i+1]) / 2
-                vary = self.vary[i]
-            new_node = (x, y, vary)
+                new_x = (x[i] + x[i+1]) / 2
+                new_y = (y[i] + y[i+1]) / 2
+                new_vary = vary[i]
+            new_node = (float(new_x), float(new_y), int(new_vary))
         else:
             if new_node[0] <= self.x[i]:
                 raise ValueError(
                     'The x value of the node to insert must larger than that '
                     'of the left neighboring node.')
         # Insert node
-        self.x.insert(i+1, new_node[0])
-        self.y.insert(i+1, new_node[1])
-        self.vary.insert(i+1, new_node[2])
+        self._store.insert(self._slot, i+1, *new_node)
         return new_node
 
+    def insert_nodes(self, idx, new_nodes=None):
+        """Insert a node into the right side of the node at each of indexes
+        `idx` at once, and return the values of the inserted nodes(an n*3
+        array). Nodes inserted at a repeated index follow one another in order.
+        Values not given are determined like `insert_node`."""
+        idx = np.asarray(idx, dtype=np.intp)
+        x, y, vary = self.x, self.y, self.vary
+        if new_nodes is None:
+            right = np.minimum(idx+1, len(self)-1)
+            # after the last node, step as far as from its left neighbor
+            step = np.where(idx > 0, x[idx] - x[np.maximum(idx-1, 0)], 1.)
+            new_nodes = np.column_stack([
+                (x[idx] + x[right]) / 2 + np.where(right == idx, step, 0.),
+                (y[idx] + y[right]) / 2, vary[idx]])
+        else:
+            new_nodes = np.asarray(new_nodes, dtype=float).reshape(-1, 3)
+            if np.any(new_nodes[:, 0] <= x[idx]):
+                raise ValueError(
+                    'The x value of the node to insert must larger than that '
+                    'of the left neighboring node.')
+        self._store.assign(self._slot, np.insert(x, idx+1, new_nodes[:, 0]),
+            np.insert(y, idx+1, new_nodes[:, 1]), np.insert(vary, idx+1, new_nodes[:, 2]))
+        return new_nodes
+
+    def prepend_node(self, new_node):
+        """Insert a node(a 1*3 tuple) before the first node."""
+        self._store.insert(self._slot, 0, *new_node)
+
     def delete_node(self, i):
         """Delete the i-th node.
         If the only node was deleted, return True, else, return False."""
-        try:
-            for lst in self._data:
-                lst.pop(i)
-        except IndexError as e:
-            raise IndexError('Node index out of range in the x direction.')
+        self._store.delete(self._slot, i)
         if len(self) == 0:
             return True
         return False
 
+    def delete_nodes(self, idx):
+        """Delete the nodes at distinct indexes `idx` at once.
+        If no node is left, return True, else, return False."""
+        self._store.assign(self._slot, *(np.delete(a, idx) for a in self))
+        return len(self) == 0
+
 class Layer(object):
     """One layer of the v.in file/model.
     Every layer consists of 3 parts:
@@ -151,29 +212,78 @@ class Layer(object):
     Each part is a TripleLine object."""
     def __init__(self, data=None):
         self._data = data or []
+        self.pois = None
+        self._digest_cache = (None, None)
 
     @classmethod
     def loads(cls, lstr):
         """Load the Layer object from string"""
-        layer = cls()
-        lines = lstr.strip().split('\n')
-        if len(lines) % 3 != 0:
-            raise ValueError('Layer can only load strings containing 3N lines, but "%s" got.' %lstr)
-        last = 0
-        for i in range(len(lines)//3):
-            line2 = lines[3*i+1]
-            if int(line2.lstrip()[:2]) == 0:
-                layer._data.append(TripleLine.loads('\n'.join(lines[last*3:(i+1)*3])))
-                last = i + 1
-        if len(layer._data) != 3:
-            raise ValueError('Layer object must consists of THREE parts, but %d got.' %(len(layer._data)))
+        store = ColumnStore()
+        parts = []
+        for lineno, col, ilayer, x, y, vary in VinReader(lstr.splitlines()).parts():
+            if vary is None:
+                raise VinSyntaxError('Layer can only load strings containing 3N lines', lineno, col)
+            parts.append(TripleLine(store=store, slot=store.add(x, y, vary)))
+        if len(parts) != 3:
+            raise ValueError('Layer object must consists of THREE parts, but %d got.' %(len(parts)))
+        return cls.from_parts(parts)
+
+    @classmethod
+    def from_parts(cls, parts):
+        """Make a layer from its 3 parts(TripleLine objects), and fix the
+        special cases of constant depth and velocity."""
+        layer = cls(parts)
         layer.fix_depth()
         layer.fix_v_top()
         layer.fix_v_bot()
         return layer
 
     def copy(self):
-        return Layer(copy.deepcopy(self._data))
+        """Make a copy of current layer. All parts of the copy share a store
+        of their own."""
+        store = ColumnStore()
+        parts = [None if tl is None else TripleLine(store=store, slot=store.add(*tl))
+            for tl in self._data]
+        cp = type(self)(parts)
+        cp.pois = self.pois
+        return cp
+
+    def bind_store(self, store):
+        """Move all parts of current layer into another store."""
+        for tl in self._data:
+            if tl is not None:
+                tl.bind_store(store)
+
+    @property
+    def revision(self):
+        """Revision of the layer, which increases whenever any part of the
+        layer is modified."""
+        return max(tl.revision for tl in self._data if tl is not None)
+
+    @staticmethod
+    def _format3(a):
+        """Values formatted with 3 decimals the way `TripleLine.dumps` writes
+        them, whose rounding differs from `np.round` on ties(e.g. 0.0005)"""
+        return ('%.3f,' * len(a) %tuple(a.tolist())).encode()
+
+    def digest(self):
+        """Digest of the layer content as written to v.in(nodes rounded to 3
+        decimals). The digest is cached until the layer is modified."""
+        key = tuple((tl._store, tl._slot, tl.revision) for tl in self._data if tl is not None)
+        if self._digest_cache[0] == key:
+            return self._digest_cache[1]
+        h = hashlib.blake2b(type(self).__name__.encode(), digest_size=16)
+        for tl in self._data:
+            if tl is None:
+                h.update(b'-')
+                continue
+            h.update(len(tl).to_bytes(8, 'little'))
+            h.update(self._format3(tl.x))
+            h.update(self._format3(tl.y))
+            h.update(tl.vary.tobytes())
+        digest = h.digest()
+        self._digest_cache = (key, digest)
+        return digest
 
     def fix_depth(self):
         """Fix the special case of depth nodes. When layer has only 1 depth
@@ -182,9 +292,7 @@ class Layer(object):
         d = self.depth
         if len(d) == 1:
             x, y, vary = (d.x[0], d.y[0], d.vary[0])
-            d.x.insert(0, 0)
-            d.y.insert(0, y)
-            d.vary.insert(0, vary)
+            d.prepend_node((0, y, vary))
 
     def fix_v_top(self):
         """Fix the special case of top velocity nodes. When layer has only 1
@@ -196,9 +304,7 @@ class Layer(object):
         vt = self.v_top
         if len(vt) == 1:
             x, y, vary = (vt.x[0], vt.y[0], vt.vary[0])
-            vt.x.insert(0, 0)
-            vt.y.insert(0, y)
-            vt.vary.insert(0, vary)
+            vt.prepend_node((0, y, vary))
 
     def fix_v_bot(self):
         """Fix the special case of bottom velocity nodes. When layer has only 1
@@ -210,33 +316,25 @@ class Layer(object):
         vb = self.v_bot
         if len(vb) == 1:
             x, y, vary = (vb.x[0], vb.y[0], vb.vary[0])
-            vb.x.insert(0, 0)
-            vb.y.insert(0, y)
-            vb.vary.insert(0, vary)
+            vb.prepend_node((0, y, vary))
 
     def recover_depth(self):
         """Recover the fixed depth nodes."""
         d = self.depth
         if len(d) == 2 and abs(d.y[0]-d.y[1]) < 1e-6:
-            d.x.pop(0)
-            d.y.pop(0)
-            d.vary.pop(0)
+            d.delete_node(0)
 
     def recover_v_top(self):
         """Recover the fixed top velocity nodes."""
         vt = self.v_top
         if len(vt) == 2 and abs(vt.y[0]-vt.y[1]) < 1e-6:
-            vt.x.pop(0)
-            vt.y.pop(0)
-            vt.vary.pop(0)
+            vt.delete_node(0)
 
     def recover_v_bot(self):
         """Recover the fixed bottom velocity nodes."""
         vb = self.v_bot
         if len(vb) == 2 and abs(vb.y[0]-vb.y[1]) < 1e-6:
-            vb.x.pop(0)
-            vb.y.pop(0)
-            vb.vary.pop(0)
+            vb.delete_node(0)
 
     def dumps(self, idx=1, shrink=False):
         cp = self.copy()
@@ -300,14 +398,16 @@ class EndLayer(Layer):
     """v.in 的最后一层只包含深度信息（两行），需要特殊处理"""
     @classmethod
     def loads(cls, lstr):
-        layer = cls()
-        lines = lstr.strip().split('\n')
-        if len(lines) != 2:
-            raise ValueError('The last layer should be consists of 2 lines, but %i got' % (len(lines), ))
-        nnode = len(lines[0].strip().split()) - 1
-        dumb_line = '   ' + ' '.join(['0' for _ in range(nnode)])
-        lines.append(dumb_line)
-        layer._data = [TripleLine.loads('\n'.join(lines)), None, None]
+        records = list(VinReader(lstr.splitlines()).records())
+        if len(records) != 1 or records[0][-1] is not None:
+            raise ValueError('The last layer should be consists of 2 lines, but %i got'
+                % (len(lstr.strip().split('\n')), ))
+        lineno, col, ilayer, flag, x, y, vary = records[0]
+        return cls.from_parts([TripleLine([x, y, [0]*len(x)]), None, None])
+
+    @classmethod
+    def from_parts(cls, parts):
+        layer = cls(parts)
         layer.fix_depth()
         return layer
 
@@ -323,38 +423,58 @@ class EndLayer(Layer):
 
 class Model(object):
     """The strata model(corresponding to a v.in file).
-    Consists of a series of Layer objects."""
-    def __init__(self, data=None):
+    Consists of a series of Layer objects, the nodes of which are all kept in
+    one `ColumnStore`."""
+    def __init__(self, data=None, store=None):
+        self._store = ColumnStore() if store is None else store
         self._data = data or []
+        for layer in self._data:
+            layer.bind_store(self._store)
+        # Layer digests when the model was last loaded or saved
+        self._saved_digests = None
+        self._listeners = []
+        self._digest_cache = (None, None)
 
     @classmethod
     def loads(cls, model_string):
         """Load model from string"""
-        model = cls()
-        lines = model_string.strip().split('\n')
-        if int(lines[0].lstrip()[:2]) != 1:
-            raise ValueError('The first layer number of a model should be "1".')
-        if len(lines)%3 != 2:
-            raise ValueError('There should be 2 ending lines at the end of v.in file.')
-
-        current_layer = 1
-        in_layer = []
-        for i in range(len(lines)//3+1):
-            line1 = lines[3*i]
-            if int(line1.lstrip()[:2]) != current_layer:
-                model._data.append(Layer.loads('\n'.join(in_layer)))
-                in_layer.clear()
-                current_layer += 1
-            in_layer.extend(lines[3*i:3*(i+1)])
-        # end layer
-        model._data.append(EndLayer.loads('\n'.join(lines[-2:])))
-        return model
+        return cls.read(model_string.splitlines())
 
     @classmethod
     def load(cls, path_vin):
         """Load model from v.in file."""
         with open(path_vin, 'r') as f:
-            return cls.loads(f.read())
+            return cls.read(f)
+
+    @classmethod
+    def read(cls, stream):
+        """Load model from a stream of v.in lines(a file object, a list of
+        strings etc.) in a single pass. Nodes are put into the store of the
+        model as soon as a part is read."""
+        store = ColumnStore()
+        layers = []
+        parts = []
+        reader = VinReader(stream)
+        for lineno, col, ilayer, x, y, vary in reader.parts():
+            expected = len(layers) + 1
+            if ilayer != expected or (vary is None and parts):
+                if parts and ilayer in (expected, expected+1):
+                    msg = 'layer %d should consist of THREE parts, but %d got' %(expected, len(parts))
+                else:
+                    msg = 'layer number should be %d, but %d got' %(expected, ilayer)
+                raise VinSyntaxError(msg, lineno, col)
+            if vary is None:
+                # The 2 ending lines: depth of the last layer boundary
+                tpl = TripleLine(store=store, slot=store.add(x, y, [0]*len(x)))
+                layers.append(EndLayer.from_parts([tpl, None, None]))
+                model = cls(layers, store)
+                model.mark_saved()
+                return model
+            parts.append(TripleLine(store=store, slot=store.add(x, y, vary)))
+            if len(parts) == 3:
+                layers.append(Layer.from_parts(parts))
+                parts = []
+        raise reader.error('unexpected end of file, there should be 2 ending lines at the end of v.in file')
 
     # def _end_layer(self):
     #     """Generate the trailing 2 lines at the end of the v.in file"""
@@ -375,9 +495,64 @@ class Model(object):
         """Dump model into a v.in file."""
         with open(path_vin, 'w') as f:
             f.write(self.dumps())
+        self.mark_saved()
 
     def copy(self):
-        return Model(copy.deepcopy(self._data))
+        """Make a copy of the model by copying the buffers of its store."""
+        cp = Model()
+        cp._store = self._store.copy()
+        for ly in self._data:
+            parts = [None if tl is None else TripleLine(store=cp._store, slot=tl._slot)
+                for tl in ly]
+            new_ly = type(ly)(parts)
+            new_ly.pois = ly.pois
+            # The copied store keeps revisions, so do the cached digests
+            key, digest = ly._digest_cache
+            if key is not None:
+                key = tuple((cp._store,) + k[1:] for k in key)
+                new_ly._digest_cache = (key, digest)
+            cp._data.append(new_ly)
+        cp._saved_digests = self._saved_digests
+        return cp
+
+    def pack(self):
+        """Pack the nodes of the model, and poission ratios bound to layers,
+        into a few flat arrays: a compact form to send to other processes.
+        See `unpack`."""
+        sizes = np.array([[-1 if tl is None else len(tl) for tl in ly] for ly in self._data],
+            dtype=np.intp).reshape(-1, 3)
+        parts = [tl for ly in self._data for tl in ly if tl is not None]
+        return dict(
+            sizes = sizes,
+            x = np.concatenate([tl.x for tl in parts]) if parts else np.zeros(0),
+            y = np.concatenate([tl.y for tl in parts]) if parts else np.zeros(0),
+            vary = np.concatenate([tl.vary for tl in parts]) if parts else np.zeros(0, dtype=np.int8),
+            pois = [None if ly.pois is None else
+                (np.asarray(ly.pois['x'], dtype=float), np.asarray(ly.pois['y'], dtype=float))
+                for ly in self._data],
+            )
+
+    @classmethod
+    def unpack(cls, packed):
+        """Rebuild a model from the result of `pack`."""
+        sizes, x, y, vary = packed['sizes'], packed['x'], packed['y'], packed['vary']
+        store = ColumnStore(len(x) + 4*sizes.size)
+        layers = []
+        pos = 0
+        for row, pois in zip(sizes, packed['pois']):
+            parts = []
+            for n in row:
+                if n < 0:
+                    parts.append(None)
+                    continue
+                slot = store.add(x[pos:pos+n], y[pos:pos+n], vary[pos:pos+n])
+                parts.append(TripleLine(store=store, slot=slot))
+                pos += n
+            layer = (EndLayer if parts[1] is None else Layer)(parts)
+            if pois is not None:
+                layer.bind_pois({'x': pois[0], 'y': pois[1]})
+            layers.append(layer)
+        return cls(layers, store)
 
     def __getitem__(self, slc):
         return self._data[slc]
@@ -388,7 +563,100 @@ class Model(object):
             '\n'.join(map(lambda ly: '  ' + str(ly).replace('\n','\n  '), self._data)))
 
     def __eq__(self, other):
-        return self.dumps() == other.dumps()
+        if not isinstance(other, Model):
+            return NotImplemented
+        return self.layer_digests() == other.layer_digests()
+
+    def layer_digests(self):
+        """Get the digests of all layers. Only layers modified since the last
+        call are digested again."""
+        return tuple(ly.digest() for ly in self._data)
+
+    def digest(self):
+        """Digest of the exact content of the model. Unlike `layer_digests`,
+        node values are not rounded, so that models of the same digest give
+        the same velocity. The digest is cached until the model is modified."""
+        key = (self._store, self._store.tick)
+        if self._digest_cache[0] == key:
+            return self._digest_cache[1]
+        h = hashlib.blake2b(digest_size=16)
+        for ly in self._data:
+            for tl in ly:
+                if tl is None:
+                    h.update(b'-')
+                    continue
+                h.update(len(tl).to_bytes(8, 'little'))
+                for a in tl:
+                    h.update(a.tobytes())
+        digest = h.digest()
+        self._digest_cache = (key, digest)
+        return digest
+
+    def mark_saved(self):
+        """Take the current content of the model as unmodified."""
+        self._saved_digests = self.layer_digests()
+
+    def is_modified(self):
+        """Check if the model has been modified since it was loaded or saved.
+        A model that was never loaded or saved counts as modified."""
+        return self.layer_digests() != self._saved_digests
+
+    def add_listener(self, func):
+        """Register a function to be called with a `ModelChange` object after
+        every modification made through the methods of the model."""
+        if func not in self._listeners:
+            self._listeners.append(func)
+
+    def remove_listener(self, func):
+        if func in self._listeners:
+            self._listeners.remove(func)
+
+    def notify(self, ilayers, xlim=None, structural=False):
+        """Tell the listeners that the model was modified."""
+        change = ModelChange(list(ilayers), xlim, structural)
+        for func in list(self._listeners):
+            func(change)
+
+    def _node_span(self, node_idx, *xs):
+        """Get the x range between the neighbors of a node (unbounded on a
+        side without neighbor), in which the velocity grid changes when the
+        node changes. Return None if any of the given x values of the node is
+        out of the range, since nodes out of order affect the whole layer."""
+        x = self.get_tpl(node_idx).x
+        i = node_idx.inode
+        xmin = x[i-1] if i > 0 else -np.inf
+        xmax = x[i+1] if i+1 < len(x) else np.inf
+        if not all(xmin <= xi <= xmax for xi in xs):
+            return None
+        return (float(xmin), float(xmax))
+
+    @staticmethod
+    def _nodes_span(old_x, new_x, idx):
+        """Like `_node_span`, for the nodes at indexes `idx` of a part moved at
+        once: the x range covering the old and new positions of their
+        neighbors. Return None if the part is out of order after the move."""
+        if np.any(np.diff(new_x) < 0):
+            return None
+        n = len(new_x)
+        left, right = np.maximum(idx-1, 0), np.minimum(idx+1, n-1)
+        xmin = -np.inf if np.any(idx == 0) else min(old_x[left].min(), new_x[left].min())
+        xmax = np.inf if np.any(idx == n-1) else max(old_x[right].max(), new_x[right].max())
+        return (float(xmin), float(xmax))
+
+    def _notify_spans(self, ilayers, spans):
+        """Notify the change of several parts at once, `spans` are the x
+        ranges changed in the parts(see `_nodes_span`)."""
+        xlim = None
+        if None not in spans:
+            xlim = (min(s[0] for s in spans), max(s[1] for s in spans))
+        self.notify(sorted(ilayers), xlim)
+
+    def _node_layers(self, node_idx):
+        """Get the layers changed with a node: a depth node is on the top of
+        its layer and the bottom of the upper one."""
+        if node_idx.ipart == 0 and node_idx.ilayer > 0:
+            return [node_idx.ilayer-1, node_idx.ilayer]
+        return [node_idx.ilayer]
 
     def __len__(self):
         return len(self._data)
@@ -397,6 +665,21 @@ class Model(object):
     def nlayer(self):
         return len(self._data)
 
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def revision(self):
+        """Revision of the model, which increases on every modification."""
+        return self._store.tick
+
+    def slot_table(self):
+        """Get the slots of all parts in the store as an array in the shape of
+        (nlayer, 3). Missing parts (of the end layer) are marked as -1."""
+        return np.array([[-1 if tl is None else tl._slot for tl in ly] for ly in self._data],
+            dtype=np.intp).reshape(-1, 3)
+
     @property
     def xlim(self):
         layer1_x = self._data[0].depth.x
@@ -427,7 +710,9 @@ class Model(object):
         object."""
         try:
             tpl = self._data[node_idx.ilayer][node_idx.ipart]
-            return tuple([l[node_idx.inode] for l in tpl])
+            x, y, vary = tpl
+            i = node_idx.inode
+            return (float(x[i]), float(y[i]), int(vary[i]))
         except (IndexError, TypeError) as e:
             return None
 
@@ -440,7 +725,70 @@ class Model(object):
             if node_idx == node_idx.end(self):
                 raise ValueError('Can not move the ENDING node of a layer')
         tpl = self.get_tpl(node_idx)
-        return tpl.move_node(node_idx.inode, delta_x, delta_y)
+        old_x = float(tpl.x[node_idx.inode])
+        new_x, new_y = tpl.move_node(node_idx.inode, delta_x, delta_y)
+        if self._listeners:
+            self.notify(self._node_layers(node_idx),
+                self._node_span(node_idx, old_x, new_x))
+        return new_x, new_y
+
+    @staticmethod
+    def node_array(nodes):
+        """Get node indexes(NodeIndex objects or triples) as an n*3 array"""
+        if isinstance(nodes, np.ndarray):
+            return nodes.astype(np.intp).reshape(-1, 3)
+        return np.array([tuple(ni[:]) for ni in nodes], dtype=np.intp).reshape(-1, 3)
+
+    def get_nodes(self, nodes):
+        """Get the values of nodes(see `node_array`) at once: arrays of x, y
+        and vary."""
+        nodes = self.node_array(nodes)
+        slots = self.slot_table()[nodes[:, 0], nodes[:, 1]]
+        i = self._store.start[slots] + nodes[:, 2]
+        return self._store.x[i], self._store.y[i], self._store.vary[i]
+
+    def part_sizes(self, nodes):
+        """Get the number of nodes in the part of each node(an n*3 array of
+        node indexes)."""
+        nodes = np.asarray(nodes, dtype=np.intp).reshape(-1, 3)
+        slots = self.slot_table()[nodes[:, 0], nodes[:, 1]]
+        if np.any(slots < 0):
+            raise ValueError('Node index out of range in y-direction')
+        return self._store.size[slots]
+
+    def fixed_in_x(self, nodes):
+        """Get a mask of the nodes(an n*3 array of node indexes) which are the
+        leading or ending nodes of their parts, and so can not move in x."""
+        nodes = np.asarray(nodes, dtype=np.intp).reshape(-1, 3)
+        return (nodes[:, 2] == 0) | (nodes[:, 2] == self.part_sizes(nodes)-1)
+
+    def move_nodes(self, nodes, delta_x, delta_y):
+        """Move distinct nodes(see `node_array`) at once, by the same delta or
+        by arrays of a delta for each node. The nodes of each part are moved in
+        one go. Nothing is moved if any leading or ending node would move in
+        x. Return the new x and y of the nodes."""
+        nodes = self.node_array(nodes)
+        delta_x = np.broadcast_to(np.asarray(delta_x, dtype=float), len(nodes))
+        delta_y = np.broadcast_to(np.asarray(delta_y, dtype=float), len(nodes))
+        fixed = self.fixed_in_x(nodes) & (np.abs(delta_x) > 1e-6)
+        if fixed.any():
+            if nodes[fixed.argmax(), 2] == 0:
+                raise ValueError('Can not move the LEADING node of a layer')
+            raise ValueError('Can not move the ENDING node of a layer')
+        new_x, new_y = np.empty(len(nodes)), np.empty(len(nodes))
+        ilayers, spans = set(), []
+        parts, group = np.unique(nodes[:, :2], axis=0, return_inverse=True)
+        for k, (ilayer, ipart) in enumerate(parts):
+            i = np.flatnonzero(group.ravel() == k)
+            tpl = self._data[ilayer][ipart]
+            old_x = tpl.x.copy() if self._listeners else None
+            new_x[i], new_y[i] = tpl.move_nodes(nodes[i, 2], delta_x[i], delta_y[i])
+            ilayers.update(self._node_layers(NodeIndex(ilayer, ipart, 0)))
+            if self._listeners:
+                spans.append(self._nodes_span(old_x, tpl.x, nodes[i, 2]))
+        if self._listeners and len(nodes):
+            self._notify_spans(ilayers, spans)
+        return new_x, new_y
 
     def insert_node(self, node_idx, new_node=None):
         """Insert a node after the given node specified by the NodeIndex object.
@@ -450,7 +798,73 @@ class Model(object):
         tpl = self.get_tpl(node_idx)
         if tpl is None:
             raise ValueError('Node index out of range in y-direction')
-        return tpl.insert_node(node_idx.inode, new_node)
+        new_node = tpl.insert_node(node_idx.inode, new_node)
+        if self._listeners:
+            self.notify(self._node_layers(node_idx),
+                self._node_span(node_idx.right()))
+        return new_node
+
+    def insert_nodes(self, nodes, new_nodes=None):
+        """Insert a node after each of the nodes(see `node_array`) at once,
+        with the values `new_nodes`(an n*3 array) or values determined like
+        `insert_node`. Nodes inserted after the same node follow one another in
+        the order of `nodes`. The nodes of each part are inserted in one go and
+        the listeners are notified once. Nothing is inserted if any node is the
+        ending node of its part. Return the indexes the inserted nodes take and
+        their values, both as n*3 arrays in the order of `nodes`."""
+        nodes = self.node_array(nodes)
+        if np.any(nodes[:, 2] == self.part_sizes(nodes)-1):
+            raise ValueError('Can not insert node after the ENDING node of a layer')
+        if new_nodes is not None:
+            new_nodes = np.asarray(new_nodes, dtype=float).reshape(-1, 3)
+        inserted, values = nodes.copy(), np.empty((len(nodes), 3))
+        ilayers, spans = set(), []
+        parts, group = np.unique(nodes[:, :2], axis=0, return_inverse=True)
+        for k, (ilayer, ipart) in enumerate(parts):
+            i = np.flatnonzero(group.ravel() == k)
+            tpl = self._data[ilayer][ipart]
+            idx = nodes[i, 2]
+            values[i] = tpl.insert_nodes(idx, None if new_nodes is None else new_nodes[i])
+            # shifted by the nodes inserted left to them, nodes inserted after
+            # the same node are kept in their order
+            rank = np.empty(len(idx), dtype=np.intp)
+            rank[np.argsort(idx, kind='stable')] = np.arange(len(idx))
+            inserted[i, 2] = idx + 1 + rank
+            ilayers.update(self._node_layers(NodeIndex(ilayer, ipart, 0)))
+            if self._listeners:
+                x = tpl.x
+                new = inserted[i, 2]
+                spans.append(None if np.any(np.diff(x) < 0) else
+                    (float(x[new.min()-1]), float(x[new.max()+1])))
+        if self._listeners and len(nodes):
+            self._notify_spans(ilayers, spans)
+        return inserted, values
+
+    def delete_nodes(self, nodes):
+        """Delete distinct nodes(see `node_array`) at once. The nodes of each
+        part are deleted in one go and the listeners are notified once. Nothing
+        is deleted if any node is the leading or ending node of its part, so no
+        part is deleted to empty."""
+        nodes = self.node_array(nodes)
+        fixed = self.fixed_in_x(nodes)
+        if fixed.any():
+            if nodes[fixed.argmax(), 2] == 0:
+                raise ValueError('Can not delete LEADING node of a layer')
+            raise ValueError('Can not delete ENDING node of a layer')
+        ilayers, spans = set(), []
+        parts, group = np.unique(nodes[:, :2], axis=0, return_inverse=True)
+        for k, (ilayer, ipart) in enumerate(parts):
+            i = np.flatnonzero(group.ravel() == k)
+            tpl = self._data[ilayer][ipart]
+            idx = nodes[i, 2]
+            if self._listeners:
+                x = tpl.x
+                spans.append(None if np.any(np.diff(x) < 0) else
+                    (float(x[idx.min()-1]), float(x[idx.max()+1])))
+            tpl.delete_nodes(idx)
+            ilayers.update(self._node_layers(NodeIndex(ilayer, ipart, 0)))
+        if self._listeners and len(nodes):
+            self._notify_spans(ilayers, spans)
 
     def delete_node(self, node_idx):
         """Delete the node specified by the given NodeIndex object.
@@ -464,18 +878,19 @@ class Model(object):
         tpl = self.get_tpl(node_idx)
         if tpl is None:
             raise ValueError('Node index out of range in y-direction')
-        # First make a copy of "tpl" to test if it will be deleted to empty.
-        tpl_cp = tpl.copy()
-        is_empty = tpl_cp.delete_node(node_idx.inode)
+        is_empty = len(tpl) == 1
         if not is_empty:
+            span = self._node_span(node_idx)
             tpl.delete_node(node_idx.inode)
+            if self._listeners:
+                self.notify(self._node_layers(node_idx), span)
             return
         # TripleLine object of velocity nodes is forbidden to delete to empty.
         if node_idx.ipart != 0:
             raise ValueError('Can not delete all the velocity nodes of a layer')
         # If the TripleLine object of depth nodes is deleted to empty,
         # then delete the whole layer.
-        self._data.pop(node_idx.ilayer)
+        self.delete_layer(node_idx.ilayer)
         return is_empty
 
     def get_thickness(self, ilayer):
@@ -511,15 +926,28 @@ class Model(object):
         new_layer.v_top.y = [v_top for i in new_layer.v_top.y]
         # Now the top of new layer becomes the bottom of current layer
         current_layer.v_top.y = new_layer.v_top.y.copy()
+        new_layer.bind_store(self._store)
         self._data.insert(ilayer+1, new_layer)
         logger_vm.debug(new_layer)
+        self.notify([ilayer, ilayer+1], structural=True)
+
+    def put_layer(self, ilayer, layer):
+        """Insert a Layer object as the i-th layer, e.g. to restore a deleted
+        layer."""
+        layer.bind_store(self._store)
+        self._data.insert(ilayer, layer)
+        self.notify([ilayer], structural=True)
 
     def delete_layer(self, ilayer):
         """Delete the i-th layer."""
         try:
-            self._data.pop(ilayer)
+            layer = self._data.pop(ilayer)
         except IndexError as e:
             raise IndexError('Layer index out of range.')
+        # Hand the nodes over to a store of its own, so that the deleted layer
+        # is still usable while its space in the model is reclaimed.
+        layer.bind_store(ColumnStore())
+        self.notify([ilayer], structural=True)
 
 
 class NodeIndex(object):
@@ -620,10 +1048,16 @@ class ModelManager():
     # How fine is the grid data for velocity contouring
     NXGRID = 500
     NYGRID = 500
+    # Number of points processed at a time by `query`
+    QUERY_CHUNK = 100000
+    # Fields of velocity grids
+    FIELDS = ('vp', 'vs', 'pois')
 
     def __init__(self, model):
         self.model = model
         self.has_pois = False
+        self.pois_obj = None
+        self._blocks = None
 
     @staticmethod
     def vp2vs(vp, nu):
@@ -634,54 +1068,87 @@ class ModelManager():
     def bind_pois(self, pois_obj):
         """Bind poission ratio to model"""
         self.has_pois = True
+        self.pois_obj = pois_obj
         pois = np.array(pois_obj['pois'])
-        poisl = np.array(pois_obj.get('poisl', [])) - 1
-        poisb = np.array(pois_obj.get('poisb', [])) - 1
-        poisbl = np.array(pois_obj.get('poisbl', []))
+        poisl = np.array(pois_obj.get('poisl', []), dtype=int) - 1
+        poisb = np.array(pois_obj.get('poisb', []), dtype=int) - 1
+        poisbl = np.array(pois_obj.get('poisbl', []), dtype=float)
         pois[pois == 0.5] = 0.49999
         poisbl[poisbl == 0.5] = 0.49999
         if len(pois) < len(self.model):
             tail = np.ones(len(self.model)-len(pois)) * pois[-1]
             pois = np.hstack([pois, tail])
-        for ily in range(len(self.model)-1):
-            ly_cur, ly_next = self.model[ily], self.model[ily+1]
-            x_top, x_bot = ly_cur.depth.x, ly_next.depth.x
-            x_v_top, x_v_bot = ly_cur.v_top.x, ly_cur.v_bot.x
-            x_all = sorted(list(set(np.hstack([x_top, x_bot, x_v_top, x_v_bot]))))
-
-            layer_pois = pois[ily]
-            x, y = [], []
+        for ily, lb in enumerate(self.blocks()):
+            if len(lb.x) < 2:
+                self.model[ily].bind_pois({'x': list(lb.x)*2, 'y': [pois[ily]]*2})
+                continue
+            # Blocks take the poission ratio of their layer, unless given by
+            # block in `poisbl`
+            pois_blk = np.full(len(lb.x)-1, pois[ily])
             indices = (poisl == ily)
             iblks, pois_bl = poisb[indices], poisbl[indices]
-            if iblks.size is 0:
-                x, y = [x_all[0], x_all[-1]], [layer_pois]*2
-            else:
-                if iblks[0] != 0:
-                    np.insert(iblks, 0, 0)
-                    np.insert(pois_bl, 0, layer_pois)
-                if iblks[-1] != len(x_all)-2:
-                    np.append(iblks, len(x_all)-2)
-                    np.append(pois_bl, layer_pois)
-                for iblk, p in zip(iblks, pois_bl):
-                    x.extend([x_all[iblk], x_all[iblk+1]])
-                    y.extend([p] * 2)
-            ly_cur.bind_pois({'x': x, 'y': y})
+            valid = (iblks >= 0) & (iblks < len(pois_blk))
+            pois_blk[iblks[valid]] = pois_bl[valid]
+            # Every block is given by the ratio at both of its edges
+            x = np.repeat(lb.x, 2)[1:-1]
+            y = np.repeat(pois_blk, 2)
+            self.model[ily].bind_pois({'x': x.tolist(), 'y': y.tolist()})
 
     def unbind_pois(self):
         self.has_pois = False
+        self.pois_obj = None
         for ily in range(len(self.model)):
             self.model[ily].unbind_pois()
 
+    def pois_digest(self):
+        """Digest of the poission ratios bound to the layers of the model."""
+        h = hashlib.blake2b(b'%d' %self.has_pois, digest_size=16)
+        if self.has_pois:
+            for ly in self.model:
+                if ly.pois is None:
+                    h.update(b'-')
+                    continue
+                x = np.asarray(ly.pois['x'], dtype=float)
+                h.update(len(x).to_bytes(8, 'little'))
+                h.update(x.tobytes())
+                h.update(np.asarray(ly.pois['y'], dtype=float).tobytes())
+        return h.digest()
+
+    def snapshot(self):
+        """A manager of a copy of the model with the same poission ratios,
+        which is not affected by later edits and can be read by another
+        thread."""
+        mm = ModelManager(self.model.copy())
+        mm.has_pois = self.has_pois
+        mm.pois_obj = self.pois_obj
+        return mm
+
+    def grid_fields(self, fields=None):
+        """Names of the grid fields among `fields`(all of `FIELDS` by default)
+        which can be computed, in the order of `FIELDS`. vs and pois can only
+        be computed if poission ratio is bound."""
+        if fields is None:
+            fields = self.FIELDS
+        for field in fields:
+            if field not in self.FIELDS:
+                raise ValueError('Invalid grid field %r' %(field,))
+        return tuple(f for f in self.FIELDS if f in fields and (self.has_pois or f == 'vp'))
+
+    def blocks(self):
+        """Get the block table of the model(see `blocks.BlockTable`). The
+        table is compiled again only for the layers modified since the last
+        call."""
+        self._blocks = BlockTable.build(self.model, self._blocks)
+        return self._blocks
+
     def get_vp_data(self):
         """Get Vp data"""
         data = []
-        for ily in range(len(self.model)-1):
-            ly_cur, ly_next = self.model[ily], self.model[ily+1]
-            x_top, x_bot = ly_cur.depth.x, ly_next.depth.x
-            y_top, y_bot = ly_cur.depth.y, ly_next.depth.y
+        for ily, lb in enumerate(self.blocks()):
+            ly_cur = self.model[ily]
             x_v_top, x_v_bot = ly_cur.v_top.x, ly_cur.v_bot.x
-            y_v_top = np.interp(x_v_top, x_top, y_top)
-            y_v_bot = np.interp(x_v_bot, x_bot, y_bot)
+            y_v_top = np.interp(x_v_top, lb.x, lb.y_top)
+            y_v_bot = np.interp(x_v_bot, lb.x, lb.y_bot)
             data.append(([x_v_top, y_v_top], [x_v_bot, y_v_bot]))
         return data
 
@@ -699,8 +1166,18 @@ class ModelManager():
         vv = (v_bot - v_top) * (yy - y_top) / (y_bot - y_top) + v_top
         return vv
 
-    def get_v_contour(self, xlim=None, ylim=None, nxgrid=None, nygrid=None):
-        """Get velocity grid data by interpolating velocity block by block"""
+    def get_v_contour(self, xlim=None, ylim=None, nxgrid=None, nygrid=None, method='scanline',
+            fields=None, dtype=float):
+        """Get velocity grid data (x, y, vp, vs, pois): the 1-D axes of the
+        grid, and grids in the shape of (len(y), len(x)).
+        `fields` and `dtype` are passed to `interp_grid` in 'scanline' method,
+        only the grids of `fields` are computed and the others are None.
+        `method` chooses how the grid is interpolated:
+            'scanline' - evaluate every layer boundary once per grid column and
+                locate the layer and block of each grid cell by sorting, see
+                `interp_grid`;
+            'block' - interpolate velocity block by block over full-grid masks,
+                which is much slower and kept for checking results."""
         if not xlim:
             xlim = self.model.xlim
         if not ylim:
@@ -712,7 +1189,169 @@ class ModelManager():
 
         x = np.linspace(xlim[0], xlim[1], nxgrid)
         y = np.linspace(ylim[0], ylim[1], nygrid)
-        xx, yy = np.meshgrid(x, y)
+        if method == 'scanline':
+            # in tiles, which bounds the temporary memory
+            from grid import compute_grid
+            vp, vs, pois = compute_grid(self, x, y, workers=1, fields=fields, dtype=dtype)
+        elif method == 'block':
+            vp, vs, pois = self.interp_grid_by_block(*np.broadcast_arrays(x, y[:, None]))
+        else:
+            raise ValueError('Invalid parameter "method"')
+        return x, y, vp, vs, pois
+
+    def interp_grid(self, x, y, fields=None, dtype=float):
+        """Interpolate velocity on the grid spanned by 1-D axes `x` and `y`,
+        return (vp, vs, pois) in the shape of (len(y), len(x)).
+        Only the grids of `fields`(see `grid_fields`) are computed, the others
+        are None. Grids are computed in float64 and stored in `dtype`.
+        Every grid column is independent of the others, so the grid can also be
+        computed piece by piece on slices of `x`."""
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        nx, ny = len(x), len(y)
+        nlayer = len(self.model) - 1
+        out = {f: np.full((ny, nx), np.nan, dtype=dtype) for f in self.grid_fields(fields)}
+        result = tuple(out.get(f) for f in self.FIELDS)
+        if nlayer < 1 or nx == 0 or ny == 0:
+            return result
+        # vs is derived from vp and pois
+        need_vp = 'vp' in out or 'vs' in out
+        need_pois = 'pois' in out or 'vs' in out
+
+        # Rows are located by `searchsorted`, which needs ascending y
+        order = None
+        if np.any(np.diff(y) < 0):
+            order = np.argsort(y, kind='stable')
+            y = y[order]
+
+        # Depth of every layer boundary at every grid column. Where a boundary
+        # cuts above the one over it, the deeper layer takes the overlapping
+        # part, just like the later layer overrides in the per-block path.
+        bounds = np.array([np.interp(x, ly.depth.x, ly.depth.y) for ly in self.model])
+        bounds = np.minimum.accumulate(bounds[::-1], axis=0)[::-1]
+        # The first grid row on or under each boundary. Rows between the
+        # boundaries of a layer belong to the layer, so counting the boundaries
+        # above each row gives the layer index of every grid cell.
+        rows = np.searchsorted(y, bounds, side='left')
+        marks = np.zeros((ny+1, nx), dtype=np.int16)
+        np.add.at(marks, (rows, np.arange(nx)), 1)
+        cell_layer = np.cumsum(marks[:-1], axis=0, dtype=np.int16) - 1
+        del marks
+        # Cells outside of the model point to a trailing row of NaN
+        cell_layer[(cell_layer < 0) | (cell_layer >= nlayer)] = nlayer
+
+        # Velocity on the top/bottom of the block each column falls in, layer
+        # by layer. `np.interp` on all the block corners of a layer picks the
+        # same block and does the same arithmetic as `interp_block`.
+        y_top_c, y_bot_c, v_top_c, v_bot_c, pois_c = \
+            [np.full((nlayer+1, nx), np.nan) for _ in range(5)]
+        table = self.blocks()
+        for ily, lb in enumerate(table):
+            if len(lb.x) < 2:
+                continue
+            inside = (lb.x[0] <= x) & (x <= lb.x[-1])
+            xin = x[inside]
+            if need_vp:
+                y_top_c[ily, inside] = np.interp(xin, lb.x, lb.y_top)
+                y_bot_c[ily, inside] = np.interp(xin, lb.x, lb.y_bot)
+                v_top_c[ily, inside] = np.interp(xin, lb.x, lb.v_top)
+                v_bot_c[ily, inside] = np.interp(xin, lb.x, lb.v_bot)
+            if need_pois:
+                pois_c[ily, inside] = lb.pois[table.locate(ily, xin)]
+
+        def gather(table):
+            return np.take_along_axis(table, cell_layer, axis=0)
+
+        if need_vp:
+            y_top_g = gather(y_top_c)
+            v_top_g = gather(v_top_c)
+            vp = (gather(v_bot_c) - v_top_g) * (y[:, None] - y_top_g) \
+                / (gather(y_bot_c) - y_top_g) + v_top_g
+            del y_top_g, v_top_g
+            if 'vp' in out:
+                out['vp'][...] = vp
+        if need_pois:
+            pois = gather(pois_c)
+            if 'pois' in out:
+                out['pois'][...] = pois
+            if 'vs' in out:
+                out['vs'][...] = self.vp2vs(vp, pois)
+
+        if order is not None:
+            for grid in result:
+                if grid is not None:
+                    grid[order] = grid.copy()
+        return result
+
+    def query(self, x, y):
+        """Get velocity at arbitrary points (x, y), y being depth. `x` and `y`
+        are broadcast against each other.
+        Return (vp, vs, pois, layer, block) in the broadcast shape: velocity and
+        poission ratio(None if not bound), and the index of the layer and of the
+        block in the layer each point falls in, -1 for points out of the model.
+        Velocity is the same as that of `interp_grid` on a grid through the
+        points. Points are processed `QUERY_CHUNK` at a time."""
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        shape = x.shape
+        # `np.interp` is much faster on sorted points
+        order = np.argsort(x.ravel(), kind='stable')
+        x, y = x.ravel()[order], y.ravel()[order]
+        vp = np.full(len(x), np.nan)
+        vs = pois = None
+        if self.has_pois:
+            vs = np.full(len(x), np.nan)
+            pois = np.full(len(x), np.nan)
+        layer = np.full(len(x), -1, dtype=np.int32)
+        block = np.full(len(x), -1, dtype=np.int32)
+        for start in range(0, len(x), self.QUERY_CHUNK):
+            chunk = slice(start, start+self.QUERY_CHUNK)
+            self._query_chunk(x[chunk], y[chunk], vp[chunk],
+                None if vs is None else vs[chunk], None if pois is None else pois[chunk],
+                layer[chunk], block[chunk])
+        result = []
+        for a in (vp, vs, pois, layer, block):
+            if a is not None:
+                a[order] = a.copy()
+                a = a.reshape(shape)
+            result.append(a)
+        return tuple(result)
+
+    def _query_chunk(self, x, y, vp, vs, pois, layer, block):
+        """Fill the output arrays of `query` for a chunk of points"""
+        nlayer = len(self.model) - 1
+        if nlayer < 1:
+            return
+        # A point on or under the top boundary of a layer(as clipped in
+        # `interp_grid`) and above the bottom one is in the layer, so count
+        # the boundaries above each point, from the bottom one up
+        ilayer = np.full(len(x), -1)
+        bound = np.full(len(x), np.inf)
+        for ly in reversed(self.model):
+            np.minimum(bound, np.interp(x, ly.depth.x, ly.depth.y), out=bound)
+            ilayer += bound <= y
+        table = self.blocks()
+        for ily in np.unique(ilayer[(ilayer >= 0) & (ilayer < nlayer)]):
+            lb = table[ily]
+            if len(lb.x) < 2:
+                continue
+            idx = np.flatnonzero(ilayer == ily)
+            idx = idx[(lb.x[0] <= x[idx]) & (x[idx] <= lb.x[-1])]
+            xin = x[idx]
+            y_top_p = np.interp(xin, lb.x, lb.y_top)
+            y_bot_p = np.interp(xin, lb.x, lb.y_bot)
+            v_top_p = np.interp(xin, lb.x, lb.v_top)
+            v_bot_p = np.interp(xin, lb.x, lb.v_bot)
+            vp[idx] = (v_bot_p - v_top_p) * (y[idx] - y_top_p) / (y_bot_p - y_top_p) + v_top_p
+            iblk = table.locate(ily, xin)
+            layer[idx] = ily
+            block[idx] = iblk
+            if pois is not None:
+                pois[idx] = lb.pois[iblk]
+                vs[idx] = self.vp2vs(vp[idx], pois[idx])
+
+    def interp_grid_by_block(self, xx, yy):
+        """Interpolate velocity on the grid `xx`, `yy` block by block.
+        Return (vp, vs, pois) like `interp_grid`."""
         vp = np.full(xx.shape, np.nan)
         vs = None
         pois = None
@@ -755,7 +1394,67 @@ class ModelManager():
                     vs[block_mask] = vs_blk
                     pois[block_mask] = pois_blk
 
-        return xx, yy, vp, vs, pois
+        return vp, vs, pois
+
+    def get_block_mesh(self, max_step=None):
+        """Triangulate the blocks of the model for Gouraud shading.
+        Inside a block, velocity is bilinear in x and the relative depth
+        between the top and bottom of the block, so velocity is exact along
+        the lines of a mesh in these coordinates. A block is cut into a mesh of
+        cells whose corners differ in velocity by `max_step` at most(by default
+        1/64 of the velocity range of the model), and every cell into 2
+        triangles. Blocks do not share vertices, so velocity jumps sharply
+        across layer boundaries, and poission ratio across blocks.
+        Return (x, y, triangles, vp, vs, pois): coordinates and values of the
+        vertices, and a n*3 array of vertex indexes of the triangles."""
+        blocks = []
+        for lb in self.blocks():
+            if len(lb.x) < 2:
+                continue
+            pois_blk = lb.pois if self.has_pois else np.full(len(lb.x)-1, np.nan)
+            blocks.append((lb.x, [lb.y_top, lb.y_bot, lb.v_top, lb.v_bot], pois_blk))
+
+        empty = np.empty(0)
+        if not blocks:
+            return empty, empty, np.empty((0, 3), dtype=int), empty, \
+                (empty if self.has_pois else None), (empty if self.has_pois else None)
+        if max_step is None:
+            v = np.hstack([np.hstack(corners[2:]) for _, corners, _ in blocks])
+            max_step = (v.max() - v.min()) / 64.
+        if not max_step > 0:
+            max_step = np.inf
+
+        xs, ys, vps, poiss, triangles = [], [], [], [], []
+        nvertex = 0
+        for x_all, (y_top, y_bot, v_top, v_bot), pois_blk in blocks:
+            # All the blocks of a layer are cut into the same number of cells
+            # along x and along depth
+            nx = np.max(np.maximum(abs(np.diff(v_top)), abs(np.diff(v_bot)))) / max_step
+            ns = np.max(abs(v_bot - v_top)) / max_step
+            nx, ns = [max(1, int(min(np.ceil(n), 64))) for n in (nx, ns)]
+            u = np.linspace(0, 1, nx+1)
+            s = np.linspace(0, 1, ns+1)[:, None, None]
+            # block by cell corner, corners in a block linearly interpolated
+            def corner(a):
+                return a[:-1, None] + u * np.diff(a)[:, None]
+            x, yt, yb, vt, vb = map(corner, (x_all, y_top, y_bot, v_top, v_bot))
+            shape = (ns+1,) + x.shape
+            xs.append(np.broadcast_to(x, shape).ravel())
+            ys.append((yt + s * (yb - yt)).ravel())
+            vps.append((vt + s * (vb - vt)).ravel())
+            poiss.append(np.broadcast_to(pois_blk[:, None], shape).ravel())
+            idx = nvertex + np.arange(np.prod(shape)).reshape(shape)
+            a, b, c, d = idx[:-1,:,:-1], idx[:-1,:,1:], idx[1:,:,:-1], idx[1:,:,1:]
+            triangles.append(np.stack([a, b, c, b, d, c], axis=-1).reshape(-1, 3))
+            nvertex += idx.size
+
+        x, y, vp = np.concatenate(xs), np.concatenate(ys), np.concatenate(vps)
+        triangles = np.concatenate(triangles)
+        vs, pois = None, None
+        if self.has_pois:
+            pois = np.concatenate(poiss)
+            vs = self.vp2vs(vp, pois)
+        return x, y, triangles, vp, vs, pois
 
     def get_v_section(self, x):
         y = []
@@ -771,23 +1470,40 @@ class ModelManager():
         return np.array(y), np.array(vp)
 
     def get_section_data(self, x):
-        """Get section data, including vp, vs and pois"""
-        y, vp, vs, pois = [], [], [], []
-        for ily in range(len(self.model)-1):
-            ly_cur, ly_next = self.model[ily], self.model[ily+1]
-            x_top, x_bot = ly_cur.depth.x, ly_next.depth.x
-            y_top, y_bot = ly_cur.depth.y, ly_next.depth.y
-            x_v_top, x_v_bot = ly_cur.v_top.x, ly_cur.v_bot.x
-            v_top, v_bot = ly_cur.v_top.y, ly_cur.v_bot.y
-
-            y_sec = [np.interp(x, x_top, y_top), np.interp(x, x_bot, y_bot)]
-            vp_sec = [np.interp(x, x_v_top, v_top), np.interp(x, x_v_bot, v_bot)]
-            y.extend(y_sec)
-            vp.extend(vp_sec)
-            if self.has_pois:
-                x_pois, pois_ly = ly_cur.pois['x'], ly_cur.pois['y']
-                pois_sec = [np.interp(x, x_pois, pois_ly)] * 2
-                vs_sec = self.vp2vs(np.array(vp_sec), np.array(pois_sec))
-                pois.extend(pois_sec)
-                vs.extend(vs_sec)
-        return np.array(y), np.array(vp), np.array(vs), np.array(pois)
+        """Get section data, including vp, vs and pois. This is fast for a
+        single x, see `get_sections` for many."""
+        y_top, y_bot, v_top, v_bot, pois = self.blocks().at(float(x))
+        y = np.stack([y_top, y_bot], axis=1).ravel()
+        vp = np.stack([v_top, v_bot], axis=1).ravel()
+        if not self.has_pois:
+            return y, vp, np.array([]), np.array([])
+        pois = np.repeat(pois, 2)
+        return y, vp, self.vp2vs(vp, pois), pois
+
+    def get_sections(self, x):
+        """Get the sections at many x positions at once. Return (y, vp, vs,
+        pois), each in the shape of (len(x), 2*nlayer): the depth and values
+        on the top and bottom of every layer(but the end layer) at each x,
+        ordered as in `get_section_data`. Values of layers without blocks are
+        NaN, vs and pois are None if poission ratio is not bound."""
+        x = np.asarray(x, dtype=float).ravel()
+        table = self.blocks()
+        shape = (len(x), 2*len(table))
+        y, vp = np.full(shape, np.nan), np.full(shape, np.nan)
+        vs = pois = None
+        if self.has_pois:
+            pois = np.full(shape, np.nan)
+        for ily, lb in enumerate(table):
+            if len(lb.x) == 0:
+                continue
+            top, bot = 2*ily, 2*ily+1
+            y[:, top] = np.interp(x, lb.x, lb.y_top)
+            y[:, bot] = np.interp(x, lb.x, lb.y_bot)
+            vp[:, top] = np.interp(x, lb.x, lb.v_top)
+            vp[:, bot] = np.interp(x, lb.x, lb.v_bot)
+            if pois is not None and len(lb.pois):
+                # Poission ratio of the block the section cuts, like in grids
+                pois[:, top] = pois[:, bot] = lb.pois[table.locate(ily, x)]
+        if pois is not None:
+            vs = self.vp2vs(vp, pois)
+        return y, vp, vs, pois
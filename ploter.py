@@ -1,23 +1,88 @@
-from collections import OrderedDict
+from collections import OrderedDict, deque
 import os
+import time
 
 import matplotlib
+from matplotlib.contour import ContourSet
+from matplotlib.patches import Rectangle
 import matplotlib.pyplot as plt
 import numpy as np
+try:
+    import contourpy
+except ImportError:
+    contourpy = None
 
+from grid import TILE_CELLS, compute_grid
 from util import get_file_logger, Delegator
-from model import Model, NodeIndex
+from model import Model, ModelManager, NodeIndex
+from journal import (EditJournal, CompoundEntry, MoveEntry, InsertNodeEntry,
+    DeleteNodeEntry, InsertLayerEntry, DeleteLayerEntry)
+from spatial import NodeGrid
 
 
 cur_dir = os.path.dirname(os.path.abspath(__file__))
 
 
+class BlitManager(object):
+    """Redraw a few animated artists of a figure over a saved background
+    instead of drawing the whole figure. The background(the figure without
+    the animated artists) is saved on every full draw of the canvas."""
+    def __init__(self, canvas, artists=()):
+        self.canvas = canvas
+        self.background = None
+        self.artists = []
+        for artist in artists:
+            self.add_artist(artist)
+        self.cid = canvas.mpl_connect('draw_event', self.on_draw)
+
+    def add_artist(self, artist):
+        artist.set_animated(True)
+        self.artists.append(artist)
+
+    def on_draw(self, event):
+        # forget artists removed from the figure
+        self.artists = [a for a in self.artists if a.figure is self.canvas.figure]
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        for artist in self.artists:
+            if artist.figure is self.canvas.figure:
+                self.canvas.figure.draw_artist(artist)
+
+    def update(self):
+        """Show the current state of the animated artists"""
+        if self.background is None:
+            # the background is saved on drawing
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self.background)
+        self.draw_artists()
+        self.canvas.blit(self.canvas.figure.bbox)
+
+    def disconnect(self):
+        """Stop managing the artists, which are drawn as usual again"""
+        self.canvas.mpl_disconnect(self.cid)
+        for artist in self.artists:
+            artist.set_animated(False)
+        self.artists.clear()
+        self.background = None
+
+
 class BasePloter(object):
     """Base class for making interactive plot based on a model object"""
 
     # Each type of nodes has a unique marker in plot. depth nodes: circle;
     # top velocity: downward-triangle; bottom velocity: upward-triangle
     MARKERS = OrderedDict([('depth', 'o'), ('v_top', 'v'), ('v_bottom', '^')])
+    # A click picks nodes and lines within this distance in pixels
+    PICK_RADIUS = 5
+    # Number of the latest frames whose latency is kept, see `frame_shown`
+    LATENCY_SAMPLES = 100
+    # Nodes dragged by the mouse move at most once in this many milliseconds
+    FRAME_INTERVAL = 16
+    # A press moving less than this many pixels is a click, not a drag
+    DRAG_THRESHOLD = 3
 
     def __init__(self, window=None):
         # window is a proxy for `MainWindow`, which provides many attributs and methods.
@@ -26,13 +91,40 @@ class BasePloter(object):
         self.canvas = self.wd.canvas
         self.ax = self.wd.ax
         self.model = None
+        # queried by the cursor readout, see `ModelPloter.format_coord`
+        self.model_manager = None
         self.lines = []
         self.texts = []
         self.selected = set()
         self.select_mark = None
+        # rubber band of the rectangle selection, see `on_button_press`
+        self.band = None
+        self.band_start = None
+        # spatial index of the nodes, see `get_node_grid`
+        self.node_grid = None
+        # nodes dragged by the mouse(an n*3 array), see `start_drag`
+        self.drag_nodes = None
+        self.drag_start = None
+        self.drag_to = None
+        self.drag_delta = (0., 0.)
+        self.drag_lock_x = False
+        self.drag_moved = False
+        self.drag_click = None
+        self.drag_timer = None
+        self.drag_pending = False
+        # lines being edited and the selection are blitted, see `draw_blit`
+        self.blit = None
+        # when the key being handled was pressed, and that of the frame to
+        # show its effect, see `frame_shown`
+        self.key_time = None
+        self.frame_key_time = None
+        self.latency = dict(blit=deque(maxlen=self.LATENCY_SAMPLES),
+            draw=deque(maxlen=self.LATENCY_SAMPLES))
         self.ctrl_mode = False
+        # undo/redo history of edits
+        self.journal = EditJournal()
         self.line_style = dict(
-            linestyle='--', color='k', markersize=4, picker=5, linewidth=1,
+            linestyle='--', color='k', markersize=4, linewidth=1,
             markeredgewidth=1, markerfacecolor='None')
         self.logger = get_file_logger(
             name = type(self).__name__,
@@ -47,42 +139,99 @@ class BasePloter(object):
         self.select_mark, = self.ax.plot(
             [], [], 'rs', zorder=100, ms=6, markeredgewidth=1, markerfacecolor='k',
             visible=False)
+        # added as an artist, so that it takes no part in autoscaling
+        self.band = Rectangle((0, 0), 0, 0, fill=False, edgecolor='b', linestyle=':',
+            zorder=101, visible=False)
+        self.ax.add_artist(self.band)
+        if self.blit is None:
+            self.blit = BlitManager(self.canvas)
+        self.blit.add_artist(self.select_mark)
+        self.blit.add_artist(self.band)
 
     def bind_event(self):
         """Bind button events and key events"""
-        self.canvas.mpl_connect('pick_event', self.on_pick)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
         self.canvas.mpl_connect('button_press_event', self.on_button_press)
+        self.canvas.mpl_connect('motion_notify_event', self.on_motion)
+        self.canvas.mpl_connect('button_release_event', self.on_button_release)
 
     def draw_select(self):
         """Show select-mask when some node(s) is selected"""
-        self.logger.debug('selected nodes: ' + ', '.join(map(str, sorted(list(self.selected)))))
+        # sorting tuples is much faster than sorting NodeIndex objects
+        node_indexes = sorted(ni[:] for ni in self.selected)
+        self.logger.debug('selected nodes: ' + ', '.join(map(str, node_indexes)))
         if not self.selected:
             xs, ys = [], []
         else:
-            node_indexes = sorted(list(self.selected))
-            nodes = [self.model.get_node(ni) for ni in node_indexes]
+            xs, ys, flags = self.model.get_nodes(node_indexes)
             # Echo message for selected nodes
             echo_msg = '\n'.join(['[ i, j]: ( x, z, flag)', '-'*28]) + '\n' + \
-                '\n'.join(['[%2d,%2d]: (%6.3f,%6.3f,%2d)' %(ni.ilayer, ni.inode, nd[0], nd[1], nd[2]) \
-                for ni, nd in zip(node_indexes, nodes)])
+                '\n'.join(['[%2d,%2d]: (%6.3f,%6.3f,%2d)' %(ni[0], ni[2], x, y, flag) \
+                for ni, x, y, flag in zip(node_indexes, xs, ys, flags)])
             # If there are 2 nodes selected, show there distance in addition
-            if len(nodes) == 2:
-                nd1, nd2 = nodes[0], nodes[1]
-                dx, dy = nd2[0] - nd1[0], nd2[1] - nd1[1]
+            if len(node_indexes) == 2:
+                dx, dy = xs[1] - xs[0], ys[1] - ys[0]
                 d = (dx**2 + dy**2)**0.5
                 echo_msg += '\n\n' + '\n'.join([
                     'distance_x = %6.3f',
                     'distance_y = %6.3f',
                     'distance   = %6.3f']) %(dx, dy, d)
             self.wd.echo.set(echo_msg)
-            xs, ys, _ = zip(*nodes)
         self.select_mark.set_data(xs, ys)
         self.select_mark.set_visible(True)
 
     def draw(self):
         """Update the plot after data changed or plot changed"""
+        self.request_frame()
+        # blitting before the figure is drawn would show an old background
+        self.blit.background = None
         self.canvas.draw_idle()
 
+    def draw_blit(self, lines=()):
+        """Update the plot after only the selection and `lines` changed, by
+        redrawing them over the background saved on the last full draw(see
+        `BlitManager`). Lines edited for the first time are taken out of the
+        background with a full draw, so following edits of them are fast. The
+        figure is drawn in full anyway on zooming, panning and resizing."""
+        self.request_frame()
+        new_lines = [line for line in lines if line not in self.blit.artists]
+        for line in new_lines:
+            self.blit.add_artist(line)
+        if new_lines:
+            self.blit.background = None
+        self.blit.update()
+        self.frame_shown('blit')
+
+    def request_frame(self):
+        """Take the time of the key being handled as that of the next frame"""
+        if self.key_time is not None:
+            self.frame_key_time, self.key_time = self.key_time, None
+
+    def frame_shown(self, kind):
+        """Record the latency from a key press to the frame showing it"""
+        if self.frame_key_time is None:
+            return
+        dt = time.perf_counter() - self.frame_key_time
+        self.frame_key_time = None
+        self.latency[kind].append(dt)
+        self.logger.debug('Key press to frame: %.1f ms (%s)' %(dt*1e3, kind))
+        if sum(len(v) for v in self.latency.values()) % self.LATENCY_SAMPLES == 0:
+            self.logger.info(self.latency_summary())
+
+    def latency_summary(self):
+        """Median and maximum latency from a key press to the frame showing
+        it, of blitted frames and of full draws"""
+        items = []
+        for kind, samples in self.latency.items():
+            if samples:
+                items.append('%s: %d frames, median %.1f ms, max %.1f ms' %(kind,
+                    len(samples), np.median(samples)*1e3, max(samples)*1e3))
+        return 'Key press to frame latency, ' + ('; '.join(items) or 'no frames')
+
+    def on_draw(self, event):
+        """Callback funtion for draw event"""
+        self.frame_shown('draw')
+
     def move_left(self, step_large=False):
         """Move every selected node left a bit"""
         delta_x = -self.wd.dx_lg if step_large else -self.wd.dx_sm
@@ -108,30 +257,38 @@ class BasePloter(object):
         self.move(delta_x, delta_y)
 
     def move(self, delta_x, delta_y):
-        """Move every selected node along the vector <delta_x, delta_y>"""
-        for node_idx in self.selected:
-            try:
-                new_x, new_y = self.model.move_node(node_idx, delta_x, delta_y)
-            except Exception as e:
-                self.wd.show_warning('Warning',
-                    'Failed to move nodes, the following error occured:\n\n%s'
-                    %(', '.join(map(str, e.args))))
-                continue
-            self.update_node(node_idx, new_x, new_y)
-        # if the first node of any layer was moved, then redraw the text
+        """Move every selected node along the vector <delta_x, delta_y>. The
+        nodes of every part are moved at once(see `Model.move_nodes`) and every
+        line changed is updated once."""
+        nodes = self.model.node_array(sorted(ni[:] for ni in self.selected))
+        fixed = self.model.fixed_in_x(nodes) & (abs(delta_x) > 1e-6)
+        if fixed.any():
+            self.wd.show_warning('Warning',
+                'Failed to move nodes, the following error occured:\n\n%s'
+                %'Can not move the LEADING or ENDING node of a layer')
+            nodes = nodes[~fixed]
+        if len(nodes):
+            self.model.move_nodes(nodes, delta_x, delta_y)
+            self.journal.record(MoveEntry(
+                nodes, [delta_x]*len(nodes), [delta_y]*len(nodes)))
+        lines = self.update_lines(np.unique(nodes[:, 0]))
+        self.draw_select()
+        # if the first node of any layer was moved, then move the text
         # label binding to the node
-        if 0 in [node_idx.inode for node_idx in self.selected]:
+        if np.any(nodes[:, 2] == 0):
             self.draw_texts()
-        self.draw_select()
-        self.draw()
-
-    def update_node(self, node_idx, new_x, new_y):
-        """Update coordinates of nodes after they are modified"""
-        line = self.get_line_by_tpl_idx((node_idx.ilayer, node_idx.ipart))
-        xs, ys = line.get_data()
-        xs[node_idx.inode] = new_x
-        ys[node_idx.inode] = new_y
-        line.set_data(xs, ys)
+            lines += self.texts
+        self.draw_blit(lines)
+
+    def update_lines(self, ilayers):
+        """Update the lines of the given layers from the model and return
+        them"""
+        lines = []
+        for i in ilayers:
+            self.lines[i].set_data(self.model[i].depth.x.copy(),
+                self.model[i].depth.y.copy())
+            lines.append(self.lines[i])
+        return lines
 
     def select_next(self, accumulate=False):
         """Select the next node of every currently selected node,
@@ -142,7 +299,7 @@ class BasePloter(object):
             ilayer, ipart = self.get_tpl_idx_by_line(self.lines[0])
             self.selected.add(NodeIndex(ilayer, ipart, 0))
             self.draw_select()
-            self.draw()
+            self.draw_blit()
             return
         new_selected = set()
         for node_idx in self.selected:
@@ -154,7 +311,7 @@ class BasePloter(object):
             self.selected.clear()
         self.selected.update(new_selected)
         self.draw_select()
-        self.draw()
+        self.draw_blit()
 
     def select_previous(self, accumulate=False):
         """Select the previous node of every currently selected node,
@@ -165,7 +322,7 @@ class BasePloter(object):
             ilayer, ipart = self.get_tpl_idx_by_line(self.lines[0])
             self.selected.add(NodeIndex(ilayer, ipart, 0))
             self.draw_select()
-            self.draw()
+            self.draw_blit()
             return
         new_selected = set()
         for node_idx in self.selected:
@@ -177,71 +334,102 @@ class BasePloter(object):
             self.selected.clear()
         self.selected.update(new_selected)
         self.draw_select()
-        self.draw()
+        self.draw_blit()
 
     def insert_nodes(self):
-        """Insert nodes to the right of every selected node"""
-        ilayers = [node_idx[0] for node_idx in self.selected]
-        if len(ilayers) != len(set(ilayers)):
-            self.wd.show_warning('Warning'
-                'Can not insert nodes\nPlease Make sure that every 2 selected '
-                'nodes are not in the same layer')
-            return
-        for node_idx in self.selected:
-            try:
-                x, y, vary = self.model.insert_node(node_idx)
-            except Exception as e:
-                self.wd.show_warning('Warning',
-                    'Failed to inserte nodes, the following error occured:\n\n%s'
-                    %(', '.join(map(str, e.args))))
-                continue
-            line = self.lines[node_idx.ilayer]
-            xs, ys = line.get_data()
-            xs = np.insert(xs, node_idx.inode+1, x)
-            ys = np.insert(ys, node_idx.inode+1, y)
-            line.set_data(xs, ys)
-        # self.selected.clear()
+        """Insert nodes to the right of every selected node. The nodes of every
+        part are inserted at once(see `Model.insert_nodes`) and every line
+        changed is updated once."""
+        nodes = self.model.node_array(sorted(ni[:] for ni in self.selected))
+        ending = nodes[:, 2] == self.model.part_sizes(nodes)-1
+        if ending.any():
+            self.wd.show_warning('Warning',
+                'Failed to insert %d nodes, the following error occured:\n\n%s'
+                %(ending.sum(), 'Can not insert node after the ENDING node of a layer'))
+            nodes = nodes[~ending]
+        if len(nodes):
+            inserted, values = self.model.insert_nodes(nodes)
+            self.journal.record(InsertNodeEntry(inserted, values))
+            # selected nodes are shifted by the nodes inserted left to them
+            after = {}
+            for ilayer, ipart, inode in nodes:
+                after.setdefault((ilayer, ipart), []).append(inode)
+            self.selected = set(NodeIndex(ni.ilayer, ni.ipart, ni.inode + int(np.searchsorted(
+                after.get((ni.ilayer, ni.ipart), []), ni.inode)))
+                for ni in self.selected)
+        self.update_lines(np.unique(nodes[:, 0]))
         self.draw_select()
         self.draw()
 
     def delete_nodes(self):
-        """Delete all the selected nodes"""
-        ilayers = [node_idx[0] for node_idx in self.selected]
-        if len(ilayers) != len(set(ilayers)):
+        """Delete all the selected nodes. The nodes of every part are deleted
+        at once(see `Model.delete_nodes`) and every line changed is updated
+        once."""
+        nodes = self.model.node_array(sorted(ni[:] for ni in self.selected))
+        fixed = self.model.fixed_in_x(nodes)
+        if fixed.any():
             self.wd.show_warning('Warning',
-                'Can not delete nodes\nPlease Make sure that every 2 selected '
-                'nodes are not in the same layer')
-            return
-        for node_idx in self.selected:
-            try:
-                is_layer_empty = self.model.delete_node(node_idx)
-            except Exception as e:
-                self.wd.show_warning('Warning',
-                    'Failed to delete nodes, the following error occured:\n\n%s'
-                    %(', '.join(map(str, e.args))))
-                continue
-            if is_layer_empty:
-                line = self.lines.pop(node_idx.ilayer)
-                self.ax.lines.remove(line)
-                self.draw_texts()
-                continue
-            line = self.lines[node_idx.ilayer]
-            xs, ys = line.get_data()
-            xs = np.delete(xs, node_idx.inode)
-            ys = np.delete(ys, node_idx.inode)
-            line.set_data(xs, ys)
+                'Failed to delete %d nodes, the following error occured:\n\n%s'
+                %(fixed.sum(), 'Can not delete LEADING or ENDING node of a layer'))
+            nodes = nodes[~fixed]
+        if len(nodes):
+            values = np.column_stack(self.model.get_nodes(nodes))
+            self.model.delete_nodes(nodes)
+            self.journal.record(DeleteNodeEntry(nodes, values))
+        self.update_lines(np.unique(nodes[:, 0]))
         self.selected.clear()
         self.draw_select()
         self.draw()
 
-    def on_button_press(self, event):
-        """Callback funtion for button press event"""
-        if not self.model:
+    def undo(self):
+        """Undo the last edit"""
+        if self.model is None:
             return
-        self.logger.debug('Button pressed: %s' %event.button)
-        if event.inaxes is None:
-            self.logger.debug('But cursor not in axes.')
+        try:
+            entry = self.journal.undo(self.model)
+        except Exception as e:
+            self.logger.exception(e)
+            self.wd.show_error('Error',
+                'Failed to undo, the following error occured:\n%s'
+                %(', '.join(map(str, e.args))))
+            self.journal.clear()
+            return
+        if entry is not None:
+            self.sync_lines(entry.ilayers)
+
+    def redo(self):
+        """Redo the last undone edit"""
+        if self.model is None:
+            return
+        try:
+            entry = self.journal.redo(self.model)
+        except Exception as e:
+            self.logger.exception(e)
+            self.wd.show_error('Error',
+                'Failed to redo, the following error occured:\n%s'
+                %(', '.join(map(str, e.args))))
+            self.journal.clear()
             return
+        if entry is not None:
+            self.sync_lines(entry.ilayers)
+
+    def sync_lines(self, ilayers=None):
+        """Update lines after the model was changed behind the plot (by
+        undo/redo). Only lines of the given layers are updated, or all the
+        lines are plotted again if `ilayers` is None"""
+        if ilayers is None:
+            for line in self.lines:
+                line.remove()
+            self.lines.clear()
+            self.plot_model()
+        else:
+            self.update_lines(ilayers)
+            self.draw_texts()
+        # selected nodes may be gone
+        self.selected.difference_update(
+            [ni for ni in self.selected if self.model.get_node(ni) is None])
+        self.draw_select()
+        self.draw()
 
     def get_tpl_idx_by_line(self, line):
         """Get the index of corresponding TripleLine object for the selected
@@ -255,42 +443,206 @@ class BasePloter(object):
         ilayer, ipart = tpl_idx
         return self.lines[ilayer]
 
-    def on_pick(self, event):
-        """Callback funtion for mouse pick event"""
-        # only allow left button to pick
-        self.logger.debug('Pick event occured')
-        if event.mouseevent.button != 1:
-            return
-        # clear previously selected nodes on each pick
-        if not self.ctrl_mode:
-            self.selected.clear()
-        ilayer, ipart = self.get_tpl_idx_by_line(event.artist)
-        # find the closest node as the node to select
-        x = event.mouseevent.xdata
-        y = event.mouseevent.ydata
+    def get_node_grid(self):
+        """Get the spatial index of the nodes(see `spatial.NodeGrid`), which is
+        built again only after the model changed."""
+        self.node_grid = NodeGrid.build(self.model, self.node_grid)
+        return self.node_grid
+
+    def get_pixel_scale(self):
+        """Pixels per data unit along x and y"""
+        (x0, y0), (x1, y1) = self.ax.transData.transform([(0, 0), (1, 1)])
+        return abs(x1 - x0), abs(y1 - y0)
+
+    def hit_line(self, x, y, scale):
+        """Get the layer whose line passes nearest to (x, y) within
+        `PICK_RADIUS` pixels, and the index of the node starting the segment
+        hit. Return (None, None) if no line is hit."""
+        sx, sy = scale
+        best, best_dist = (None, None), self.PICK_RADIUS
+        for ilayer, line in enumerate(self.lines):
+            xs, ys = line.get_data()
+            if len(xs) < 2 or not xs[0] <= x <= xs[-1]:
+                continue
+            i = min(max(np.searchsorted(xs, x) - 1, 0), len(xs) - 2)
+            # distance in pixels to the segment
+            px, py = xs[i] * sx, ys[i] * sy
+            dx, dy = xs[i+1] * sx - px, ys[i+1] * sy - py
+            t = ((x*sx - px) * dx + (y*sy - py) * dy) / max(dx*dx + dy*dy, 1e-12)
+            t = min(max(t, 0), 1)
+            dist = np.hypot(px + t*dx - x*sx, py + t*dy - y*sy)
+            if dist <= best_dist:
+                best, best_dist = (ilayer, i), dist
+        return best
+
+    def pick(self, x, y):
+        """Get the nodes picked by a click at (x, y): the node nearest to the
+        click if it is within the pick size("pick" in the window), or the whole
+        line clicked on. Return an empty set if nothing is hit."""
+        grid = self.get_node_grid()
+        scale = self.get_pixel_scale()
+        inear, _ = grid.nearest(x, y, self.PICK_RADIUS, scale)
+        ilayer, iseg = self.hit_line(x, y, scale)
+        # nodes near the click, and the nodes at both ends of the segment hit
+        candidates = []
+        if inear is not None:
+            candidates.append(grid.node_index(inear))
+            if ilayer is None:
+                ilayer = int(grid.ilayer[inear])
+        if iseg is not None:
+            candidates.extend([NodeIndex(ilayer, 0, iseg), NodeIndex(ilayer, 0, iseg+1)])
+        if not candidates:
+            return set()
+        nodes = [self.model.get_node(ni) for ni in candidates]
+        distances = [np.hypot(x - nd[0], y - nd[1]) for nd in nodes]
+        imin = int(np.argmin(distances))
         self.logger.debug('Cursor picked at (%f, %f), selected layer %d' %(x, y, ilayer))
-        xs, ys = event.artist.get_data()
-        distances = np.hypot(x - xs[event.ind], y - ys[event.ind])
-        idx_min = distances.argmin()
-        min_dist = distances[idx_min]
-
         # select the whole line, if even the closest node is still too
         # far(the distance is larger than pick_tolerence)
-        new_selected = set()
-        if min_dist > self.wd.pick:
-            new_selected = set([NodeIndex(ilayer,ipart,inode) for inode in
-                range(len(event.artist.get_xdata()))])
-        else:
-            inode = event.ind[idx_min]
-            new_selected.add(NodeIndex(ilayer,ipart,inode))
+        if distances[imin] > self.wd.pick:
+            return set(NodeIndex(ilayer, 0, inode) for inode in range(len(self.model[ilayer].depth)))
+        return set([candidates[imin]])
 
-        # if in ctrl-mode, allow multiple selection and anti-selection
-        if self.ctrl_mode and self.selected.issuperset(new_selected):
+    def select(self, new_selected):
+        """Select nodes, or in ctrl-mode, add them to the selection(or take
+        them out if all of them are selected already)"""
+        if not self.ctrl_mode:
+            self.selected.clear()
+        if self.ctrl_mode and new_selected and self.selected.issuperset(new_selected):
             self.selected.difference_update(new_selected)
         else:
             self.selected.update(new_selected)
         self.draw_select()
-        self.draw()
+        self.draw_blit()
+
+    def on_button_press(self, event):
+        """Callback funtion for button press event. A left click picks nodes
+        (see `pick`), a left drag from a node or line moves the selected nodes
+        (see `start_drag`), and from where nothing is picked selects the nodes
+        in a rectangle."""
+        if not self.model:
+            return
+        # not the effect of a key press
+        self.key_time = None
+        if self.drag_nodes is not None:
+            # the release of the last drag was missed
+            self.end_drag()
+        self.logger.debug('Button pressed: %s' %event.button)
+        if event.inaxes is None:
+            self.logger.debug('But cursor not in axes.')
+            return
+        # only allow left button to pick, and not while panning or zooming
+        toolbar = getattr(self.canvas, 'toolbar', None)
+        if event.button != 1 or (toolbar is not None and toolbar.mode):
+            return
+        new_selected = self.pick(event.xdata, event.ydata)
+        if not new_selected:
+            self.band_start = (event.xdata, event.ydata)
+            return
+        if self.ctrl_mode:
+            self.select(new_selected)
+            return
+        if self.selected.issuperset(new_selected):
+            # dragging moves all the selected nodes, a click selects the
+            # nodes picked
+            self.start_drag(event, click=new_selected)
+        else:
+            self.select(new_selected)
+            self.start_drag(event)
+
+    def start_drag(self, event, click=None):
+        """Start moving the selected nodes with the mouse. Motion events are
+        coalesced into one move of the nodes per frame(see `drag_frame`), and
+        the whole drag is recorded as a single edit. A drag which takes any
+        leading or ending node can only move the nodes up and down. `click`
+        are the nodes to select if the mouse is released without dragging."""
+        self.drag_nodes = self.model.node_array(sorted(ni[:] for ni in self.selected))
+        self.drag_start = self.drag_to = (event.xdata, event.ydata, event.x, event.y)
+        self.drag_delta = (0., 0.)
+        self.drag_lock_x = bool(self.model.fixed_in_x(self.drag_nodes).any())
+        self.drag_moved = False
+        self.drag_click = click
+        if self.drag_timer is None:
+            self.drag_timer = self.canvas.new_timer(interval=self.FRAME_INTERVAL)
+            self.drag_timer.single_shot = True
+            self.drag_timer.add_callback(self.drag_frame)
+
+    def drag_frame(self):
+        """Move the dragged nodes to the latest position of the mouse"""
+        self.drag_pending = False
+        if self.drag_nodes is None:
+            return
+        dx = 0. if self.drag_lock_x else self.drag_to[0] - self.drag_start[0]
+        dy = self.drag_to[1] - self.drag_start[1]
+        if (dx, dy) == self.drag_delta:
+            return
+        self.model.move_nodes(self.drag_nodes, dx - self.drag_delta[0], dy - self.drag_delta[1])
+        self.drag_delta = (dx, dy)
+        lines = self.update_lines(np.unique(self.drag_nodes[:, 0]))
+        # labels follow the first nodes of layers
+        if np.any(self.drag_nodes[:, 2] == 0):
+            self.draw_texts()
+            lines += self.texts
+        self.draw_select()
+        self.draw_blit(lines)
+
+    def end_drag(self):
+        """Finish moving nodes with the mouse"""
+        self.drag_frame()
+        self.drag_timer.stop()
+        nodes, (dx, dy) = self.drag_nodes, self.drag_delta
+        self.drag_nodes = None
+        if not self.drag_moved:
+            if self.drag_click is not None:
+                self.select(self.drag_click)
+            return
+        if dx == 0 and dy == 0:
+            return
+        self.logger.debug('Dragged %d nodes by (%f, %f)' %(len(nodes), dx, dy))
+        # a single edit, not merged with moves before or after
+        self.journal.seal()
+        self.journal.record(MoveEntry(nodes, [dx]*len(nodes), [dy]*len(nodes)))
+        self.journal.seal()
+
+    def on_motion(self, event):
+        """Callback funtion for mouse motion event"""
+        if self.drag_nodes is not None:
+            if event.inaxes is not self.ax:
+                return
+            if not self.drag_moved:
+                x0, y0 = self.drag_start[2:]
+                if np.hypot(event.x - x0, event.y - y0) < self.DRAG_THRESHOLD:
+                    return
+                self.drag_moved = True
+            self.drag_to = (event.xdata, event.ydata, event.x, event.y)
+            if not self.drag_pending:
+                self.drag_pending = True
+                self.drag_timer.start()
+            return
+        if self.band_start is None or event.inaxes is not self.ax:
+            return
+        x0, y0 = self.band_start
+        self.band.set_bounds(x0, y0, event.xdata - x0, event.ydata - y0)
+        self.band.set_visible(True)
+        self.draw_blit()
+
+    def on_button_release(self, event):
+        """Callback funtion for button release event"""
+        if self.drag_nodes is not None:
+            self.end_drag()
+            return
+        if self.band_start is None:
+            return
+        self.band_start = None
+        if not self.band.get_visible():
+            # a click on nothing
+            return
+        self.band.set_visible(False)
+        x, y = self.band.get_x(), self.band.get_y()
+        w, h = self.band.get_width(), self.band.get_height()
+        grid = self.get_node_grid()
+        inside = grid.in_rect(min(x, x+w), max(x, x+w), min(y, y+h), max(y, y+h))
+        self.select(set(grid.node_index(i) for i in inside))
 
     def on_key_press(self, event):
         """Hot key definitions"""
@@ -308,6 +660,7 @@ class BasePloter(object):
             self.ctrl_mode = True
             return
 
+        self.key_time = time.perf_counter()
         if key == 'up':
             self.move_up(self.ctrl_mode)
             return
@@ -323,7 +676,7 @@ class BasePloter(object):
         if key == 'escape':
             self.selected.clear()
             self.draw_select()
-            self.draw()
+            self.draw_blit()
             return
         if key in ('n', 'N'):
             accumulate = key.isupper() or self.ctrl_mode
@@ -366,7 +719,9 @@ class ModelPloter(BasePloter):
     def open(self):
         self.ax.cla()
         self.lines.clear()
+        self.texts.clear()
         self.selected.clear()
+        self.journal.clear()
         self.set_axes()
         self.load_model()
 
@@ -378,11 +733,24 @@ class ModelPloter(BasePloter):
         self.ax.invert_yaxis()
         self.ax.set_xlabel('X (km)')
         self.ax.set_ylabel('Depth (km)')
+        self.ax.format_coord = self.format_coord
+
+    def format_coord(self, x, y):
+        """Readout of the cursor position, with the layer and velocity there"""
+        text = 'x=%.4f    y=%.4f' %(x, y)
+        if self.model:
+            vp, _, _, layer, block = self.model_manager.query(x, y)
+            if layer >= 0:
+                text += '    Ly%d  block %d  vp=%.4f' %(layer+1, block+1, vp)
+        return text
 
     def load_model(self):
         """Load model from v.in file"""
         try:
             self.model = Model.load(self.wd.vin_path)
+            # kept for the cursor readout, its block table is recompiled only
+            # for the layers edited since the last query
+            self.model_manager = ModelManager(self.model)
         except Exception as e:
             self.logger.exception(e)
             self.wd.show_error(
@@ -399,14 +767,17 @@ class ModelPloter(BasePloter):
         self.draw_texts()
 
     def draw_texts(self):
-        """Make a label for every line in the figure"""
-        self.ax.texts.clear()
+        """Make a label for every line in the figure, or move the labels to
+        follow the lines if there is one for every line already"""
+        if self.texts and len(self.texts) == len(self.lines):
+            for i, t in enumerate(self.texts):
+                t.set_position(self.get_text_position(i))
+            return
+        for t in self.texts:
+            t.remove()
         self.texts.clear()
         for i, line in enumerate(self.lines):
-            # texts will be in the middle of layer
-            # x, y = (line.get_xdata()[0], line.get_ydata()[0])
-            x, y = (0, line.get_ydata()[0])
-            y += self.model.get_thickness(i) / 2
+            x, y = self.get_text_position(i)
             t = self.ax.text(
                 x, y, 'Ly%s' %(i+1), fontsize=8, rotation=0, ha='right',
                 va='center', bbox=dict(
@@ -415,11 +786,18 @@ class ModelPloter(BasePloter):
                 )
             self.texts.append(t)
 
+    def get_text_position(self, ilayer):
+        """Position of the label of a line: in the middle of layer"""
+        # x, y = (line.get_xdata()[0], line.get_ydata()[0])
+        x, y = (0, self.lines[ilayer].get_ydata()[0])
+        y += self.model.get_thickness(ilayer) / 2
+        return x, y
+
     def is_modified(self):
         """Check if the model has been modified"""
         if not self.model:
             return False
-        return self.model != Model.load(self.wd.vin_path)
+        return self.model.is_modified()
 
     def save(self, path=None):
         """Save model back into current v.in file"""
@@ -439,7 +817,14 @@ class ModelPloter(BasePloter):
                 'nodes are in the same layer, then editor will insert a layer below.')
             return
         ilayer = ilayers[0]
+        if ilayer >= self.model.nlayer - 1:
+            self.wd.show_warning('Warning',
+                'Failed to insert new layer.\nCan not insert a layer under the '
+                'ending boundary of the model.')
+            return
+        old_v_top = self.model[ilayer].v_top.y.copy()
         self.model.insert_layer(ilayer)
+        self.journal.record(InsertLayerEntry(ilayer, old_v_top))
         new_layer = self.model[ilayer+1]
         line, = self.ax.plot(new_layer.depth[0], new_layer.depth[1], **self.line_style)
         self.lines.insert(ilayer+1, line)
@@ -453,15 +838,19 @@ class ModelPloter(BasePloter):
         if not self.selected:
             return
         ilayers = list(set([node_idx[0] for node_idx in self.selected]))
+        entries = []
         try:
             for i in reversed(ilayers):
+                layer = self.model[i]
                 self.model.delete_layer(i)
+                entries.append(DeleteLayerEntry(i, layer))
                 line = self.lines.pop(i)
-                self.ax.lines.remove(line)
+                line.remove()
         except Exception as e:
             self.wd.show_error('Error',
                 'Failed to delete layers, the following error occured:\n%s'
                 %(', '.join(map(str, e.args))))
+        self.journal.record(CompoundEntry(entries))
         self.selected.clear()
         self.draw_texts()
         self.draw_select()
@@ -486,14 +875,35 @@ class ModelPloter(BasePloter):
 # velocity plot
 # ------------------------------------------------------------ #
 class VContourPlotDelegator(Delegator):
-    """Delegator for plotting velocity contours"""
+    """Delegator for plotting velocity contours.
+    A plot is made in three steps: `compute_plotdata` computes grid data,
+    `prepare_render` turns it into what the artists are made of (filled
+    contour polygons or an RGBA image), and `draw_render` makes the artists.
+    The first two steps only read the model manager they are given, so they can
+    run in a background thread on a snapshot of the model, see
+    `ModelManager.snapshot`. `plot_velocity_contour` does all of them."""
+
+    # Grid data is computed in about this number of tiles to report progress
+    PROGRESS_STEPS = 20
+    # Data type of grid data, float32 takes half the memory
+    GRID_DTYPE = np.float64
 
     def __init__(self, delegate, allowed_attrs=None):
         super().__init__(delegate, allowed_attrs)
-        # 缓存绘图数据
+        # 缓存绘图数据. Computed data are also kept in `grid_cache` (see
+        # `GridCache`) shared by all velocity windows
         self.last_params = None
         self.last_plotdata = None
+        # x ranges where the model changed since the cached data was computed
+        self.dirty_spans = []
+        # bumped whenever the cached data is forgotten
+        self.generation = 0
         self.color_levels = 256
+        # seconds taken by the steps of the last plot
+        self.timings = {}
+        # vertical line marking the linked section, see `move_cursor`
+        self.cursor = None
+        self.cursor_blit = None
 
         # 自定义一个 colormap，即在默认的 jet 最开头加上一个白色
         white = [1, 1, 1, 1]
@@ -517,16 +927,142 @@ class VContourPlotDelegator(Delegator):
                 ax.plot(x_v_top, y_v_top, color='k', marker=11, markerfacecolor='white', linestyle='None')
                 ax.plot(x_v_bot, y_v_bot, color='k', marker=10, markerfacecolor='white', linestyle='None')
 
-    def get_format_coord(self, xx, yy, zz):
+    def forget_plotdata(self):
+        self.last_params = None
+        self.last_plotdata = None
+        self.dirty_spans.clear()
+        self.generation += 1
+
+    def model_changed(self, change):
+        """Take note of a model change (a `ModelChange` object), so that the
+        cached data can be patched before its next use. Return True if the
+        cached data is affected."""
+        if change.structural or change.xlim is None:
+            affected = self.last_plotdata is not None
+            self.forget_plotdata()
+            return affected
+        # Spans are kept even if they miss the cached grid, since data being
+        # computed in background may be on another grid.
+        self.dirty_spans.append(change.xlim)
+        if self.last_plotdata is None:
+            return False
+        x = self.last_plotdata[0]
+        xmin, xmax = change.xlim
+        return not (xmax < x.min() or xmin > x.max())
+
+    def get_base(self):
+        """What `compute_plotdata` needs to reuse the cached data, taken along
+        with a snapshot of the model."""
+        return (self.generation, self.last_params, self.last_plotdata, list(self.dirty_spans))
+
+    def keep_plotdata(self, params, plotdata, base):
+        """Cache data computed by `compute_plotdata` from `base`, unless the
+        cached data has been forgotten since `base` was taken. Changes made
+        after that are kept to patch the new data."""
+        if base[0] != self.generation:
+            return
+        self.last_params = params
+        self.last_plotdata = plotdata
+        del self.dirty_spans[:len(base[3])]
+
+    def patch_plotdata(self, model_manager, plotdata, dirty_spans):
+        """Get the data with the grid columns in the x ranges where the model
+        changed recomputed. The data may be cached and shared, so the patched
+        grids are copies."""
+        x, y, vp, vs, pois = plotdata
+        cols = np.zeros(len(x), dtype=bool)
+        for xmin, xmax in dirty_spans:
+            cols |= (xmin <= x) & (x <= xmax)
+        cols = np.flatnonzero(cols)
+        if len(cols) == 0:
+            return plotdata
+        grids = []
+        fields = [f for f, grid in zip(model_manager.FIELDS, (vp, vs, pois)) if grid is not None]
+        patches = model_manager.interp_grid(x[cols], y, fields)
+        for grid, patch in zip((vp, vs, pois), patches):
+            if grid is not None:
+                grid = grid.copy()
+                grid[:, cols] = patch
+            grids.append(grid)
+        return (x, y) + tuple(grids)
+
+    def get_params(self, xlim=None, ylim=None, nxgrid=None, nygrid=None, dtype=None):
+        """Grid parameters (xlim, ylim, nxgrid, nygrid, dtype), unset ones
+        defaulting to the whole model and `GRID_DTYPE`"""
+        if not xlim:
+            xlim = self.model_manager.model.xlim
+        if not ylim:
+            ylim = self.model_manager.model.ylim
+        if nxgrid is None:
+            nxgrid = self.model_manager.NXGRID
+        if nygrid is None:
+            nygrid = self.model_manager.NYGRID
+        if dtype is None:
+            dtype = self.GRID_DTYPE
+        return (tuple(xlim), tuple(ylim), nxgrid, nygrid, np.dtype(dtype).str)
+
+    def compute_plotdata(self, model_manager, params, base, plot_type=0, progress=None):
+        """Get grid data (x, y, vp, vs, pois) of the model managed by
+        `model_manager` for grid parameters `params`, with the field of
+        `plot_type` in it. Fields are computed on demand and cached one by one
+        in `grid_cache`, Vs being derived from the Vp and pois grids. Fields
+        that are neither needed nor come with the cached data in `base`(see
+        `get_base`) are None. The cached data is patched if possible.
+        `progress` is called with the fraction of work done, see `compute_grid`."""
+        xlim, ylim, nxgrid, nygrid, dtype = params
+        x = np.linspace(xlim[0], xlim[1], nxgrid)
+        y = np.linspace(ylim[0], ylim[1], nygrid)
+        generation, last_params, last_plotdata, dirty_spans = base
+        fields = model_manager.FIELDS
+        grids = dict.fromkeys(fields)
+        fresh = set()
+        if params == last_params:
+            if dirty_spans:
+                # only the columns where the model changed are computed
+                last_plotdata = self.patch_plotdata(model_manager, last_plotdata, dirty_spans)
+                fresh.update(f for f, grid in zip(fields, last_plotdata[2:]) if grid is not None)
+            grids.update(zip(fields, last_plotdata[2:]))
+
+        def make_key(field):
+            return self.grid_cache.make_key(model_manager, xlim, ylim, nxgrid, nygrid, dtype, field)
+
+        field = fields[plot_type]
+        needed = [field]
+        if field == 'vs' and grids['vs'] is None:
+            needed = ['vp', 'pois']
+        missing = []
+        for f in model_manager.grid_fields(needed):
+            if grids[f] is None:
+                cached = self.grid_cache.get(make_key(f))
+                if cached is None:
+                    missing.append(f)
+                else:
+                    grids[f] = cached[0]
+        if missing:
+            tile_cols = None
+            if progress is not None:
+                tile_cols = max(1, min(-(-nxgrid // self.PROGRESS_STEPS), TILE_CELLS // max(nygrid, 1)))
+            computed = compute_grid(model_manager, x, y, workers=1, tile_cols=tile_cols,
+                progress=progress, fields=missing, dtype=dtype)
+            grids.update((f, grid) for f, grid in zip(fields, computed) if grid is not None)
+            fresh.update(missing)
+        if field == 'vs' and grids['vs'] is None and model_manager.has_pois:
+            grids['vs'] = model_manager.vp2vs(grids['vp'], grids['pois']).astype(dtype, copy=False)
+            fresh.add('vs')
+        for f in fresh:
+            self.grid_cache.put(make_key(f), (grids[f],))
+        return (x, y) + tuple(grids[f] for f in fields)
+
+    def get_format_coord(self, plot_type):
+        """Readout of the value under the cursor, queried from the model
+        itself rather than the plotted grid"""
         def format_coord(x, y):
-            xrow, ycol = xx[0,:], yy[:,0]
-            icol = np.searchsorted(xrow, x)
-            irow = np.searchsorted(ycol, y)
-            if (0 < icol < len(xrow)) and (0 < irow < len(ycol)):
-                z = zz[irow, icol]
-            else:
-                z = np.nan
-            return 'x=%.4f    y=%.4f    z=%.4f' %(x, y, z)
+            vp, vs, pois, layer, block = self.model_manager.query(x, y)
+            z = self.pick_field(plot_type, vp, vs, pois)
+            text = 'x=%.4f    y=%.4f    z=%.4f' %(x, y, np.nan if z is None else z)
+            if layer >= 0:
+                text += '    Ly%d  block %d' %(layer+1, block+1)
+            return text
         return format_coord
 
     def get_viewport(self):
@@ -538,42 +1074,184 @@ class VContourPlotDelegator(Delegator):
         ylim = ax.get_ybound()
         return xlim, ylim
 
-    def plot_velocity_contour(self, plot_type=0, xlim=None, ylim=None, nxgrid=None, nygrid=None, ignore_sea_water=False):
-        """plot_type: 0-Vp, 1-Vs, 2-Pois"""
-        if not xlim:
-            xlim = self.model_manager.model.xlim
-        if not ylim:
-            ylim = self.model_manager.model.ylim
-
-        # 如果参数未改变，只是绘制不同的 plot_type，则使用缓存的数据
-        params = (xlim, ylim, nxgrid, nygrid)
-        if params != self.last_params:
-            # print('calculate new data')
-            xx, yy, vp, vs, pois = self.model_manager.get_v_contour(xlim, ylim, nxgrid, nygrid)
-            self.last_params = params
-            self.last_plotdata = (xx, yy, vp, vs, pois)
+    def get_pixel_grid(self, xlim, ylim):
+        """Grid size (nxgrid, nygrid) making a grid cell about a pixel on
+        screen, for region `xlim` * `ylim` in the current view(or in the whole
+        figure before anything is plotted)."""
+        if self.fig.axes:
+            ax = self.fig.axes[0]
+            bbox = ax.get_window_extent()
+            (x0, x1), (y0, y1) = ax.get_xbound(), ax.get_ybound()
+            nxgrid = bbox.width * (xlim[1] - xlim[0]) / (x1 - x0)
+            nygrid = bbox.height * (ylim[1] - ylim[0]) / (y1 - y0)
         else:
-            # print('use cached data')
-            xx, yy, vp, vs, pois = self.last_plotdata
-
+            nxgrid, nygrid = self.fig.bbox.width, self.fig.bbox.height
+        return max(2, int(np.ceil(nxgrid))), max(2, int(np.ceil(nygrid)))
+
+    def get_levels(self, zz):
+        """Color levels of grid data, picked in the same way as contourf"""
+        zz = np.ma.masked_invalid(zz, copy=False)
+        if zz.count() == 0:
+            zmin, zmax = 0., 1.
+        else:
+            zmin, zmax = float(zz.min()), float(zz.max())
+        levels = matplotlib.ticker.MaxNLocator(self.color_levels+1, min_n_ticks=1)\
+            .tick_values(zmin, zmax)
+        # trim the levels beyond the data
+        under = np.flatnonzero(levels < zmin)
+        i0 = under[-1] if len(under) else 0
+        over = np.flatnonzero(levels > zmax)
+        i1 = over[0] + 1 if len(over) else len(levels)
+        if i1 - i0 < 3:
+            i0, i1 = 0, len(levels)
+        return levels[i0:i1]
+
+    def get_filled_contours(self, x, y, zz, levels, progress=None):
+        """Polygons of the filled contours of grid `zz` on 1-D axes `x` and
+        `y` between `levels`, generated in the same way as contourf. Return (allsegs, allkinds) for `ContourSet`, with
+        the polygons of a level joined into a single path."""
+        zz = np.ma.masked_invalid(zz, copy=False)
+        generator = contourpy.contour_generator(x, y, zz,
+            name=matplotlib.rcParams['contour.algorithm'],
+            corner_mask=matplotlib.rcParams['contour.corner_mask'],
+            fill_type=contourpy.FillType.OuterCode)
+        lowers, uppers = levels[:-1].copy(), levels[1:]
+        if zz.min() == lowers[0]:
+            lowers[0] -= 1
+        allsegs, allkinds = [], []
+        for i, (lower, upper) in enumerate(zip(lowers, uppers)):
+            points, codes = generator.filled(lower, upper)
+            if points:
+                allsegs.append([np.concatenate(points)])
+                allkinds.append([np.concatenate(codes)])
+            else:
+                allsegs.append([])
+                allkinds.append([])
+            if progress is not None:
+                progress((i+1) / len(lowers))
+        return allsegs, allkinds
+
+    @staticmethod
+    def pick_field(plot_type, vp, vs, pois):
         if plot_type == 0:
-            zz = vp
+            return vp
         elif plot_type == 1:
-            zz = vs
+            return vs
         elif plot_type == 2:
-            zz = pois
+            return pois
+        raise ValueError('Invalid parameter "plot_type"')
+
+    def get_cmap(self, plot_type, ignore_sea_water):
+        if ignore_sea_water:
+            return self.jet_lg if plot_type == 2 else self.jet_sm
+        return plt.get_cmap('jet')
+
+    def get_mesh(self, model_manager):
+        """Get the block mesh of the model(see `ModelManager.get_block_mesh`),
+        which is built once for a revision of the model and kept in
+        `grid_cache`."""
+        key = ('mesh', model_manager.model.digest(), model_manager.pois_digest())
+        mesh = self.grid_cache.get(key)
+        if mesh is None:
+            mesh = model_manager.get_block_mesh()
+            self.grid_cache.put(key, mesh)
+        return mesh
+
+    def prepare_plot(self, model_manager, params, base, plot_type=0, ignore_sea_water=False,
+            render_mode='contour', progress=None):
+        """Compute data for a plot of the model managed by `model_manager`
+        and prepare the plot with it, see `compute_plotdata` and
+        `prepare_render`. Return (plotdata, render, timings), plotdata being
+        None in 'gouraud' mode, which needs no grid data."""
+        t0 = time.perf_counter()
+        if render_mode == 'gouraud':
+            plotdata = None
+            data = self.get_mesh(model_manager)
         else:
-            raise ValueError('Invalid parameter "plot_type"')
+            plotdata = data = self.compute_plotdata(model_manager, params, base, plot_type,
+                progress=progress and (lambda f: progress(f/2)))
+        t1 = time.perf_counter()
+        render = self.prepare_render(data, plot_type, ignore_sea_water, render_mode,
+            progress=progress and (lambda f: progress(0.5+f/2)))
+        return plotdata, render, dict(compute=t1-t0, prepare=time.perf_counter()-t1)
+
+    def prepare_render(self, data, plot_type=0, ignore_sea_water=False, render_mode='contour', progress=None):
+        """Do the heavy work of rendering grid data(or the block mesh for
+        'gouraud' mode) short of making artists, return a dict for
+        `draw_render`.
+        plot_type: 0-Vp, 1-Vs, 2-Pois
+        render_mode: 'contour' - filled contours, for publication;
+                     'raster' - an image of grid cells, much faster to draw;
+                     'gouraud' - the blocks of the model shaded between
+                        exact velocity on the vertices of a mesh, with sharp
+                        layer boundaries and no grid"""
+        cmap = self.get_cmap(plot_type, ignore_sea_water)
+        if render_mode == 'gouraud':
+            x, y, triangles = data[:3]
+            z = self.pick_field(plot_type, *data[3:])
+            zmin, zmax = (np.nanmin(z), np.nanmax(z)) if np.any(np.isfinite(z)) else (0, 1)
+            render = dict(x=x, y=y, triangles=triangles, z=z, cmap=cmap, render_mode=render_mode,
+                plot_type=plot_type, norm=matplotlib.colors.Normalize(zmin, zmax), shading_cmap=cmap)
+            if cmap is self.jet_sm or cmap is self.jet_lg:
+                # Colors are interpolated between vertices, so the white end of
+                # the colormap would bleed into the triangles around. Triangles
+                # all in the white band are filled with white instead.
+                band = (zmax - zmin) / cmap.N
+                white = (z < zmin + band) if cmap is self.jet_sm else (z > zmax - band)
+                white = np.all(white[triangles], axis=1)
+                render['white'] = np.stack([x[triangles[white]], y[triangles[white]]], axis=-1)
+                render['triangles'] = triangles[~white]
+                render['shading_cmap'] = plt.get_cmap('jet')
+            return render
+        x, y = data[:2]
+        zz = self.pick_field(plot_type, *data[2:])
+        render = dict(x=x, y=y, zz=zz, cmap=cmap, render_mode=render_mode, plot_type=plot_type)
+        if render_mode == 'contour':
+            # without contourpy(matplotlib < 3.6), contourf does it all
+            if contourpy is not None:
+                render['levels'] = self.get_levels(zz)
+                render['allsegs'], render['allkinds'] = self.get_filled_contours(
+                    x, y, zz, render['levels'], progress)
+        elif render_mode == 'raster':
+            # Colors are binned by the same levels as contourf does, and mapped
+            # to RGBA beforehand, so that drawing only resamples the image.
+            dx = (x[-1] - x[0]) / (len(x) - 1) if len(x) > 1 else 1
+            dy = (y[-1] - y[0]) / (len(y) - 1) if len(y) > 1 else 1
+            levels = self.get_levels(zz)
+            # there may be a level more than colors, see `get_levels`
+            render['norm'] = matplotlib.colors.BoundaryNorm(levels, max(cmap.N, len(levels)-1))
+            render['rgba'] = cmap(render['norm'](np.ma.masked_invalid(zz)), bytes=True)
+            render['extent'] = (x[0]-dx/2, x[-1]+dx/2, y[0]-dy/2, y[-1]+dy/2)
+        else:
+            raise ValueError('Invalid parameter "render_mode"')
+        return render
 
+    def draw_render(self, render, xlim, ylim):
+        """Make the artists of a plot prepared by `prepare_render`"""
         self.fig.clear()
         ax = self.fig.add_subplot(111)
-        ax.format_coord = self.get_format_coord(xx, yy, zz)
-        if ignore_sea_water:
-            cmap = self.jet_lg if plot_type == 2 else self.jet_sm
+        cmap = render['cmap']
+        ax.format_coord = self.get_format_coord(render['plot_type'])
+        if render['render_mode'] == 'gouraud':
+            if 'white' in render:
+                ax.add_collection(matplotlib.collections.PolyCollection(
+                    render['white'], facecolors='white', edgecolors='none'))
+            ax.tripcolor(render['x'], render['y'], render['triangles'], render['z'],
+                shading='gouraud', cmap=render['shading_cmap'], norm=render['norm'])
+            p = matplotlib.cm.ScalarMappable(norm=render['norm'], cmap=cmap)
+        elif render['render_mode'] == 'raster':
+            ax.imshow(render['rgba'], origin='lower', aspect='auto',
+                interpolation='nearest', extent=render['extent'])
+            p = matplotlib.cm.ScalarMappable(norm=render['norm'], cmap=cmap)
+        elif 'allsegs' in render:
+            p = ContourSet(ax, render['levels'], render['allsegs'], render['allkinds'],
+                filled=True, cmap=cmap)
         else:
-            cmap = 'jet'
-        p = ax.contourf(xx, yy, zz, levels=self.color_levels, cmap=cmap)
+            p = ax.contourf(render['x'], render['y'], render['zz'], levels=self.color_levels, cmap=cmap)
         cbar = plt.colorbar(p, ax=ax, shrink=1, fraction=0.1, pad=0.03)
+        if render['render_mode'] == 'raster':
+            # a minor tick on every level boundary is too much to draw
+            cbar.minorticks_off()
         cbar.ax.set_ylabel('Velocity (km/s)')
         # hold the reference to colorbar object for further use
         cbar.ax.colorbar = cbar
@@ -585,6 +1263,43 @@ class VContourPlotDelegator(Delegator):
         ax.set_xlabel('X (km)')
         ax.set_ylabel('Depth (km)')
 
+    def move_cursor(self, x):
+        """Move the vertical cursor marking the linked section to `x`. Only
+        the cursor is redrawn."""
+        if not self.fig.axes:
+            return
+        ax = self.fig.axes[0]
+        if self.cursor is None or self.cursor.axes is not ax:
+            # the figure has been plotted again
+            self.remove_cursor()
+            self.cursor = ax.axvline(x, color='w', linestyle='--', linewidth=1)
+            self.cursor_blit = BlitManager(self.fig.canvas, [self.cursor])
+        self.cursor.set_xdata([x, x])
+        self.cursor_blit.update()
+
+    def remove_cursor(self):
+        if self.cursor is None:
+            return
+        self.cursor_blit.disconnect()
+        if self.cursor.axes is not None:
+            self.cursor.remove()
+            self.fig.canvas.draw_idle()
+        self.cursor = self.cursor_blit = None
+
+    def plot_velocity_contour(self, plot_type=0, xlim=None, ylim=None, nxgrid=None, nygrid=None, ignore_sea_water=False, render_mode='contour'):
+        """plot_type: 0-Vp, 1-Vs, 2-Pois
+        render_mode: 'contour', 'raster' or 'gouraud', see `prepare_render`"""
+        # 如果模型和参数未改变，只是绘制不同的 plot_type，则使用缓存的数据
+        params = self.get_params(xlim, ylim, nxgrid, nygrid)
+        base = self.get_base()
+        plotdata, render, timings = self.prepare_plot(self.model_manager, params, base,
+            plot_type, ignore_sea_water, render_mode)
+        if plotdata is not None:
+            self.keep_plotdata(params, plotdata, base)
+        t = time.perf_counter()
+        self.draw_render(render, params[0], params[1])
+        self.timings = dict(timings, build=time.perf_counter()-t)
+
 
 class VSectionPlotDelegator(Delegator):
     """Delegator for plotting velocity sections"""
@@ -593,8 +1308,19 @@ class VSectionPlotDelegator(Delegator):
     X_LABELS = ('Vp (km/s)', 'Vs (km/s)', 'Poisson')
     Y_LABEL = 'Depth (km)'
 
+    # Colormap of swept sections overlaid, by their position
+    SWEEP_CMAP = 'viridis'
+
+    # Number of sections over the model to fit the axes to in linked mode
+    LINK_SECTIONS = 200
+
     def __init__(self, delegate, allowed_attrs=None):
         super().__init__(delegate, allowed_attrs)
+        # Sections computed by `compute_sweep`: (xs, y, vp, vs, pois)
+        self.sweep = None
+        self.overlays = []
+        # redraws only the curves in linked mode, see `start_linked`
+        self.blit = None
         self.init_plot()
 
     def init_plot(self):
@@ -615,8 +1341,13 @@ class VSectionPlotDelegator(Delegator):
         deduct_layer is used to switch between real depth and mbsf.
         """
         y, vp, vs, pois = self.model_manager.get_section_data(section_x)
+        self.draw_sections(y, vp, vs, pois, deduct_layer, ylim)
+
+    def draw_sections(self, y, vp, vs, pois, deduct_layer=None, ylim=None):
+        """Plot a section given by data in the form of `get_section_data`"""
+        self.remove_overlays()
         if deduct_layer is not None:
-            y -= y[2*deduct_layer]
+            y = y - y[2*deduct_layer]
         self.plot_vp_section(y, vp)
         if self.model_manager.has_pois:
             self.plot_vs_section(y, vs)
@@ -651,3 +1382,89 @@ class VSectionPlotDelegator(Delegator):
             self.curves[2].set_data(val, depth)
         # self.axs[2].relim()
         # self.axs[2].autoscale_view(scalex=True, scaley=False)
+
+    def compute_sweep(self, section_xs):
+        """Compute the sections at all of `section_xs` in one go, they are
+        kept for `plot_sweep_step` and `plot_sweep_overlay` until the next
+        sweep. Return the number of sections."""
+        section_xs = np.asarray(section_xs, dtype=float).ravel()
+        self.sweep = (section_xs,) + self.model_manager.get_sections(section_xs)
+        return len(section_xs)
+
+    def plot_sweep_step(self, i, deduct_layer=None, ylim=None):
+        """Plot the i-th of the swept sections"""
+        xs, y, vp, vs, pois = self.sweep
+        if vs is None:
+            vs = pois = np.empty((len(xs), 0))
+        self.draw_sections(y[i], vp[i], vs[i], pois[i], deduct_layer, ylim)
+
+    def plot_sweep_overlay(self, deduct_layer=None, ylim=None):
+        """Overlay all the swept sections, colored by their position"""
+        xs, y, vp, vs, pois = self.sweep
+        self.remove_overlays()
+        for curve in self.curves:
+            if curve is not None:
+                curve.set_data([], [])
+        if deduct_layer is not None:
+            y = y - y[:, 2*deduct_layer, None]
+        norm = matplotlib.colors.Normalize(xs.min(), xs.max()) if len(xs) else None
+        for ax, val in zip(self.axs, (vp, vs, pois)):
+            if val is None or len(xs) == 0:
+                continue
+            # one polyline for a section
+            lines = matplotlib.collections.LineCollection(np.stack([val, y], axis=-1),
+                cmap=self.SWEEP_CMAP, norm=norm, linewidths=0.8)
+            lines.set_array(xs)
+            ax.add_collection(lines)
+            self.overlays.append(lines)
+        if len(xs):
+            self.axs[0].set_ylim(top=0, bottom=1.05*np.nanmax(y[:, -1]))
+            for ax, val in zip(self.axs[:2], (vp, vs)):
+                if val is not None and np.any(np.isfinite(val)):
+                    margin = 0.05 * (np.nanmax(val) - np.nanmin(val))
+                    ax.set_xlim(np.nanmin(val)-margin, np.nanmax(val)+margin)
+        if ylim:
+            self.axs[0].set_ybound(ylim)
+        self.fig.canvas.draw()
+
+    def start_linked(self):
+        """Get ready for `blit_section`: fit the axes to the sections all over
+        the model, so that the limits need not change with the section, and
+        animate the curves."""
+        self.stop_linked()
+        self.remove_overlays()
+        xlim = self.model_manager.model.xlim
+        y, vp, vs, pois = self.model_manager.get_sections(np.linspace(xlim[0], xlim[1], self.LINK_SECTIONS))
+        for i, (ax, val) in enumerate(zip(self.axs, (vp, vs, pois))):
+            if self.curves[i] is None:
+                self.curves[i], = ax.plot([], [], 'rgb'[i]+'-', linewidth=1)
+            if i < 2 and val is not None and np.any(np.isfinite(val)):
+                margin = 0.05 * (np.nanmax(val) - np.nanmin(val))
+                ax.set_xlim(np.nanmin(val)-margin, np.nanmax(val)+margin)
+        if np.any(np.isfinite(y)):
+            self.axs[0].set_ylim(top=0, bottom=1.05*np.nanmax(y))
+        self.blit = BlitManager(self.fig.canvas, self.curves)
+        self.fig.canvas.draw()
+
+    def blit_section(self, section_x):
+        """Show the section at `section_x` in linked mode, redrawing only the
+        curves"""
+        y, vp, vs, pois = self.model_manager.get_section_data(section_x)
+        self.curves[0].set_data(vp, y)
+        if self.model_manager.has_pois:
+            self.curves[1].set_data(vs, y)
+            self.curves[2].set_data(pois, y)
+        else:
+            self.curves[1].set_data([], [])
+            self.curves[2].set_data([], [])
+        self.blit.update()
+
+    def stop_linked(self):
+        if self.blit is not None:
+            self.blit.disconnect()
+            self.blit = None
+
+    def remove_overlays(self):
+        for lines in self.overlays:
+            lines.remove()
+        self.overlays.clear()
@@ -0,0 +1,235 @@
+"""Render velocity contours of v.in files from the command line, without the
+GUI. Files are rendered in parallel, one process per file.
+
+    python render.py examples/*.in -o figures --type vp --format png pdf
+    python render.py "inversion/iter_*/v.in" --fix examples/simple_fix.py
+
+Run `python render.py -h` for all the options.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import os
+import runpy
+import sys
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from gridcache import GridCache
+from model import Model, ModelManager
+from ploter import VContourPlotDelegator
+import util
+
+
+PLOT_TYPES = ('vp', 'vs', 'pois')
+RENDER_MODES = ('contour', 'raster', 'gouraud')
+FORMATS = ('png', 'pdf', 'svg')
+
+
+class Renderer(object):
+    """Render the velocity contour of a model the way the Contours tab of the
+    velocity window does, on a figure of the Agg backend"""
+    def __init__(self, model_manager, figsize=None):
+        self.model_manager = model_manager
+        self.fig = plt.figure(figsize=figsize, tight_layout=True)
+        # grids are computed once for a figure, nothing to cache
+        self.grid_cache = GridCache(max_bytes=0)
+        self.ploter = VContourPlotDelegator(delegate=self, allowed_attrs=(
+            'model_manager', 'fig', 'grid_cache'))
+
+    def render(self, plot_type=0, xlim=None, ylim=None, nxgrid=None, nygrid=None,
+            ignore_sea_water=False, render_mode='contour'):
+        self.ploter.plot_velocity_contour(plot_type, xlim, ylim, nxgrid, nygrid,
+            ignore_sea_water, render_mode)
+        return dict(self.ploter.timings)
+
+    def fix(self, script_path):
+        """Run a script fixing the figure, like the Fix button of the GUI"""
+        runpy.run_path(script_path, init_globals=dict(fig=self.fig))
+
+    def save(self, path, dpi=None):
+        self.fig.savefig(path, dpi=dpi)
+
+    def close(self):
+        plt.close(self.fig)
+
+
+def expand_paths(patterns):
+    """Paths of the files given by a list of paths or glob patterns, in order
+    and without duplicates. A pattern matching nothing is an error."""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            raise ValueError('No file matches "%s"' %pattern)
+        for path in matches:
+            if not os.path.isfile(path):
+                raise ValueError('Not a file: "%s"' %path)
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def output_paths(path, outdir, formats):
+    """Output file of `path` in every format, named after the input file. Files
+    of the same name in different directories are told apart by their parent
+    directory, e.g. iter_1/v.in -> iter_1_v.png"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if outdir is None:
+        outdir = os.path.dirname(path)
+    else:
+        parent = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        stem = '%s_%s' %(parent, stem) if parent else stem
+    return [os.path.join(outdir, '%s.%s' %(stem, fmt)) for fmt in formats]
+
+
+def render_file(path, outputs, options):
+    """Render the model in v.in file `path` to every file of `outputs`.
+    Return the seconds taken by each step. Run in a worker process."""
+    t0 = time.perf_counter()
+    model_manager = ModelManager(Model.load(path))
+    if options['pois']:
+        model_manager.bind_pois(util.parse_pois_str(options['pois']))
+    plot_type = PLOT_TYPES.index(options['plot_type'])
+    if plot_type > 0 and not model_manager.has_pois:
+        raise ValueError('Plotting %s needs poission ratios, see --pois' %options['plot_type'])
+    timings = dict(load=time.perf_counter()-t0)
+    renderer = Renderer(model_manager, options['figsize'])
+    try:
+        timings.update(renderer.render(plot_type, options['xlim'], options['ylim'],
+            options['nx'], options['ny'], options['ignore_sea_water'], options['mode']))
+        if options['fix']:
+            t = time.perf_counter()
+            renderer.fix(options['fix'])
+            timings['fix'] = time.perf_counter() - t
+        t = time.perf_counter()
+        for output in outputs:
+            renderer.save(output, options['dpi'])
+        timings['save'] = time.perf_counter() - t
+    finally:
+        renderer.close()
+    timings['total'] = time.perf_counter() - t0
+    return timings
+
+
+def render_jobs(jobs, nfile):
+    """Number of processes rendering `nfile` files with `jobs` processes(all
+    the CPUs if None), no more than the files. The files are rendered in this
+    process if 1."""
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    return max(1, min(jobs, nfile))
+
+
+def render_files(paths, outdir=None, formats=('png',), jobs=None, report=None, **options):
+    """Render every v.in file of `paths` with `jobs` processes(all the CPUs
+    by default). `options` are those of `render_file`. `report` is called
+    with (path, outputs, timings, error) once a file is done, in the order
+    they are done. Return a list of such tuples in the order of `paths`."""
+    if outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+    tasks = [(path, output_paths(path, outdir, formats)) for path in paths]
+    jobs = render_jobs(jobs, len(tasks))
+    results = {}
+
+    def done(path, outputs, timings, error):
+        results[path] = (path, outputs, timings, error)
+        if report is not None:
+            report(*results[path])
+
+    if jobs == 1:
+        for path, outputs in tasks:
+            try:
+                done(path, outputs, render_file(path, outputs, options), None)
+            except Exception as e:
+                done(path, outputs, None, e)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(render_file, path, outputs, options): (path, outputs)
+                for path, outputs in tasks}
+            for future in as_completed(futures):
+                path, outputs = futures[future]
+                try:
+                    done(path, outputs, future.result(), None)
+                except Exception as e:
+                    done(path, outputs, None, e)
+    return [results[path] for path, outputs in tasks]
+
+
+STEPS = ('load', 'compute', 'prepare', 'build', 'fix', 'save', 'total')
+
+
+def format_summary(results, wall):
+    """Table of the time(in ms) taken by each step for every file"""
+    width = max([len(path) for path, *_ in results] + [4])
+    lines = ['%-*s' %(width, 'file') + ''.join('%9s' %step for step in STEPS)]
+    for path, outputs, timings, error in results:
+        if error is not None:
+            lines.append('%-*s  failed: %s' %(width, path, error))
+            continue
+        lines.append('%-*s' %(width, path) + ''.join(
+            '%9.0f' %(timings[step]*1e3) if step in timings else '%9s' %'-' for step in STEPS))
+    nfailed = sum(1 for r in results if r[3] is not None)
+    lines.append('%d files rendered, %d failed, %.2f s' %(len(results)-nfailed, nfailed, wall))
+    return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Render velocity contours of v.in files.')
+    parser.add_argument('files', nargs='+', help='v.in files or glob patterns of them')
+    parser.add_argument('-o', '--outdir', help='directory of output files(default: beside the input)')
+    parser.add_argument('-f', '--format', nargs='+', choices=FORMATS, default=['png'],
+        help='output formats(default: png)')
+    parser.add_argument('-t', '--type', dest='plot_type', choices=PLOT_TYPES, default='vp',
+        help='field to plot(default: vp)')
+    parser.add_argument('-m', '--mode', choices=RENDER_MODES, default='contour',
+        help='render mode(default: contour)')
+    parser.add_argument('--nx', type=int, help='number of grid columns(default: %d)' %ModelManager.NXGRID)
+    parser.add_argument('--ny', type=int, help='number of grid rows(default: %d)' %ModelManager.NYGRID)
+    parser.add_argument('--xlim', type=float, nargs=2, metavar=('XMIN', 'XMAX'),
+        help='x range of the grid(default: the whole model)')
+    parser.add_argument('--ylim', type=float, nargs=2, metavar=('YMIN', 'YMAX'),
+        help='depth range of the grid(default: the whole model)')
+    parser.add_argument('--ignore-sea-water', action='store_true', help='leave sea water blank')
+    parser.add_argument('--pois', help='poission ratios as copied from r.in, needed to plot vs and pois')
+    parser.add_argument('--fix', metavar='SCRIPT', help='script fixing the figure, e.g. examples/simple_fix.py')
+    parser.add_argument('--figsize', type=float, nargs=2, metavar=('WIDTH', 'HEIGHT'),
+        help='figure size in inches')
+    parser.add_argument('--dpi', type=float, help='resolution of raster outputs')
+    parser.add_argument('-j', '--jobs', type=int, help='number of processes(default: all the CPUs)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        paths = expand_paths(args.files)
+        if args.fix and not os.path.isfile(args.fix):
+            raise ValueError('Invalid script path: "%s"' %args.fix)
+    except ValueError as e:
+        print('error: %s' %e, file=sys.stderr)
+        return 2
+
+    def report(path, outputs, timings, error):
+        if error is None:
+            print('%s -> %s (%.0f ms)' %(path, ', '.join(outputs), timings['total']*1e3))
+        else:
+            print('%s failed: %s' %(path, error), file=sys.stderr)
+
+    t = time.perf_counter()
+    results = render_files(paths, args.outdir, args.format, args.jobs, report,
+        plot_type=args.plot_type, mode=args.mode, nx=args.nx, ny=args.ny,
+        xlim=args.xlim, ylim=args.ylim, ignore_sea_water=args.ignore_sea_water,
+        pois=args.pois, fix=args.fix, figsize=args.figsize, dpi=args.dpi)
+    print()
+    print(format_summary(results, time.perf_counter()-t))
+    # worker processes exist only if more than one job
+    print(util.format_peak_rss(render_jobs(args.jobs, len(paths)) > 1))
+    return 1 if any(r[3] is not None for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
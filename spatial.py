@@ -0,0 +1,133 @@
+"""Spatial index of the nodes of a model.
+
+`NodeGrid` buckets nodes into the cells of a uniform grid over their bounding
+box, so that the nodes near a point or in a region are found by looking at a
+few cells instead of all the nodes. Nodes are sorted by cell, with the cells
+numbered row by row, so the cells of a row of a query region are a single
+slice of the sorted nodes.
+"""
+import numpy as np
+from matplotlib.path import Path
+
+from model import NodeIndex
+
+
+class NodeGrid(object):
+    """Immutable index of the nodes of some parts of a model(the depth nodes by
+    default), in data coordinates. Use `build` to get an index up to date with
+    a model."""
+    # Nodes per cell on average
+    NODES_PER_CELL = 2
+
+    def __init__(self, x, y, ilayer, inode, ipart=0, key=None):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.ilayer = np.asarray(ilayer, dtype=np.intp)
+        self.inode = np.asarray(inode, dtype=np.intp)
+        self.ipart = ipart
+        # what the index was built from, see `build`
+        self.key = key
+        n = len(self.x)
+        if n:
+            self.x0, self.y0 = self.x.min(), self.y.min()
+            width = max(self.x.max() - self.x0, 1e-12)
+            height = max(self.y.max() - self.y0, 1e-12)
+        else:
+            self.x0 = self.y0 = 0.
+            width = height = 1.
+        # cells about as wide as high relative to the bounding box
+        ncell = max(n // self.NODES_PER_CELL, 1)
+        self.nx = max(int(round(np.sqrt(ncell * width / height))), 1)
+        self.ny = max(ncell // self.nx, 1)
+        self.dx, self.dy = width / self.nx, height / self.ny
+        cell = self.cell_y(self.y) * self.nx + self.cell_x(self.x)
+        self.order = np.argsort(cell, kind='stable')
+        # nodes of the i-th cell are order[cell_start[i]:cell_start[i+1]]
+        self.cell_start = np.searchsorted(cell[self.order], np.arange(self.nx*self.ny+1))
+
+    @classmethod
+    def build(cls, model, old=None, ipart=0):
+        """Get the index of the `ipart`-th part of all the layers of the
+        model, or `old` if the model has not changed since it was built."""
+        # Any change of nodes or layers moves the revision of the store
+        key = (model.store, model.revision, ipart)
+        if old is not None and old.key == key:
+            return old
+        parts = [ly[ipart] for ly in model]
+        sizes = [len(tl) for tl in parts]
+        if not parts:
+            return cls([], [], [], [], ipart, key)
+        x = np.concatenate([tl.x for tl in parts])
+        y = np.concatenate([tl.y for tl in parts])
+        ilayer = np.repeat(np.arange(len(parts)), sizes)
+        # position of every node in its part
+        inode = np.arange(len(x)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        return cls(x, y, ilayer, inode, ipart, key)
+
+    def __len__(self):
+        return len(self.x)
+
+    def cell_x(self, x):
+        return np.clip((x - self.x0) / self.dx, 0, self.nx-1).astype(np.intp)
+
+    def cell_y(self, y):
+        return np.clip((y - self.y0) / self.dy, 0, self.ny-1).astype(np.intp)
+
+    def node_index(self, i):
+        return NodeIndex(self.ilayer[i], self.ipart, self.inode[i])
+
+    def candidates(self, xmin, xmax, ymin, ymax):
+        """Positions of the nodes in the cells overlapping a rectangle, a
+        superset of the nodes in it"""
+        if len(self) == 0 or xmin > xmax or ymin > ymax:
+            return np.zeros(0, dtype=np.intp)
+        cx0, cx1 = self.cell_x(np.array([xmin, xmax]))
+        cy0, cy1 = self.cell_y(np.array([ymin, ymax]))
+        rows = np.arange(cy0, cy1+1) * self.nx
+        starts = self.cell_start[rows + cx0]
+        stops = self.cell_start[rows + cx1 + 1]
+        return np.concatenate([self.order[a:b] for a, b in zip(starts, stops)])
+
+    def in_rect(self, xmin, xmax, ymin, ymax):
+        """Positions of the nodes in a rectangle, borders included"""
+        i = self.candidates(xmin, xmax, ymin, ymax)
+        x, y = self.x[i], self.y[i]
+        return i[(xmin <= x) & (x <= xmax) & (ymin <= y) & (y <= ymax)]
+
+    def in_polygon(self, verts):
+        """Positions of the nodes in a polygon(a lasso), given by its vertices"""
+        verts = np.asarray(verts, dtype=float)
+        if len(verts) < 3:
+            return np.zeros(0, dtype=np.intp)
+        i = self.in_rect(verts[:, 0].min(), verts[:, 0].max(), verts[:, 1].min(), verts[:, 1].max())
+        inside = Path(verts).contains_points(np.column_stack([self.x[i], self.y[i]]))
+        return i[inside]
+
+    def nearest(self, x, y, radius=np.inf, scale=(1., 1.)):
+        """Position of the node nearest to (x, y) within `radius` and the
+        distance to it, or (None, inf). Distances are measured after scaling
+        x and y by `scale`, e.g. pixels per data unit for a distance on
+        screen."""
+        if len(self) == 0:
+            return None, np.inf
+        sx, sy = scale
+        # search a few cells around first, then as far as the nearest node
+        # found, which bounds the distance to any nearer node
+        r = min(radius, 2 * max(self.dx * sx, self.dy * sy))
+        while True:
+            i = self.candidates(x - r/sx, x + r/sx, y - r/sy, y + r/sy)
+            if len(i):
+                d = np.hypot((self.x[i] - x) * sx, (self.y[i] - y) * sy)
+                k = d.argmin()
+                if d[k] <= r:
+                    return int(i[k]), float(d[k])
+                if r >= radius:
+                    return None, np.inf
+                r = min(d[k], radius)
+            elif r >= radius:
+                return None, np.inf
+            else:
+                r = min(2 * r, radius)
+
+    def __str__(self):
+        return '<NodeGrid: %d nodes, %d x %d cells>' %(len(self), self.nx, self.ny)
@@ -0,0 +1,184 @@
+import numpy as np
+
+
+class ColumnStore(object):
+    """Columnar storage for the nodes of a model.
+    The x, value and vary flag of all nodes are kept in 3 contiguous buffers
+    (float64, float64 and int8). Every part of the model (a TripleLine object)
+    owns a "slot": a segment of the buffers starting at `start[slot]`, holding
+    `size[slot]` nodes with room for `cap[slot]` nodes.
+    When a full slot grows, it is moved to the end of the buffers with doubled
+    capacity, so inserting nodes is amortized cheap. The space left behind is
+    reclaimed by compacting the buffers once it takes up more than half of
+    them.
+    Every change of a slot stamps `rev[slot]` with a new value of the store's
+    `tick` counter, so that caches built on a slot can tell if it changed."""
+    MIN_CAP = 4
+
+    def __init__(self, capacity=64):
+        capacity = max(int(capacity), self.MIN_CAP)
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.vary = np.zeros(capacity, dtype=np.int8)
+        # offset table, indexed by slot
+        self.start = np.zeros(0, dtype=np.intp)
+        self.size = np.zeros(0, dtype=np.intp)
+        self.cap = np.zeros(0, dtype=np.intp)
+        self.rev = np.zeros(0, dtype=np.int64)
+        self.nslot = 0
+        self.tick = 0
+        # used length of the buffers, and the length of unused holes in it
+        self.end = 0
+        self.garbage = 0
+
+    def copy(self):
+        """Make a copy of the store. Slots keep their numbers in the copy."""
+        cp = ColumnStore.__new__(ColumnStore)
+        cp.x = self.x.copy()
+        cp.y = self.y.copy()
+        cp.vary = self.vary.copy()
+        cp.start = self.start.copy()
+        cp.size = self.size.copy()
+        cp.cap = self.cap.copy()
+        cp.rev = self.rev.copy()
+        cp.nslot = self.nslot
+        cp.tick = self.tick
+        cp.end = self.end
+        cp.garbage = self.garbage
+        return cp
+
+    @property
+    def nbytes(self):
+        return self.x.nbytes + self.y.nbytes + self.vary.nbytes
+
+    def add(self, x=(), y=(), vary=()):
+        """Add a new slot holding the given nodes and return its number."""
+        x = np.asarray(x, dtype=float)
+        n = len(x)
+        if not (len(y) == n and len(vary) == n):
+            raise ValueError('x, y and vary must be in the same length.')
+        if self.nslot == len(self.start):
+            more = max(self.nslot, 8)
+            self.start = np.concatenate([self.start, np.zeros(more, dtype=np.intp)])
+            self.size = np.concatenate([self.size, np.zeros(more, dtype=np.intp)])
+            self.cap = np.concatenate([self.cap, np.zeros(more, dtype=np.intp)])
+            self.rev = np.concatenate([self.rev, np.zeros(more, dtype=np.int64)])
+        slot = self.nslot
+        self.nslot += 1
+        self._allocate(slot, max(n, self.MIN_CAP))
+        s = self.start[slot]
+        self.x[s:s+n] = x
+        self.y[s:s+n] = y
+        self.vary[s:s+n] = vary
+        self.size[slot] = n
+        self.touch(slot)
+        return slot
+
+    def release(self, slot):
+        """Give up the space of a slot. The slot becomes empty for good."""
+        self.garbage += self.cap[slot]
+        self.size[slot] = 0
+        self.cap[slot] = 0
+        self.touch(slot)
+
+    def touch(self, slot):
+        """Mark a slot as changed. Writing through views does not mark the
+        slot by itself, so the writer should call this."""
+        self.tick += 1
+        self.rev[slot] = self.tick
+
+    def view(self, slot):
+        """Zero-copy views of the x, y and vary of a slot. Views are only valid
+        until the next insertion or deletion on the store."""
+        s = self.start[slot]
+        e = s + self.size[slot]
+        return self.x[s:e], self.y[s:e], self.vary[s:e]
+
+    def reserve(self, slot, n):
+        """Make sure the slot has room for `n` nodes."""
+        if n <= self.cap[slot]:
+            return
+        s, size = self.start[slot], self.size[slot]
+        old = (self.x[s:s+size].copy(), self.y[s:s+size].copy(), self.vary[s:s+size].copy())
+        self.garbage += self.cap[slot]
+        self._allocate(slot, max(n, 2*self.cap[slot], self.MIN_CAP))
+        s = self.start[slot]
+        self.x[s:s+size], self.y[s:s+size], self.vary[s:s+size] = old
+        if self.garbage > self.end // 2:
+            self.compact()
+
+    def insert(self, slot, i, x, y, vary):
+        """Insert a node before the i-th node of a slot."""
+        n = self.size[slot]
+        if i < 0:
+            i += n
+        if not 0 <= i <= n:
+            raise IndexError('Node index out of range in the x direction.')
+        self.reserve(slot, n+1)
+        s = self.start[slot]
+        for buf, value in ((self.x, x), (self.y, y), (self.vary, vary)):
+            buf[s+i+1:s+n+1] = buf[s+i:s+n]
+            buf[s+i] = value
+        self.size[slot] = n + 1
+        self.touch(slot)
+
+    def delete(self, slot, i):
+        """Delete the i-th node of a slot."""
+        n = self.size[slot]
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('Node index out of range in the x direction.')
+        s = self.start[slot]
+        for buf in (self.x, self.y, self.vary):
+            buf[s+i:s+n-1] = buf[s+i+1:s+n]
+        self.size[slot] = n - 1
+        self.touch(slot)
+
+    def assign(self, slot, x, y, vary):
+        """Replace the nodes of a slot, e.g. by the result of inserting or
+        deleting several nodes with numpy at once."""
+        n = len(x)
+        if not (len(y) == n and len(vary) == n):
+            raise ValueError('x, y and vary must be in the same length.')
+        self.reserve(slot, n)
+        s = self.start[slot]
+        self.x[s:s+n] = x
+        self.y[s:s+n] = y
+        self.vary[s:s+n] = vary
+        self.size[slot] = n
+        self.touch(slot)
+
+    def compact(self, order=None):
+        """Squeeze out the holes left by moved or released slots. Slots are
+        laid out in the given order, or in the order of slot numbers."""
+        if order is None:
+            order = range(self.nslot)
+        order = [slot for slot in order if self.cap[slot] > 0]
+        total = int(sum(self.cap[slot] for slot in order))
+        capacity = max(2*total, self.MIN_CAP)
+        x, y, vary = np.zeros(capacity), np.zeros(capacity), np.zeros(capacity, dtype=np.int8)
+        pos = 0
+        for slot in order:
+            s, n = self.start[slot], self.size[slot]
+            x[pos:pos+n] = self.x[s:s+n]
+            y[pos:pos+n] = self.y[s:s+n]
+            vary[pos:pos+n] = self.vary[s:s+n]
+            self.start[slot] = pos
+            pos += self.cap[slot]
+        self.x, self.y, self.vary = x, y, vary
+        self.end = pos
+        self.garbage = 0
+
+    def _allocate(self, slot, cap):
+        """Allocate space for a slot at the end of the buffers."""
+        if self.end + cap > len(self.x):
+            capacity = max(2*len(self.x), self.end + cap)
+            for name in ('x', 'y', 'vary'):
+                old = getattr(self, name)
+                buf = np.zeros(capacity, dtype=old.dtype)
+                buf[:self.end] = old[:self.end]
+                setattr(self, name, buf)
+        self.start[slot] = self.end
+        self.cap[slot] = cap
+        self.end += cap
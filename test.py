@@ -1,6 +1,9 @@
+import os
+
 import matplotlib.pyplot as plt
 import numpy as np
 
+from journal import EditJournal, MoveEntry, DeleteNodeEntry, DeleteLayerEntry
 from model import TripleLine, Layer, EndLayer, Model, ModelManager, NodeIndex
 from ploter import ModelPloter
 from util import SessionManager, HistoryManager, parse_pois_str
@@ -15,7 +18,7 @@ def test_triple_line():
 
     t = TripleLine.loads(s)
     print(t)
-    print(t._data)
+    print(list(t))
     print(t.dumps(5))
     t.insert_node(3, (2.51,1,0))
     print(t.dumps())
@@ -57,6 +60,26 @@ def test_model():
     print(model.dumps())
     print(model.get_node(NodeIndex(0,0,5)))
 
+def test_model_read():
+    import io
+    s = open('examples/v3.in').read()
+    assert Model.read(io.StringIO(s)) == Model.loads(s)
+    try:
+        Model.loads(s.replace('2.570', '2.5y0', 1))
+    except ValueError as e:
+        print(e)
+
+def test_model_store():
+    model = Model.load('examples/v1.in')
+    print(model.slot_table())
+    tpl = model[0].depth
+    for i in range(100):
+        tpl.insert_node(0)
+    cp = model.copy()
+    cp.move_node(NodeIndex(0,0,1), 0.5, 0.5)
+    print(len(tpl), model.get_node(NodeIndex(0,0,1)), cp.get_node(NodeIndex(0,0,1)))
+    print(model.store.end, model.store.garbage, model.store.nbytes)
+
 def test_ploter():
     path_vin = 'v.in'
     ploter = ModelPloter(path_vin)
@@ -132,6 +155,177 @@ def test_velosity_interp():
     plt.show()
 
 
+def test_v_contour_methods():
+    model = Model.load('examples/v3.in')
+    mp = ModelManager(model)
+    mp.bind_pois(parse_pois_str('pois=0.4999,0.4852,0.4770,0.4620,0.4700'))
+    res_scan = mp.get_v_contour(nxgrid=300, nygrid=200)
+    res_block = mp.get_v_contour(nxgrid=300, nygrid=200, method='block')
+    for a, b in zip(res_scan, res_block):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_model_listener():
+    model = Model.load('examples/v3.in')
+    mp = ModelManager(model)
+    changes = []
+    model.add_listener(changes.append)
+    x, y = np.linspace(0, 23, 300), np.linspace(0, 10, 200)
+    vp = mp.interp_grid(x, y)[0]
+    model.move_node(NodeIndex(2, 0, 3), 0, 0.2)
+    xmin, xmax = changes[0].xlim
+    cols = (xmin <= x) & (x <= xmax)
+    vp[:, cols] = mp.interp_grid(x[cols], y)[0]
+    np.testing.assert_array_equal(vp, mp.interp_grid(x, y)[0])
+    model.insert_layer(3)
+    print(changes)
+
+
+def test_journal():
+    model = Model.load('examples/v3.in')
+    origin = model.dumps()
+    y0 = model[1].depth.y[2]
+    journal = EditJournal()
+    for i in range(100):
+        model[1].depth.move_node(2, 0, 0.001)
+        journal.record(MoveEntry([(1, 0, 2)], [0], [0.001]))
+    layer = model[2]
+    model.delete_layer(2)
+    journal.record(DeleteLayerEntry(2, layer))
+    print(len(journal), journal.nbytes)
+    while journal.undo(model):
+        pass
+    assert model.dumps() == origin and not model.is_modified()
+    # the 100 moves are merged into one entry
+    journal.redo(model)
+    assert np.isclose(model[1].depth.y[2], y0 + 0.1)
+
+
+def test_grid_tiled():
+    from grid import compute_grid
+    model = Model.load('examples/v3.in')
+    mp = ModelManager(model)
+    mp.bind_pois(parse_pois_str('pois=0.4999,0.4852,0.4770,0.4620,0.4700'))
+    x, y = np.linspace(0, 23, 1000), np.linspace(0, 10, 300)
+    res_serial = mp.interp_grid(x, y)
+    res_tiled = compute_grid(mp, x, y, workers=2, tile_cols=64)
+    for a, b in zip(res_serial, res_tiled):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_grid_fields():
+    model = Model.load('examples/v3.in')
+    mp = ModelManager(model)
+    mp.bind_pois(parse_pois_str('pois=0.4999,0.4852,0.4770,0.4620,0.4700'))
+    x, y = np.linspace(0, 23, 400), np.linspace(0, 10, 300)
+    vp, vs, pois = mp.interp_grid(x, y, fields=['vp'], dtype=np.float32)
+    assert vp.dtype == np.float32 and vs is None and pois is None
+    np.testing.assert_array_equal(vp, mp.interp_grid(x, y)[0].astype(np.float32))
+
+
+def test_grid_to_files():
+    import tempfile
+    from grid import compute_grid_to_files
+    model = Model.load('examples/v3.in')
+    mp = ModelManager(model)
+    mp.bind_pois(parse_pois_str('pois=0.4999,0.4852,0.4770,0.4620,0.4700'))
+    x, y = np.linspace(0, 23, 400), np.linspace(0, 10, 300)
+    res = mp.interp_grid(x, y, dtype=np.float32)
+    with tempfile.TemporaryDirectory() as folder:
+        paths = {f: os.path.join(folder, f+'.npy') for f in ('vp', 'pois')}
+        out = compute_grid_to_files(mp, x, y, paths, workers=2, max_memory=8*2**20, dtype=np.float32)
+        for name, a, b in zip(('vp', 'vs', 'pois'), res, out):
+            if name in paths:
+                np.testing.assert_array_equal(a, b)
+            else:
+                assert b is None
+        del out
+
+
+def test_grid_cache():
+    from gridcache import GridCache
+    model = Model.load('examples/v3.in')
+    mp = ModelManager(model)
+    cache = GridCache(max_bytes=2*500*300*8*5)
+    for nx in (500, 400, 500, 300):
+        key = cache.make_key(mp, model.xlim, model.ylim, nx, 300)
+        if cache.get(key) is None:
+            cache.put(key, mp.get_v_contour(model.xlim, model.ylim, nx, 300))
+    mp.bind_pois(parse_pois_str('pois=0.4999,0.4852,0.4770,0.4620,0.4700'))
+    # the pois is part of the key
+    assert cache.make_key(mp, model.xlim, model.ylim, 500, 300) not in cache
+    print(cache.stats())
+
+
+def test_block_mesh():
+    model = Model.load('examples/v3.in')
+    mp = ModelManager(model)
+    mp.bind_pois(parse_pois_str('pois=0.4999,0.4852,0.4770,0.4620,0.4700'))
+    x, y, triangles, vp, vs, pois = mp.get_block_mesh()
+    print(len(x), len(triangles))
+    # vertices inside layers(not on boundaries) get the same velocity as grids
+    i = len(x) // 3
+    np.testing.assert_allclose(vp[i], mp.interp_grid([x[i]], [y[i]])[0][0, 0])
+
+
+def test_query():
+    model = Model.load('examples/v3.in')
+    mp = ModelManager(model)
+    mp.bind_pois(parse_pois_str('pois=0.4999,0.4852,0.4770,0.4620,0.4700'))
+    x, y = np.linspace(-1, 24, 300), np.linspace(-1, 11, 200)
+    grids = mp.interp_grid(x, y)
+    vp, vs, pois, layer, block = mp.query(x[None,:], y[:,None])
+    for a, b in zip(grids, (vp, vs, pois)):
+        np.testing.assert_array_equal(a, b)
+    print(mp.query([5, 5, 30], [0.5, 5, 5]))
+
+
+def test_block_table():
+    model = Model.load('examples/v3.in')
+    mp = ModelManager(model)
+    mp.bind_pois(parse_pois_str('''pois=0.4999,0.4852,0.4770,0.4620,0.4700
+        poisl=2,2
+        poisb=2,3
+        poisbl=0.485,0.487'''))
+    table = mp.blocks()
+    print(table, table.offsets)
+    print(table[1].pois)
+    # only the layers around the moved node are compiled again
+    model.move_node(NodeIndex(2, 0, 1), 0, 0.1)
+    new_table = mp.blocks()
+    assert [a is b for a, b in zip(table, new_table)] == [True, False, False] + [True]*12
+    assert mp.blocks() is new_table
+
+
+def test_sections():
+    model = Model.load('examples/v3.in')
+    mp = ModelManager(model)
+    mp.bind_pois(parse_pois_str('pois=0.4999,0.4852,0.4770,0.4620,0.4700'))
+    xs = np.linspace(0, 23, 50)
+    y, vp, vs, pois = mp.get_sections(xs)
+    print(y.shape)
+    for i, x in enumerate(xs):
+        for a, b in zip((y, vp, vs, pois), mp.get_section_data(x)):
+            np.testing.assert_array_equal(a[i], b)
+
+
+def test_background_job():
+    from grid import compute_grid
+    from util import BackgroundJob
+    model = Model.load('examples/v3.in')
+    mp = ModelManager(model)
+    x, y = np.linspace(0, 23, 2000), np.linspace(0, 10, 1000)
+    job = BackgroundJob(lambda job: compute_grid(
+        mp.snapshot(), x, y, workers=1, tile_cols=10, progress=job.set_progress)).start()
+    job.cancel()
+    assert job.wait(10) and job.result is None and job.progress < 1
+    job = BackgroundJob(lambda job: compute_grid(
+        mp.snapshot(), x, y[:10], workers=1, tile_cols=100, progress=job.set_progress)).start()
+    job.wait()
+    assert job.progress == 1
+    np.testing.assert_array_equal(job.result[0], mp.interp_grid(x, y[:10])[0])
+
+
 def test_session_manager():
     sm = SessionManager(autosave=True)
     print(sm.load())
@@ -162,13 +356,131 @@ def test_parse_pois_str():
         poisbl=0.485,0.487,0.476,0.458,0.462,0.489,'''
     print(parse_pois_str(pois_str))
 
+
+def test_node_grid():
+    from spatial import NodeGrid
+    model = Model.load('examples/v3.in')
+    grid = NodeGrid.build(model)
+    print(grid, NodeGrid.build(model, grid) is grid)
+    x = np.concatenate([ly.depth.x for ly in model])
+    y = np.concatenate([ly.depth.y for ly in model])
+    i, d = grid.nearest(5.3, 2.2)
+    assert d == np.hypot(x-5.3, y-2.2).min()
+    inside = grid.in_rect(2, 8, 1, 3)
+    assert len(inside) == np.count_nonzero((2 <= x) & (x <= 8) & (1 <= y) & (y <= 3))
+
+
+def test_move_nodes():
+    model = Model.load('examples/v3.in')
+    other = model.copy()
+    nodes = [NodeIndex(1, 0, i) for i in (2, 3, 4)] + [NodeIndex(2, 1, 1)]
+    for node_idx in nodes:
+        model.move_node(node_idx, 0.05, 0.1)
+    print(other.move_nodes(nodes, 0.05, 0.1))
+    assert model.dumps() == other.dumps()
+    np.testing.assert_array_equal(np.column_stack(other.get_nodes(nodes)),
+        [model.get_node(ni) for ni in nodes])
+    try:
+        other.move_nodes([NodeIndex(1, 0, 3), NodeIndex(1, 0, 0)], 0.1, 0)
+    except ValueError as e:
+        print(e)
+    # nothing is moved
+    assert model.dumps() == other.dumps()
+
+
+def test_insert_delete_nodes():
+    model = Model.load('examples/v3.in')
+    other = model.copy()
+    origin = model.dumps()
+    nodes = [NodeIndex(1, 0, i) for i in (1, 2, 4)] + [NodeIndex(2, 1, 0)]
+    for node_idx in sorted(nodes, reverse=True):
+        model.insert_node(node_idx)
+    inserted, values = other.insert_nodes(nodes)
+    print(inserted)
+    assert model.dumps() == other.dumps()
+    changes = []
+    other.add_listener(changes.append)
+    other.delete_nodes(inserted)
+    # the nodes of all the parts are deleted with one notification
+    assert len(changes) == 1
+    print(changes[0])
+    assert other.dumps() == origin
+    try:
+        other.delete_nodes([NodeIndex(1, 0, 3), NodeIndex(1, 0, 0)])
+    except ValueError as e:
+        print(e)
+    # nothing is deleted
+    assert other.dumps() == origin
+
+
+def test_undo_delete_adjacent_nodes():
+    model = Model.load('examples/v3.in')
+    origin = model.dumps()
+    mp = ModelManager(model)
+    journal = EditJournal()
+    nodes = model.node_array([(1, 0, 2), (1, 0, 3)])
+    values = np.column_stack(model.get_nodes(nodes))
+    model.delete_nodes(nodes)
+    journal.record(DeleteNodeEntry(nodes, values))
+    x, y = np.linspace(0, 23, 500), np.linspace(0, 10, 200)
+    vp = mp.interp_grid(x, y)[0]
+    changes = []
+    model.add_listener(changes.append)
+    # both nodes are inserted again after the node 1
+    journal.undo(model)
+    assert model.dumps() == origin
+    assert len(changes) == 1
+    xmin, xmax = changes[0].xlim
+    cols = (xmin <= x) & (x <= xmax)
+    vp[:, cols] = mp.interp_grid(x[cols], y)[0]
+    np.testing.assert_array_equal(vp, mp.interp_grid(x, y)[0])
+
+
+def test_digest_tie():
+    model = Model.load('examples/v3.in')
+    print(model[0].depth.y[1])
+    # 0.0005 is a tie, written as 0.001 but rounded to 0 by np.round
+    model.move_node(NodeIndex(0, 0, 1), 0, 0.0005)
+    assert '%8.3f' %model[0].depth.y[1] == '   0.001'
+    assert model.is_modified()
+
+def test_render_without_tk():
+    import subprocess
+    import sys
+    # a fresh interpreter, where tkinter can't be imported
+    code = "import sys; sys.modules['tkinter'] = None; import render"
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    print(proc.stderr)
+    assert proc.returncode == 0
+
 if __name__ == '__main__':
     test_triple_line()
     # test_layer()
     # test_end_layer()
     # test_model()
+    # test_model_read()
+    # test_model_store()
     # test_ploter()
     # test_velosity_interp()
+    # test_v_contour_methods()
+    # test_model_listener()
+    # test_journal()
+    # test_grid_tiled()
+    # test_grid_fields()
+    # test_grid_to_files()
+    # test_grid_cache()
+    # test_block_mesh()
+    # test_query()
+    # test_block_table()
+    # test_sections()
+    # test_background_job()
     # test_session_manager()
     # test_history_manager()
     # test_parse_pois_str()
+    # test_node_grid()
+    # test_move_nodes()
+    # test_insert_delete_nodes()
+    # test_undo_delete_adjacent_nodes()
+    # test_digest_tie()
+    # test_render_without_tk()
@@ -2,8 +2,13 @@ import json
 import logging
 import os
 import re
-import tkinter as tk
-import tkinter.ttk as ttk
+import sys
+import threading
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
 
 
 cur_dir = os.path.dirname(os.path.abspath(__file__))
@@ -30,71 +35,6 @@ def get_file_logger(name, file, level=logging.INFO):
     return logger
 
 
-class ScrollText(tk.Frame):
-    """Custom tkinter widget: ScrollText"""
-    def __init__(self, master, **kw):
-        super().__init__(master)
-        self.rowconfigure(0, weight=1)
-        self.columnconfigure(0, weight=1)
-        self.text = tk.Text(self, **kw)
-        self.text.grid(row=0, column=0, sticky='nswe')
-        y_scroll = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.text.yview)
-        y_scroll.grid(row=0, column=1, sticky='ns')
-        self.text.config(yscrollcommand=y_scroll.set)
-
-    def get(self):
-        return self.text.get('1.0', tk.END)
-
-    def set(self, string):
-        self.text.config(state=tk.NORMAL)
-        self.text.delete('1.0', tk.END)
-        self.text.insert(tk.END, string)
-        self.text.config(state=tk.DISABLED)
-
-
-def create_label_entry(master, label_text, entry_var, callback, label_width=10, entry_width=16):
-    """create one-line label-entry widget"""
-    label_entry = ttk.Frame(master)
-    label_entry.columnconfigure(0, weight=1)
-    label_entry.grid(column=0, pady=(5, 0), sticky='nswe')
-    ttk.Label(label_entry, text=label_text, width=label_width).grid(row=0, column=0, sticky='nsw')
-    entry = ttk.Entry(label_entry, textvariable=entry_var, width=entry_width)
-    entry.grid(row=0, column=1, sticky='nswe')
-    entry.bind('<Return>', callback)
-    return label_entry
-
-
-class TextWindow(tk.Frame):
-    """A Window contains only a text widget, mainly for showing message"""
-    def __init__(self, text='', editable=True, title='untitled', geometry='1125x740+300+100'):
-        master = tk.Toplevel()
-        super().__init__(master)
-        self.master = master
-        self.text = text
-        self.editable = editable
-        self.title = title
-        self.geometry = geometry
-        self.create_widgets()
-
-    def create_widgets(self):
-        self.master.title(self.title)
-        self.master.geometry(self.geometry)
-        self.master.rowconfigure(0, weight=1)
-        self.master.columnconfigure(0, weight=1)
-        self.rowconfigure(0, weight=1)
-        self.columnconfigure(0, weight=1)
-        self.grid(pady=(2, 0), sticky='nswe')
-        text_widget = tk.Text(self, bd=0, font=('Consolas', 11))
-        text_widget.grid(row=0, column=0, sticky='nswe')
-        scrollbar = ttk.Scrollbar(self, command=text_widget.yview)
-        scrollbar.grid(row=0, column=1, sticky='nswe')
-        text_widget['yscrollcommand'] = scrollbar.set
-
-        text_widget.insert(tk.END, self.text)
-        if not self.editable:
-            text_widget.config(state=tk.DISABLED)
-
-
 class Delegator(object):
     """Delegator Base Class"""
     def __init__(self, delegate=None, allowed_attrs=None):
@@ -127,6 +67,82 @@ class Delegator(object):
         self.delegate = delegate
 
 
+def peak_rss(children=False):
+    """Peak resident memory in bytes of this process, or of the largest of its
+    child processes which have terminated. None if unknown on the platform."""
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    maxrss = resource.getrusage(who).ru_maxrss
+    # in bytes on macOS, in kilobytes elsewhere
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def format_peak_rss(children=False):
+    """Report of `peak_rss` of this process, and of its child processes if
+    `children`"""
+    rss = peak_rss()
+    if rss is None:
+        return 'peak RSS: unknown'
+    text = 'peak RSS: %.1f MB' %(rss/2**20)
+    if children:
+        children = peak_rss(children=True)
+        text += ', %.1f MB in a worker process' %(children/2**20)
+    return text
+
+
+class Cancelled(Exception):
+    """Raised by a long computation when it is cancelled"""
+    pass
+
+
+class BackgroundJob(object):
+    """Run `func(job)` in a daemon thread.
+    `func` reports its progress by `set_progress` and checks `cancelled` to
+    stop early(or raises `Cancelled`). The result or the error is stored for
+    the thread that started the job to pick up, since tkinter must only be
+    used from the main thread."""
+    def __init__(self, func):
+        self.func = func
+        self.progress = 0.
+        self.result = None
+        self.error = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        try:
+            self.result = self.func(self)
+        except Cancelled:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            self._done.set()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def set_progress(self, progress):
+        if self._cancel.is_set():
+            raise Cancelled
+        self.progress = progress
+
+
 class BaseConfigManager(object):
     """Base class for managing json config"""
     def __init__(self):
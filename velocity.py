@@ -1,5 +1,6 @@
 import os
 import runpy
+import time
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog, messagebox
@@ -8,10 +9,12 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 import numpy as np
 
-from globals_ import session, history
+import export
+from globals_ import session, history, grid_cache
 from model import ModelManager
 from ploter import VContourPlotDelegator, VSectionPlotDelegator
 import util
+import widgets
 
 
 cur_dir = os.path.dirname(os.path.abspath(__file__))
@@ -28,6 +31,7 @@ class VelocityFrame(ttk.Frame):
             level = 'debug')
         self.model_manager = None
         self.last_tab_id = None
+        self.refresh_pending = False
         self.create_widgets()
 
     def create_widgets(self):
@@ -36,6 +40,7 @@ class VelocityFrame(ttk.Frame):
         self.master.geometry('1000x600+220+50')
         self.master.rowconfigure(0, weight=1)
         self.master.columnconfigure(0, weight=1)
+        self.master.protocol("WM_DELETE_WINDOW", self.close)
 
         # Make frame resizable
         self.rowconfigure(0, weight=1)
@@ -53,6 +58,11 @@ class VelocityFrame(ttk.Frame):
         self.notebook.bind('<<NotebookTabChanged>>', self.tab_changed)
 
     def bind_model(self, model):
+        """Bind the model being edited. Plots follow the edits on it, and are
+        made again for another model bound later(e.g. a file opened in the
+        main window)."""
+        rebind = self.model_manager is not None
+        self.unbind_model()
         self.model_manager = ModelManager(model)
         pois_str = session.get('pois')
         if pois_str:
@@ -60,6 +70,44 @@ class VelocityFrame(ttk.Frame):
             self.model_manager.bind_pois(pois_obj)
         self.vsf.bind_model(self.model_manager)
         self.vcf.bind_model(self.model_manager)
+        model.add_listener(self.model_changed)
+        if rebind:
+            # the poission ratio comes with the session of the new file
+            self.st.pois_text.delete('1.0', tk.END)
+            self.st.pois_text.insert(tk.END, pois_str or '')
+            if self.model_manager.has_pois:
+                self.vsf.pois_set()
+                self.vcf.pois_set()
+            else:
+                self.vsf.pois_unset()
+                self.vcf.pois_unset()
+            self.vcf.replot()
+
+    def unbind_model(self):
+        if self.model_manager is not None:
+            self.model_manager.model.remove_listener(self.model_changed)
+
+    def model_changed(self, change):
+        """Listener of the model. Plots are refreshed once the pending edits
+        are all done, instead of on every single edit."""
+        if change.structural and self.model_manager.has_pois:
+            # poission ratio is bound by layer index
+            self.model_manager.bind_pois(self.model_manager.pois_obj)
+        self.vcf.model_changed(change)
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            self.after_idle(self.refresh)
+
+    def refresh(self):
+        self.refresh_pending = False
+        self.vsf.update_plot()
+        self.vcf.refresh_plot()
+
+    def close(self):
+        self.unbind_model()
+        self.vcf.cancel_job()
+        self.vcf.cancel_export()
+        self.master.destroy()
 
     def tab_changed(self, event):
         if event.widget.index(event.widget.select()) == 1:
@@ -139,6 +187,13 @@ class SettingsFrame(ttk.Frame):
 class VelocityContourFrame(ttk.Frame):
     """Velocity contour frame"""
     NXGRID, NYGRID = 500, 500
+    # Interval in ms to check a plot being computed in background
+    POLL_INTERVAL = 50
+    # In auto resolution mode, the view is plotted again once it has not
+    # changed for this long(in ms)
+    SETTLE_DELAY = 400
+    # The linked section follows the mouse at most once a frame(in ms)
+    FRAME_INTERVAL = 16
 
     def __init__(self, master):
         super().__init__(master)
@@ -152,15 +207,37 @@ class VelocityContourFrame(ttk.Frame):
         self.fig.patch.set_facecolor('#F0F0F0')
         self.plot_type_tkvar = tk.IntVar(value=0)
         self.ignore_sea_water_tkvar = tk.BooleanVar(value=True)
+        self.render_mode_tkvar = tk.StringVar(value='contour')
+        self.render_time_tkvar = tk.StringVar()
+        self.progress_tkvar = tk.DoubleVar(value=0)
         self.xmin_tkvar = tk.DoubleVar()
         self.xmax_tkvar = tk.DoubleVar()
         self.ymin_tkvar = tk.DoubleVar()
         self.ymax_tkvar = tk.DoubleVar()
         self.xstep_tkvar = tk.DoubleVar()
         self.ystep_tkvar = tk.DoubleVar()
+        self.auto_resolution_tkvar = tk.BooleanVar(value=False)
+        self.linked_section_tkvar = tk.BooleanVar(value=False)
         self.script_path_tkvar = tk.StringVar()
+        # parameters of the last plot, for refreshing it after model changes
+        self.plot_args = None
+        # plot being computed in background, see `start_job`
+        self.job = None
+        self.poll_id = None
+        # grid being exported in background, see `export_grid`
+        self.export_job = None
+        self.export_poll_id = None
+        # pending replot after pan/zoom in auto resolution mode
+        self.settle_id = None
+        self.button_down = False
+        # linked section: the x the mouse moved to last, and the pending
+        # update of the section to it
+        self.motion_cid = None
+        self.cursor_x = None
+        self.cursor_id = None
+        self.grid_cache = grid_cache
         self.ploter = VContourPlotDelegator(delegate=self, allowed_attrs=(
-            'model_manager', 'fig'))
+            'model_manager', 'fig', 'grid_cache'))
 
     def create_widgets(self):
         # Make frame resizable
@@ -177,6 +254,10 @@ class VelocityContourFrame(ttk.Frame):
         canvas = FigureCanvasTkAgg(self.fig, master=plot_area)
         canvas.get_tk_widget().grid(row=0, column=0, sticky='nswe')
         canvas._tkcanvas.grid(sticky='nswe')
+        # section under the mouse, shown beside the contours when linked
+        self.section_panel = LinkedSectionPanel(plot_area)
+        canvas.mpl_connect('button_press_event', self.button_pressed)
+        canvas.mpl_connect('button_release_event', self.button_released)
         # toolbar uses pack geometry manager internally, so wrap it with a frame
         # using grid geometry manager.
         toolbar_area = ttk.Frame(self)
@@ -210,24 +291,47 @@ class VelocityContourFrame(ttk.Frame):
         ttk.Radiobutton(tmp, text='Yes', value=True, variable=self.ignore_sea_water_tkvar).grid(row=1, column=0, sticky='nsw')
         ttk.Radiobutton(tmp, text='No', value=False, variable=self.ignore_sea_water_tkvar).grid(row=1, column=1, sticky='nsw')
 
+        # contourf for publication, raster for fast drawing, or gouraud for
+        # shading model blocks without a grid
+        tmp = ttk.Frame(side_area)
+        tmp.grid(column=0, sticky='nswe', pady=(10, 0))
+        ttk.Label(tmp, text='Render Mode: ').grid(row=0, column=0, columnspan=2, sticky='nswe')
+        ttk.Radiobutton(tmp, text='Contour', value='contour', variable=self.render_mode_tkvar).grid(row=1, column=0, sticky='nsw')
+        ttk.Radiobutton(tmp, text='Raster', value='raster', variable=self.render_mode_tkvar).grid(row=1, column=1, sticky='nsw')
+        ttk.Radiobutton(tmp, text='Gouraud', value='gouraud', variable=self.render_mode_tkvar).grid(row=1, column=2, sticky='nsw')
+
+        # section following the mouse
+        ttk.Checkbutton(side_area, text='Linked Section', variable=self.linked_section_tkvar,
+            command=self.linked_section_changed).grid(column=0, pady=(10, 0), sticky='nw')
+
         # plot params
         tmp = ttk.Frame(side_area)
         tmp.columnconfigure(1, weight=1)
         tmp.grid(column=0, sticky='nswe', pady=(10, 0))
         ttk.Label(tmp, text='Plot Parameters: ').grid(column=0, sticky='nswe')
         # set xlim and ylim
-        util.create_label_entry(tmp, 'xmin: ', self.xmin_tkvar, self.xmin_changed, label_width=6)
-        util.create_label_entry(tmp, 'xmax: ', self.xmax_tkvar, self.xmax_changed, label_width=6)
-        util.create_label_entry(tmp, 'ymin: ', self.ymin_tkvar, self.ymin_changed, label_width=6)
-        util.create_label_entry(tmp, 'ymax: ', self.ymax_tkvar, self.ymax_changed, label_width=6)
+        widgets.create_label_entry(tmp, 'xmin: ', self.xmin_tkvar, self.xmin_changed, label_width=6)
+        widgets.create_label_entry(tmp, 'xmax: ', self.xmax_tkvar, self.xmax_changed, label_width=6)
+        widgets.create_label_entry(tmp, 'ymin: ', self.ymin_tkvar, self.ymin_changed, label_width=6)
+        widgets.create_label_entry(tmp, 'ymax: ', self.ymax_tkvar, self.ymax_changed, label_width=6)
         # set xstep and ystep for meshing
-        util.create_label_entry(tmp, 'xstep: ', self.xstep_tkvar, self.xstep_changed, label_width=6)
-        util.create_label_entry(tmp, 'ystep: ', self.ystep_tkvar, self.ystep_changed, label_width=6)
+        widgets.create_label_entry(tmp, 'xstep: ', self.xstep_tkvar, self.xstep_changed, label_width=6)
+        widgets.create_label_entry(tmp, 'ystep: ', self.ystep_tkvar, self.ystep_changed, label_width=6)
         # use current viewport to set parameters
         ttk.Button(tmp, text='Use Viewport', command=self.use_viewport).grid(column=0, pady=5, sticky='nw')
+        # a grid cell for a pixel, and plot again after pan/zoom
+        ttk.Checkbutton(tmp, text='Auto Resolution', variable=self.auto_resolution_tkvar,
+            command=self.auto_resolution_changed).grid(column=0, sticky='nw')
 
         # plot button
         ttk.Button(side_area, text='Plot', command=self.update_plot).grid(column=0, pady=(10, 0), sticky='nw')
+        ttk.Progressbar(side_area, variable=self.progress_tkvar, maximum=1.0, mode='determinate')\
+            .grid(column=0, pady=(5, 0), sticky='we')
+        ttk.Label(side_area, textvariable=self.render_time_tkvar, font=('Consolas', 8))\
+            .grid(column=0, pady=(5, 0), sticky='nw')
+        # export grid data of the plot parameters to files
+        self.export_button = ttk.Button(side_area, text='Export Grid...', command=self.export_grid)
+        self.export_button.grid(column=0, pady=(5, 0), sticky='nw')
 
         # load script to fix figure
         ttk.Separator(side_area, orient=tk.HORIZONTAL).grid(column=0, pady=(20, 0), sticky='ew')
@@ -240,6 +344,11 @@ class VelocityContourFrame(ttk.Frame):
         # fix button
         ttk.Button(tmp, text='Fix', command=self.fix_plot).grid(column=0, pady=(10, 0), sticky='nw')
 
+        # changing any parameter cancels the plot being computed
+        for tkvar in (self.plot_type_tkvar, self.ignore_sea_water_tkvar, self.render_mode_tkvar,
+                self.xmin_tkvar, self.xmax_tkvar, self.ymin_tkvar, self.ymax_tkvar,
+                self.xstep_tkvar, self.ystep_tkvar):
+            tkvar.trace_add('write', self.params_changed)
 
     def bind_model(self, model_manager):
         """`model_manager` is a `ModelManager` object, which contains attribute `model`
@@ -256,19 +365,33 @@ class VelocityContourFrame(ttk.Frame):
         self.ymax_tkvar.set(ymax)
         self.xstep_tkvar.set(xstep)
         self.ystep_tkvar.set(ystep)
+        self.section_panel.bind_model(model_manager)
 
 
     def pois_set(self):
+        self.ploter.forget_plotdata()
         self.plot_type_radios[1].configure(state=tk.NORMAL)
         self.plot_type_radios[2].configure(state=tk.NORMAL)
 
     def pois_unset(self):
+        self.ploter.forget_plotdata()
         self.plot_type_radios[1].configure(state=tk.DISABLED)
         self.plot_type_radios[2].configure(state=tk.DISABLED)
         self.plot_type_tkvar.set(0)
 
     def update_plot(self):
         """update contour plot according to user setting parameters"""
+        self.plot_args = self.get_plot_args()
+        self.start_job()
+
+    def replot(self):
+        """Plot a newly bound model with the default parameters if there is a
+        plot, the data of the last model is forgotten."""
+        self.ploter.forget_plotdata()
+        if self.plot_args is not None:
+            self.update_plot()
+
+    def get_plot_args(self):
         xmin = self.xmin_tkvar.get()
         xmax = self.xmax_tkvar.get()
         ymin = self.ymin_tkvar.get()
@@ -280,16 +403,168 @@ class VelocityContourFrame(ttk.Frame):
         nxgrid = int(round((xmax - xmin) / xstep))
         nygrid = int(round((ymax - ymin) / ystep))
         ignore_sea_water = self.ignore_sea_water_tkvar.get()
-        self.ploter.plot_velocity_contour(self.plot_type_tkvar.get(), xlim, ylim, nxgrid, nygrid, ignore_sea_water)
+        return (self.plot_type_tkvar.get(), xlim, ylim, nxgrid, nygrid,
+            ignore_sea_water, self.render_mode_tkvar.get())
+
+    def start_job(self, keep_view=False):
+        """Compute the plot of `plot_args` in background, on a snapshot of
+        the model. The running job is cancelled. The plot is swapped in once it
+        is ready, see `poll_job`."""
+        if self.job is not None:
+            keep_view = keep_view and self.job.keep_view
+        self.cancel_job()
+        plot_type, xlim, ylim, nxgrid, nygrid, ignore_sea_water, render_mode = self.plot_args
+        ploter = self.ploter
+        params = ploter.get_params(xlim, ylim, nxgrid, nygrid)
+        base = ploter.get_base()
+        model_manager = self.model_manager.snapshot()
+
+        def work(job):
+            return ploter.prepare_plot(model_manager, params, base, plot_type,
+                ignore_sea_water, render_mode, progress=job.set_progress)
+
+        self.job = util.BackgroundJob(work)
+        self.job.params, self.job.base, self.job.keep_view = params, base, keep_view
+        self.job.start()
+        self.poll_id = self.after(self.POLL_INTERVAL, self.poll_job)
+
+    def poll_job(self):
+        """Show the progress of the plot job, and the plot once it is done"""
+        job = self.job
+        if not job.done():
+            self.progress_tkvar.set(job.progress)
+            self.poll_id = self.after(self.POLL_INTERVAL, self.poll_job)
+            return
+        self.job = self.poll_id = None
+        self.progress_tkvar.set(0)
+        if job.error is not None:
+            self.logger.exception(job.error)
+            messagebox.showerror('Error', str(job.error), parent=self.master)
+            return
+        plotdata, render, timings = job.result
+        if plotdata is not None:
+            self.ploter.keep_plotdata(job.params, plotdata, job.base)
+        xlim, ylim = self.ploter.get_viewport() if job.keep_view else (None, None)
+        t = time.perf_counter()
+        self.ploter.draw_render(render, job.params[0], job.params[1])
+        ax = self.fig.axes[0]
+        if xlim:
+            ax.set_xbound(xlim)
+            ax.set_ybound(ylim)
+        ax.callbacks.connect('xlim_changed', self.viewport_changed)
+        ax.callbacks.connect('ylim_changed', self.viewport_changed)
+        self.ploter.timings = dict(timings, build=time.perf_counter()-t)
+        self.draw_plot()
+        self.logger.debug(self.grid_cache)
+
+    def cancel_job(self):
+        if self.job is None:
+            return
+        self.job.cancel()
+        self.after_cancel(self.poll_id)
+        self.job = self.poll_id = None
+        self.progress_tkvar.set(0)
+
+    def params_changed(self, *args):
+        if self.job is None:
+            return
+        try:
+            changed = self.get_plot_args() != self.plot_args
+        except (tk.TclError, ValueError, ZeroDivisionError):
+            # being edited
+            changed = True
+        if changed:
+            self.cancel_job()
+
+    def draw_plot(self):
+        """Draw the figure and report the time taken"""
+        t = time.perf_counter()
         self.fig.canvas.draw()
+        timings = dict(self.ploter.timings, draw=time.perf_counter()-t)
+        self.render_time_tkvar.set('\n'.join('%-8s %6.0f ms' %(name+':', timings[name]*1e3)
+            for name in ('compute', 'prepare', 'build', 'draw')))
+        self.logger.debug('%s rendering timings: %s' %(self.plot_args[-1], timings))
+
+    def export_grid(self):
+        """Export the grid of the plot parameters in background, all the fields
+        that can be computed are exported"""
+        try:
+            plot_args = self.get_plot_args()
+        except (tk.TclError, ValueError, ZeroDivisionError):
+            messagebox.showerror('Error', 'Invalid plot parameters', parent=self.master)
+            return
+        path = filedialog.asksaveasfilename(parent=self.master, title='Export Grid',
+            defaultextension='.npy', filetypes=[
+                ('NumPy array', '*.npy'), ('Raw float32', '*.raw'), ('ASCII columns', '*.txt')])
+        if not path:
+            return
+        plot_type, xlim, ylim, nxgrid, nygrid = plot_args[:5]
+        model_manager = self.model_manager.snapshot()
+
+        def work(job):
+            return export.export_grid(model_manager, path, xlim, ylim, nxgrid, nygrid,
+                progress=job.set_progress)
+
+        self.export_job = util.BackgroundJob(work).start()
+        self.export_button.configure(state=tk.DISABLED)
+        self.export_poll_id = self.after(self.POLL_INTERVAL, self.poll_export)
+
+    def poll_export(self):
+        job = self.export_job
+        # the window may be closed with the poll pending
+        if job is None or not self.winfo_exists():
+            return
+        if not job.done():
+            self.progress_tkvar.set(job.progress)
+            self.export_poll_id = self.after(self.POLL_INTERVAL, self.poll_export)
+            return
+        self.export_job = self.export_poll_id = None
+        self.progress_tkvar.set(0)
+        self.export_button.configure(state=tk.NORMAL)
+        if job.error is not None:
+            self.logger.exception(job.error)
+            messagebox.showerror('Error', str(job.error), parent=self.master)
+            return
+        messagebox.showinfo('Export Grid', 'Exported to:\n' + '\n'.join(job.result), parent=self.master)
+
+    def cancel_export(self):
+        if self.export_job is None:
+            return
+        self.export_job.cancel()
+        self.after_cancel(self.export_poll_id)
+        self.export_job = self.export_poll_id = None
+
+    def model_changed(self, change):
+        self.ploter.model_changed(change)
+
+    def refresh_plot(self):
+        """Plot again with the last parameters after the model changed, only
+        the changed part of the data is computed. Current view is kept."""
+        if self.linked_section_tkvar.get():
+            self.section_panel.start()
+            if self.cursor_x is not None:
+                self.section_panel.show_section(self.cursor_x)
+        if self.plot_args is None:
+            return
+        self.start_job(keep_view=True)
 
     def use_viewport(self):
+        """Set plot parameters to the part of the model in the view. In auto
+        resolution mode, grid steps are about a pixel."""
         xlim, ylim = self.ploter.get_viewport()
         if not xlim:
             return
-        xmin, xmax = xlim
-        ymin, ymax = ylim
-        xstep, ystep = (xmax - xmin) / self.NXGRID, (ymax - ymin) / self.NYGRID
+        XMIN, XMAX = self.model_manager.model.xlim
+        YMIN, YMAX = self.model_manager.model.ylim
+        xmin, xmax = max(xlim[0], XMIN), min(xlim[1], XMAX)
+        ymin, ymax = max(ylim[0], YMIN), min(ylim[1], YMAX)
+        if xmin >= xmax or ymin >= ymax:
+            return
+        if self.auto_resolution_tkvar.get():
+            nxgrid, nygrid = self.ploter.get_pixel_grid((xmin, xmax), (ymin, ymax))
+        else:
+            nxgrid, nygrid = self.NXGRID, self.NYGRID
+        xstep, ystep = (xmax - xmin) / nxgrid, (ymax - ymin) / nygrid
         self.xmin_tkvar.set(round(xmin, 10))
         self.xmax_tkvar.set(round(xmax, 10))
         self.ymin_tkvar.set(round(ymin, 10))
@@ -297,6 +572,69 @@ class VelocityContourFrame(ttk.Frame):
         self.xstep_tkvar.set(round(xstep, 10))
         self.ystep_tkvar.set(round(ystep, 10))
 
+    def auto_resolution_changed(self):
+        if self.auto_resolution_tkvar.get():
+            self.use_viewport()
+
+    def viewport_changed(self, ax=None):
+        """Called on every change of axis limits. In auto resolution mode,
+        the view is plotted again once it settles."""
+        if not self.auto_resolution_tkvar.get():
+            return
+        if self.settle_id is not None:
+            self.after_cancel(self.settle_id)
+        self.settle_id = self.after(self.SETTLE_DELAY, self.viewport_settled)
+
+    def viewport_settled(self):
+        self.settle_id = None
+        if self.button_down:
+            # still panning or zooming
+            self.settle_id = self.after(self.SETTLE_DELAY, self.viewport_settled)
+            return
+        self.use_viewport()
+        plot_args = self.get_plot_args()
+        if plot_args == self.plot_args:
+            return
+        self.plot_args = plot_args
+        self.start_job(keep_view=True)
+
+    def linked_section_changed(self):
+        canvas = self.fig.canvas
+        if self.linked_section_tkvar.get():
+            self.section_panel.grid(row=0, column=1, sticky='nswe')
+            self.section_panel.start()
+            self.motion_cid = canvas.mpl_connect('motion_notify_event', self.mouse_moved)
+            return
+        canvas.mpl_disconnect(self.motion_cid)
+        if self.cursor_id is not None:
+            self.after_cancel(self.cursor_id)
+        self.motion_cid = self.cursor_id = self.cursor_x = None
+        self.ploter.remove_cursor()
+        self.section_panel.stop()
+        self.section_panel.grid_remove()
+
+    def mouse_moved(self, event):
+        """Only the last position is kept, the section is updated once a
+        frame so that motion events never queue up."""
+        if event.xdata is None or not self.fig.axes or event.inaxes is not self.fig.axes[0]:
+            return
+        self.cursor_x = event.xdata
+        if self.cursor_id is None:
+            self.cursor_id = self.after(self.FRAME_INTERVAL, self.update_cursor)
+
+    def update_cursor(self):
+        self.cursor_id = None
+        xmin, xmax = self.model_manager.model.xlim
+        x = min(max(self.cursor_x, xmin), xmax)
+        self.ploter.move_cursor(x)
+        self.section_panel.show_section(x)
+
+    def button_pressed(self, event):
+        self.button_down = True
+
+    def button_released(self, event):
+        self.button_down = False
+
     def xmin_changed(self, event=None):
         xmin = self.xmin_tkvar.get()
         XMIN, XMAX = self.model_manager.model.xlim
@@ -364,8 +702,45 @@ class VelocityContourFrame(ttk.Frame):
         self.ploter.fig.canvas.draw()
 
 
+class LinkedSectionPanel(ttk.Frame):
+    """Sections at the cursor of the contour plot, see
+    `VelocityContourFrame.linked_section_changed`"""
+    def __init__(self, master):
+        super().__init__(master)
+        self.model_manager = None
+        self.fig, self.axs = plt.subplots(1, 3, sharey=True, tight_layout=True, figsize=(4, 4))
+        self.fig.patch.set_facecolor('#F0F0F0')
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+        canvas = FigureCanvasTkAgg(self.fig, master=self)
+        canvas.get_tk_widget().grid(row=0, column=0, sticky='nswe')
+        self.ploter = VSectionPlotDelegator(delegate=self, allowed_attrs=(
+            'model_manager', 'fig', 'axs'))
+
+    def bind_model(self, model_manager):
+        self.model_manager = model_manager
+
+    def start(self):
+        if self.model_manager is not None:
+            self.ploter.start_linked()
+
+    def stop(self):
+        self.ploter.stop_linked()
+
+    def show_section(self, x):
+        if self.ploter.blit is not None:
+            self.ploter.blit_section(x)
+
+    def destroy(self):
+        plt.close(self.fig)
+        super().destroy()
+
+
 class VelocitySectionFrame(ttk.Frame):
     """Velocity section frame"""
+    # Most sections in a sweep
+    MAX_SWEEP = 10000
+
     def __init__(self, master):
         super().__init__(master)
         self.master = master
@@ -380,6 +755,14 @@ class VelocitySectionFrame(ttk.Frame):
         self.section_x_tkvar = tk.DoubleVar()
         self.ymin_tkvar = tk.DoubleVar()
         self.ymax_tkvar = tk.DoubleVar()
+        # Sweep mode: sections from `sweep_from` to `sweep_to` every
+        # `sweep_step` km, overlaid or stepped through one by one
+        self.sweep_tkvar = tk.BooleanVar(value=False)
+        self.sweep_from_tkvar = tk.DoubleVar()
+        self.sweep_to_tkvar = tk.DoubleVar()
+        self.sweep_step_tkvar = tk.DoubleVar(value=1.0)
+        self.sweep_mode_tkvar = tk.StringVar(value='overlay')
+        self.sweep_index_tkvar = tk.DoubleVar(value=0)
         self.ploter = VSectionPlotDelegator(delegate=self, allowed_attrs=(
             'model_manager', 'fig', 'axs'))
 
@@ -424,9 +807,26 @@ class VelocitySectionFrame(ttk.Frame):
         tmp.grid(column=0, sticky='nswe', pady=(20, 0))
         ttk.Label(tmp, text='Plot Parameters: ').grid(column=0, sticky='nswe')
 
-        util.create_label_entry(tmp, 'Section At: ', self.section_x_tkvar, self.section_x_changed, label_width=10, entry_width=10)
-        util.create_label_entry(tmp, 'ymin: ', self.ymin_tkvar, self.section_x_changed, label_width=10, entry_width=10)
-        util.create_label_entry(tmp, 'ymax: ', self.ymax_tkvar, self.section_x_changed, label_width=10, entry_width=10)
+        widgets.create_label_entry(tmp, 'Section At: ', self.section_x_tkvar, self.section_x_changed, label_width=10, entry_width=10)
+        widgets.create_label_entry(tmp, 'ymin: ', self.ymin_tkvar, self.section_x_changed, label_width=10, entry_width=10)
+        widgets.create_label_entry(tmp, 'ymax: ', self.ymax_tkvar, self.section_x_changed, label_width=10, entry_width=10)
+
+        # sweep mode
+        tmp = ttk.Frame(side_area)
+        tmp.columnconfigure(0, weight=1)
+        tmp.grid(column=0, sticky='nswe', pady=(20, 0))
+        ttk.Checkbutton(tmp, text='Sweep Sections', variable=self.sweep_tkvar,
+            command=self.update_plot).grid(column=0, sticky='nsw')
+        widgets.create_label_entry(tmp, 'From: ', self.sweep_from_tkvar, self.sweep_changed, label_width=10, entry_width=10)
+        widgets.create_label_entry(tmp, 'To: ', self.sweep_to_tkvar, self.sweep_changed, label_width=10, entry_width=10)
+        widgets.create_label_entry(tmp, 'Step: ', self.sweep_step_tkvar, self.sweep_changed, label_width=10, entry_width=10)
+        ttk.Radiobutton(tmp, text='Overlay', value='overlay', variable=self.sweep_mode_tkvar,
+            command=self.draw_sweep).grid(column=0, sticky='nsw')
+        ttk.Radiobutton(tmp, text='Step Through', value='step', variable=self.sweep_mode_tkvar,
+            command=self.draw_sweep).grid(column=0, sticky='nsw')
+        self.sweep_scale = ttk.Scale(tmp, orient=tk.HORIZONTAL, from_=0, to=0,
+            variable=self.sweep_index_tkvar, command=self.sweep_index_changed)
+        self.sweep_scale.grid(column=0, pady=(5, 0), sticky='nswe')
 
         # # Set poission ratio
         # ttk.Button(side_area, text='Set pois', command=self.master.goto_settings).grid(column=0, pady=(15, 0), sticky='nswe')
@@ -437,6 +837,8 @@ class VelocitySectionFrame(ttk.Frame):
     def bind_model(self, model_manager):
         self.model_manager = model_manager
         self.section_x_tkvar.set(sum(self.model_manager.model.xlim)/2.0)
+        self.sweep_from_tkvar.set(self.model_manager.model.xlim[0])
+        self.sweep_to_tkvar.set(self.model_manager.model.xlim[1])
         self.update_plot()
         self.fig.canvas.draw()
 
@@ -446,12 +848,68 @@ class VelocitySectionFrame(ttk.Frame):
     def pois_unset(self):
         pass
 
-    def update_plot(self):
-        section_x = self.section_x_tkvar.get()
+    def get_plot_kwargs(self):
         deduct_layer = 1 if self.has_water_layer.get() else None
         ymin, ymax = self.ymin_tkvar.get(), self.ymax_tkvar.get()
         ylim = [ymin, ymax] if (ymin or ymax) else None
-        self.ploter.plot_sections(section_x, deduct_layer=deduct_layer, ylim=ylim)
+        return dict(deduct_layer=deduct_layer, ylim=ylim)
+
+    def update_plot(self):
+        if self.sweep_tkvar.get():
+            self.update_sweep()
+            return
+        section_x = self.section_x_tkvar.get()
+        self.ploter.plot_sections(section_x, **self.get_plot_kwargs())
+
+    def get_sweep_xs(self):
+        """Positions of the swept sections, inside the model"""
+        xmin, xmax = self.model_manager.model.xlim
+        start = max(self.sweep_from_tkvar.get(), xmin)
+        stop = min(self.sweep_to_tkvar.get(), xmax)
+        step = self.sweep_step_tkvar.get()
+        if not step > 0:
+            raise ValueError('Step of sweep must be positive.')
+        if stop < start:
+            raise ValueError('Nothing to sweep between %g and %g.' %(start, stop))
+        n = int(np.floor((stop - start) / step + 1e-9)) + 1
+        if n > self.MAX_SWEEP:
+            raise ValueError('Too many sections(%d) to sweep, the most is %d.' %(n, self.MAX_SWEEP))
+        return start + step * np.arange(n)
+
+    def update_sweep(self):
+        """Compute all the swept sections at once and plot them"""
+        try:
+            xs = self.get_sweep_xs()
+        except (ValueError, tk.TclError) as e:
+            messagebox.showerror('Error', str(e), parent=self.master)
+            return
+        n = self.ploter.compute_sweep(xs)
+        self.sweep_scale.configure(to=n-1)
+        self.sweep_index_tkvar.set(min(int(self.sweep_index_tkvar.get()), n-1))
+        self.draw_sweep()
+
+    def draw_sweep(self):
+        """Plot the swept sections already computed"""
+        if not self.sweep_tkvar.get() or self.ploter.sweep is None:
+            return
+        if self.sweep_mode_tkvar.get() == 'overlay':
+            self.ploter.plot_sweep_overlay(**self.get_plot_kwargs())
+        else:
+            self.sweep_index_changed()
+
+    def sweep_changed(self, event=None):
+        if self.sweep_tkvar.get():
+            self.update_sweep()
+
+    def sweep_index_changed(self, value=None):
+        """Step to another swept section, nothing is computed"""
+        if not self.sweep_tkvar.get() or self.ploter.sweep is None \
+                or self.sweep_mode_tkvar.get() != 'step':
+            return
+        xs = self.ploter.sweep[0]
+        i = int(np.clip(round(self.sweep_index_tkvar.get()), 0, len(xs)-1))
+        self.section_x_tkvar.set(round(float(xs[i]), 6))
+        self.ploter.plot_sweep_step(i, **self.get_plot_kwargs())
 
     def section_x_changed(self, event=None):
         xmin, xmax = self.model_manager.model.xlim
@@ -0,0 +1,138 @@
+"""Single pass reader of v.in files.
+
+A v.in file is a series of 3-line records:
+     2    0.000   0.940   1.450 ...     <- layer number, x of nodes
+     1    2.550   2.560   2.570 ...     <- continuation flag, value of nodes
+             0       0       0 ...     <- vary flags
+A part (depth, top velocity or bottom velocity of a layer) spans records up
+to the one whose continuation flag is 0, and every layer consists of 3
+parts. The file ends with a 2-line record: the depth of the last boundary.
+"""
+import re
+
+
+class VinSyntaxError(ValueError):
+    """Syntax error in v.in, located by line and column (both 1-based)."""
+    def __init__(self, msg, lineno, col):
+        super().__init__('line %d, column %d: %s' %(lineno, col, msg))
+        self.lineno = lineno
+        self.col = col
+
+
+class VinReader(object):
+    """Read records and parts from a stream of v.in lines (a file object, a
+    list of strings etc.) in a single pass, checking the structure on the
+    way."""
+    def __init__(self, stream):
+        self.stream = iter(stream)
+        self.lineno = 0
+        self.line = ''
+
+    def next_line(self):
+        """Get the next non-blank line, or None at the end of the stream."""
+        for line in self.stream:
+            self.lineno += 1
+            if line and not line.isspace():
+                self.line = line
+                return line
+        return None
+
+    def error(self, msg, itoken=None):
+        """Make a VinSyntaxError located at the i-th token of current line,
+        or at the end of the line if the token is missing."""
+        col = len(self.line.rstrip()) + 1
+        if itoken is not None:
+            for i, m in enumerate(re.finditer(r'\S+', self.line)):
+                if i == itoken:
+                    col = m.start() + 1
+                    break
+        return VinSyntaxError(msg, self.lineno, col)
+
+    def parse(self, tokens, conv, what, offset=0):
+        """Convert tokens of current line one by one, so that the invalid one
+        can be located. `offset` is the index of the first token in the line."""
+        values = []
+        for i, tok in enumerate(tokens):
+            try:
+                values.append(conv(tok))
+            except ValueError:
+                raise self.error('invalid %s %r' %(what, tok), offset+i)
+        return values
+
+    def records(self):
+        """Yield the records one by one as tuples
+            (lineno, col, ilayer, flag, x, y, vary),
+        where `col` is the column of the layer number. The 2-line record at
+        the end of a v.in file has no vary line, its `vary` is None."""
+        while True:
+            line = self.next_line()
+            if line is None:
+                return
+            lineno = self.lineno
+            col = len(line) - len(line.lstrip()) + 1
+            tokens = line.split()
+            try:
+                ilayer = int(tokens[0])
+                x = list(map(float, tokens[1:]))
+            except ValueError:
+                ilayer = self.parse(tokens[:1], int, 'layer number')[0]
+                x = self.parse(tokens[1:], float, 'x value', 1)
+            if not x:
+                raise self.error('expect x values after the layer number')
+
+            line = self.next_line()
+            if line is None:
+                raise self.error('unexpected end of file, expect a line of node values')
+            tokens = line.split()
+            try:
+                flag = int(tokens[0])
+                y = list(map(float, tokens[1:]))
+            except ValueError:
+                flag = self.parse(tokens[:1], int, 'continuation flag')[0]
+                y = self.parse(tokens[1:], float, 'node value', 1)
+            if flag not in (0, 1):
+                raise self.error('continuation flag should be 0 or 1, but %d got' %flag, 0)
+            if len(y) != len(x):
+                raise self.error('expect %d node values, but %d got' %(len(x), len(y)),
+                    min(len(x), len(y)) + 1)
+
+            line = self.next_line()
+            if line is None:
+                yield (lineno, col, ilayer, flag, x, y, None)
+                return
+            tokens = line.split()
+            try:
+                vary = list(map(int, tokens))
+            except ValueError:
+                vary = self.parse(tokens, int, 'vary flag')
+            if len(vary) != len(x):
+                raise self.error('expect %d vary flags, but %d got' %(len(x), len(vary)),
+                    min(len(x), len(vary)))
+            yield (lineno, col, ilayer, flag, x, y, vary)
+
+    def parts(self):
+        """Join records into parts by continuation flags, and yield the parts
+        as tuples (lineno, col, ilayer, x, y, vary), where `lineno` and `col`
+        locate the layer number of the first record of the part. `vary` is
+        None for the ending part of a v.in file."""
+        part = None
+        for lineno, col, ilayer, flag, x, y, vary in self.records():
+            if part is None:
+                part = [lineno, col, ilayer, x, y, vary]
+            else:
+                if ilayer != part[2]:
+                    raise VinSyntaxError(
+                        'layer number of a continued part should be %d, but %d got'
+                        %(part[2], ilayer), lineno, col)
+                if vary is None:
+                    raise VinSyntaxError('unexpected end of file inside a part', lineno, col)
+                part[3].extend(x)
+                part[4].extend(y)
+                part[5].extend(vary)
+            if flag == 0 or vary is None:
+                yield tuple(part)
+                part = None
+        if part is not None:
+            raise VinSyntaxError(
+                'unexpected end of file, the part starting here is continued',
+                part[0], part[1])
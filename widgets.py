@@ -0,0 +1,69 @@
+"""tkinter widgets of the GUI, kept out of `util` which the command line
+tools import without tkinter"""
+import tkinter as tk
+import tkinter.ttk as ttk
+
+
+class ScrollText(tk.Frame):
+    """Custom tkinter widget: ScrollText"""
+    def __init__(self, master, **kw):
+        super().__init__(master)
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+        self.text = tk.Text(self, **kw)
+        self.text.grid(row=0, column=0, sticky='nswe')
+        y_scroll = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.text.yview)
+        y_scroll.grid(row=0, column=1, sticky='ns')
+        self.text.config(yscrollcommand=y_scroll.set)
+
+    def get(self):
+        return self.text.get('1.0', tk.END)
+
+    def set(self, string):
+        self.text.config(state=tk.NORMAL)
+        self.text.delete('1.0', tk.END)
+        self.text.insert(tk.END, string)
+        self.text.config(state=tk.DISABLED)
+
+
+def create_label_entry(master, label_text, entry_var, callback, label_width=10, entry_width=16):
+    """create one-line label-entry widget"""
+    label_entry = ttk.Frame(master)
+    label_entry.columnconfigure(0, weight=1)
+    label_entry.grid(column=0, pady=(5, 0), sticky='nswe')
+    ttk.Label(label_entry, text=label_text, width=label_width).grid(row=0, column=0, sticky='nsw')
+    entry = ttk.Entry(label_entry, textvariable=entry_var, width=entry_width)
+    entry.grid(row=0, column=1, sticky='nswe')
+    entry.bind('<Return>', callback)
+    return label_entry
+
+
+class TextWindow(tk.Frame):
+    """A Window contains only a text widget, mainly for showing message"""
+    def __init__(self, text='', editable=True, title='untitled', geometry='1125x740+300+100'):
+        master = tk.Toplevel()
+        super().__init__(master)
+        self.master = master
+        self.text = text
+        self.editable = editable
+        self.title = title
+        self.geometry = geometry
+        self.create_widgets()
+
+    def create_widgets(self):
+        self.master.title(self.title)
+        self.master.geometry(self.geometry)
+        self.master.rowconfigure(0, weight=1)
+        self.master.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+        self.grid(pady=(2, 0), sticky='nswe')
+        text_widget = tk.Text(self, bd=0, font=('Consolas', 11))
+        text_widget.grid(row=0, column=0, sticky='nswe')
+        scrollbar = ttk.Scrollbar(self, command=text_widget.yview)
+        scrollbar.grid(row=0, column=1, sticky='nswe')
+        text_widget['yscrollcommand'] = scrollbar.set
+
+        text_widget.insert(tk.END, self.text)
+        if not self.editable:
+            text_widget.config(state=tk.DISABLED)